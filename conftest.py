@@ -0,0 +1,11 @@
+import pandas as pd
+import pytest
+
+
+# A small click log, for the click prior tests in week3/tests and week4/tests
+@pytest.fixture
+def clicks_df():
+    return pd.DataFrame({
+        "query": ["tv", "tv", "tv", "tv", "laptop", "laptop", "head phones", "ünïcode"],
+        "sku": [1, 1, 2, 3, 4, 4, 5, 6],
+    })
@@ -4,6 +4,16 @@ from flask import Flask
 from flask import render_template
 import pandas as pd
 
+import week2.utilities.query_utils as qu
+from week2.resources import Resources
+
+# The click prior query for each query, from utilities/build_priors.py or (slowly) straight from the clicks CSV
+def load_priors(prior_clicks_loc):
+    if prior_clicks_loc.endswith(".csv"):
+        return qu.create_prior_query_map(pd.read_csv(prior_clicks_loc))
+    return qu.load_prior_query_map(prior_clicks_loc)
+
+
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__, instance_relative_config=True)
@@ -11,18 +21,41 @@ def create_app(test_config=None):
     if test_config is None:
         # load the instance config, if it exists, when not testing
         app.config.from_envvar('LTR_APPLICATION_SETTINGS', silent=True)
-        PRIOR_CLICKS_LOC = os.environ.get("PRIOR_CLICKS_LOC", "/workspace/ltr_output/train.csv")
-        print("PRIOR CLICKS: %s" % PRIOR_CLICKS_LOC)
-        if PRIOR_CLICKS_LOC and os.path.isfile(PRIOR_CLICKS_LOC):
-            priors = pd.read_csv(PRIOR_CLICKS_LOC)
-            priors_gb = priors.groupby("query")
-            app.config["priors_df"] = priors
-            app.config["priors_gb"] = priors_gb
         #print(app.config)
     else:
         # load the test config if passed in
         app.config.from_mapping(test_config)
 
+    # OpenSearch connection settings.  Set them in the instance config or the environment.
+    # The client itself is created once per process in opensearch.get_opensearch
+    app.config.setdefault("OPENSEARCH_HOST", os.environ.get("OPENSEARCH_HOST", "localhost"))
+    app.config.setdefault("OPENSEARCH_PORT", int(os.environ.get("OPENSEARCH_PORT", 9200)))
+    app.config.setdefault("OPENSEARCH_USER", os.environ.get("OPENSEARCH_USER", "admin"))
+    app.config.setdefault("OPENSEARCH_PASSWORD", os.environ.get("OPENSEARCH_PASSWORD", "admin"))
+    app.config.setdefault("OPENSEARCH_USE_SSL", os.environ.get("OPENSEARCH_USE_SSL", "true").lower() == "true")
+    app.config.setdefault("OPENSEARCH_VERIFY_CERTS", os.environ.get("OPENSEARCH_VERIFY_CERTS", "false").lower() == "true")
+    app.config.setdefault("OPENSEARCH_POOL_MAXSIZE", int(os.environ.get("OPENSEARCH_POOL_MAXSIZE", 10)))
+    app.config.setdefault("OPENSEARCH_TIMEOUT", float(os.environ.get("OPENSEARCH_TIMEOUT", 10)))
+    app.config.setdefault("OPENSEARCH_MAX_RETRIES", int(os.environ.get("OPENSEARCH_MAX_RETRIES", 3)))
+    app.config.setdefault("OPENSEARCH_RETRY_ON_TIMEOUT", os.environ.get("OPENSEARCH_RETRY_ON_TIMEOUT", "false").lower() == "true")
+
+    # The priors load in the background (see resources.py), check /ready to see when they're done.
+    # Set LOAD_RESOURCES_IN_BACKGROUND=false to load them before create_app returns.
+    app.config.setdefault("LOAD_RESOURCES_IN_BACKGROUND", os.environ.get("LOAD_RESOURCES_IN_BACKGROUND", "true").lower() == "true")
+    resources = app.config["resources"] = Resources(background=app.config["LOAD_RESOURCES_IN_BACKGROUND"])
+    if test_config is None:
+        # Prefer the priors precomputed by utilities/build_priors.py, they load much faster than the clicks CSV
+        PRIOR_CLICKS_LOC = os.environ.get("PRIOR_CLICKS_LOC")
+        if not PRIOR_CLICKS_LOC:
+            PRIOR_CLICKS_LOC = "/workspace/ltr_output/priors.pkl"
+            if not os.path.isfile(PRIOR_CLICKS_LOC):
+                PRIOR_CLICKS_LOC = "/workspace/ltr_output/train.csv"
+        print("PRIOR CLICKS: %s" % PRIOR_CLICKS_LOC)
+        if PRIOR_CLICKS_LOC and os.path.isfile(PRIOR_CLICKS_LOC):
+            resources.load(app, "prior_clicks", lambda: {"prior_query_map": load_priors(PRIOR_CLICKS_LOC)})
+        else:
+            print("No prior clicks to load.  This may effect quality. Run ltr-end-to-end.sh per week 2 if you want")
+
     # ensure the instance folder exists
     try:
         os.makedirs(app.instance_path)
@@ -36,6 +69,8 @@ def create_app(test_config=None):
 
     from . import search
     app.register_blueprint(search.bp)
+    from . import resources
+    app.register_blueprint(resources.bp)
     app.add_url_rule('/', view_func=search.query)
 
     return app
@@ -146,21 +146,10 @@ def query():
 
 def get_click_prior(user_query):
     click_prior = ""
-    if current_app.config.get("priors_gb"):
-        try:
-            prior_doc_ids = None
-            prior_doc_id_weights = None
-            query_times_seen = 0  # careful here
-            prior_clicks_for_query = None
-            prior_clicks_for_query = current_app.config["priors_gb"].get_group(user_query)
-            if prior_clicks_for_query is not None and len(prior_clicks_for_query) > 0:
-                prior_doc_ids = prior_clicks_for_query.sku.drop_duplicates()
-                prior_doc_id_weights = prior_clicks_for_query.sku.value_counts()  # histogram gives us the click counts for all the doc_ids
-                query_times_seen = prior_clicks_for_query.sku.count()
-                click_prior = qu.create_prior_queries(prior_doc_ids, prior_doc_id_weights, query_times_seen)
-        except KeyError as ke:
-            pass
-            # nothing to do here, we just haven't seen this query before in our training set
+    prior_query_map = current_app.config.get("prior_query_map")
+    if prior_query_map is not None:
+        # empty if we haven't seen this query before in our training set
+        click_prior = prior_query_map.get(user_query, "")
     print("prior: %s" % click_prior)
     return click_prior
 
@@ -0,0 +1,21 @@
+####
+#
+#  Precompute the click priors for the search app from the LTR training clicks and save them in the binary form that
+#  query_utils.load_prior_query_map reads, so the app doesn't have to read and group the CSV every time it starts.
+#
+###
+import argparse
+
+import pandas as pd
+import query_utils as qu
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build the click priors for the search app.')
+    general = parser.add_argument_group("general")
+    general.add_argument("--input", default="/workspace/ltr_output/train.csv", help="The click CSV to build the priors from")
+    general.add_argument("--output", default="/workspace/ltr_output/priors.pkl", help="Where to write the priors.  Point PRIOR_CLICKS_LOC at it.")
+    args = parser.parse_args()
+
+    prior_query_map = qu.create_prior_query_map(pd.read_csv(args.input))
+    qu.save_prior_query_map(prior_query_map, args.output)
+    print("Saved priors for %s queries to %s" % (len(prior_query_map), args.output))
@@ -1,4 +1,5 @@
 import math
+import pickle
 # some helpful tools for dealing with queries
 def create_stats_query(aggs, extended=True):
     print("Creating stats query from %s" % aggs)
@@ -40,6 +41,29 @@ def create_prior_queries(doc_ids, doc_id_weights, query_times_seen): # total imp
 
 
 
+# The click prior query for every query in the clicks, precomputed with create_prior_queries exactly as
+# search.get_click_prior used to do it per request.  Returns query -> click prior query
+def create_prior_query_map(clicks_df):
+    prior_query_map = {}
+    for query, prior_clicks_for_query in clicks_df.groupby("query"):
+        prior_doc_ids = prior_clicks_for_query.sku.drop_duplicates()
+        prior_doc_id_weights = prior_clicks_for_query.sku.value_counts()  # histogram gives us the click counts for all the doc_ids
+        query_times_seen = prior_clicks_for_query.sku.count()
+        prior_query_map[query] = create_prior_queries(prior_doc_ids, prior_doc_id_weights, query_times_seen)
+    return prior_query_map
+
+
+# Save the prior query map (see utilities/build_priors.py) so the app can load it instead of grouping the clicks CSV
+def save_prior_query_map(prior_query_map, path):
+    with open(path, "wb") as output:
+        pickle.dump(prior_query_map, output, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_prior_query_map(path):
+    with open(path, "rb") as input:
+        return pickle.load(input)
+
+
 def create_simple_baseline(user_query, click_prior_query, filters, sort="_score", sortDir="desc", size=10, include_aggs=True, highlight=True, source=None):
 
     query_obj = {
@@ -1,3 +1,4 @@
+import gc
 import os
 
 from flask import Flask
@@ -6,6 +7,19 @@ import pandas as pd
 import fasttext
 from pathlib import Path
 
+import week3.utilities.query_utils as qu
+from week3.resources import Resources
+
+# The click prior query for each query, from utilities/build_priors.py or (slowly) straight from the clicks CSV.  The
+# directory build_priors.py writes by default is memory mapped (see query_utils.PriorFile), so the workers share it.
+def load_priors(prior_clicks_loc):
+    if prior_clicks_loc.endswith(".csv"):
+        return qu.create_prior_query_map(pd.read_csv(prior_clicks_loc))
+    if os.path.isdir(prior_clicks_loc):
+        return qu.PriorFile(prior_clicks_loc)
+    return qu.load_prior_query_map(prior_clicks_loc)
+
+
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__, instance_relative_config=True)
@@ -13,26 +27,71 @@ def create_app(test_config=None):
     if test_config is None:
         # load the instance config, if it exists, when not testing
         app.config.from_envvar('LTR_APPLICATION_SETTINGS', silent=True)
-        PRIOR_CLICKS_LOC = os.environ.get("PRIOR_CLICKS_LOC", "/workspace/ltr_output/train.csv")
+        #print(app.config)
+        app.config["index_name"] = os.environ.get("INDEX_NAME", "bbuy_annotations")
+    else:
+        # load the test config if passed in
+        app.config.from_mapping(test_config)
+
+    # OpenSearch connection settings.  Set them in the instance config or the environment.
+    # The client itself is created once per process in opensearch.get_opensearch
+    app.config.setdefault("OPENSEARCH_HOST", os.environ.get("OPENSEARCH_HOST", "localhost"))
+    app.config.setdefault("OPENSEARCH_PORT", int(os.environ.get("OPENSEARCH_PORT", 9200)))
+    app.config.setdefault("OPENSEARCH_USER", os.environ.get("OPENSEARCH_USER", "admin"))
+    app.config.setdefault("OPENSEARCH_PASSWORD", os.environ.get("OPENSEARCH_PASSWORD", "admin"))
+    app.config.setdefault("OPENSEARCH_USE_SSL", os.environ.get("OPENSEARCH_USE_SSL", "true").lower() == "true")
+    app.config.setdefault("OPENSEARCH_VERIFY_CERTS", os.environ.get("OPENSEARCH_VERIFY_CERTS", "false").lower() == "true")
+    app.config.setdefault("OPENSEARCH_POOL_MAXSIZE", int(os.environ.get("OPENSEARCH_POOL_MAXSIZE", 10)))
+    app.config.setdefault("OPENSEARCH_TIMEOUT", float(os.environ.get("OPENSEARCH_TIMEOUT", 10)))
+    app.config.setdefault("OPENSEARCH_MAX_RETRIES", int(os.environ.get("OPENSEARCH_MAX_RETRIES", 3)))
+    app.config.setdefault("OPENSEARCH_RETRY_ON_TIMEOUT", os.environ.get("OPENSEARCH_RETRY_ON_TIMEOUT", "false").lower() == "true")
+
+    # Query time synonym expansion, from the table utilities/build_synonyms.py precomputes from the synonym model.  Each
+    # word adds at most SYNONYM_MAX_PER_WORD neighbors that are at least SYNONYM_MIN_SIMILARITY similar, and a query
+    # adds at most SYNONYM_MAX_CLAUSES in all.  Set EXPAND_SYNONYMS=false to turn it off.
+    app.config.setdefault("EXPAND_SYNONYMS", os.environ.get("EXPAND_SYNONYMS", "true").lower() == "true")
+    app.config.setdefault("SYNONYM_MIN_SIMILARITY", float(os.environ.get("SYNONYM_MIN_SIMILARITY", 0.8)))
+    app.config.setdefault("SYNONYM_MAX_PER_WORD", int(os.environ.get("SYNONYM_MAX_PER_WORD", 2)))
+    app.config.setdefault("SYNONYM_MAX_CLAUSES", int(os.environ.get("SYNONYM_MAX_CLAUSES", 6)))
+    app.config.setdefault("SYNONYM_BOOST", float(os.environ.get("SYNONYM_BOOST", 1.0)))
+
+    # The priors and the synonym model load in the background (see resources.py), check /ready to see when they're done.
+    # Set LOAD_RESOURCES_IN_BACKGROUND=false to load them before create_app returns.
+    # With PRELOAD_MODELS=true they load before create_app returns and everything loaded so far is moved out of the
+    # garbage collector's reach (gc.freeze), so a pre-forking server that creates the app before forking, e.g.
+    #   PRELOAD_MODELS=true gunicorn --preload -w 4 'week3:create_app()'
+    # shares one copy of the fastText models between its workers: pages are only copied for a worker that writes to them,
+    # and the collector would otherwise write to every object it visits.
+    app.config.setdefault("PRELOAD_MODELS", os.environ.get("PRELOAD_MODELS", "false").lower() == "true")
+    app.config.setdefault("LOAD_RESOURCES_IN_BACKGROUND", os.environ.get("LOAD_RESOURCES_IN_BACKGROUND", "true").lower() == "true"
+                          and not app.config["PRELOAD_MODELS"])
+    resources = app.config["resources"] = Resources(background=app.config["LOAD_RESOURCES_IN_BACKGROUND"])
+    if test_config is None:
+        # Prefer the priors precomputed by utilities/build_priors.py, they load much faster than the clicks CSV
+        PRIOR_CLICKS_LOC = os.environ.get("PRIOR_CLICKS_LOC")
+        if not PRIOR_CLICKS_LOC:
+            for PRIOR_CLICKS_LOC in ["/workspace/ltr_output/priors", "/workspace/ltr_output/priors.pkl", "/workspace/ltr_output/train.csv"]:
+                if os.path.exists(PRIOR_CLICKS_LOC):
+                    break
         print("PRIOR CLICKS: %s" % PRIOR_CLICKS_LOC)
-        if PRIOR_CLICKS_LOC and os.path.isfile(PRIOR_CLICKS_LOC):
-            priors = pd.read_csv(PRIOR_CLICKS_LOC)
-            priors_gb = priors.groupby("query")
-            app.config["priors_df"] = priors
-            app.config["priors_gb"] = priors_gb
+        if PRIOR_CLICKS_LOC and os.path.exists(PRIOR_CLICKS_LOC):
+            resources.load(app, "prior_clicks", lambda: {"prior_query_map": load_priors(PRIOR_CLICKS_LOC)})
         else:
             print("No prior clicks to load.  This may effect quality. Run ltr-end-to-end.sh per week 2 if you want")
-        #print(app.config)
         SYNS_MODEL_LOC = os.environ.get("SYNONYMS_MODEL_LOC", "/workspace/datasets/fasttext/syns_model.bin")
         print("SYNS_MODEL_LOC: %s" % SYNS_MODEL_LOC)
         if SYNS_MODEL_LOC and os.path.isfile(SYNS_MODEL_LOC):
-            app.config["syns_model"] = fasttext.load_model(SYNS_MODEL_LOC)
+            resources.load(app, "syns_model", lambda: {"syns_model": fasttext.load_model(SYNS_MODEL_LOC)})
         else:
             print("No synonym model found.  Have you run fasttext?")
-        app.config["index_name"] = os.environ.get("INDEX_NAME", "bbuy_annotations")
-    else:
-        # load the test config if passed in
-        app.config.from_mapping(test_config)
+        SYNONYMS_TABLE_LOC = os.environ.get("SYNONYMS_TABLE_LOC", "/workspace/datasets/fasttext/synonyms.tsv")
+        print("SYNONYMS_TABLE_LOC: %s" % SYNONYMS_TABLE_LOC)
+        if app.config["EXPAND_SYNONYMS"] and SYNONYMS_TABLE_LOC and os.path.isfile(SYNONYMS_TABLE_LOC):
+            resources.load(app, "synonym_table", lambda: {
+                "synonym_table": qu.load_synonym_table(SYNONYMS_TABLE_LOC, min_similarity=app.config["SYNONYM_MIN_SIMILARITY"])
+            })
+        elif app.config["EXPAND_SYNONYMS"]:
+            print("No synonym table found.  Run utilities/build_synonyms.py to expand queries with synonyms")
 
     # ensure the instance folder exists
     try:
@@ -49,8 +108,13 @@ def create_app(test_config=None):
 
     from . import search
     app.register_blueprint(search.bp)
+    from . import resources
+    app.register_blueprint(resources.bp)
     from . import documents
     app.register_blueprint(documents.bp)
     app.add_url_rule('/', view_func=search.query)
 
+    if app.config["PRELOAD_MODELS"]:
+        gc.collect()
+        gc.freeze()
     return app
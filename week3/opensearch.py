@@ -1,25 +1,46 @@
-from flask import g, current_app
+import threading
+
+from flask import current_app
 from opensearchpy import OpenSearch
 
-# Create an OpenSearch client instance and put it into Flask shared space for use by the application
-def get_opensearch():
-    if 'opensearch' not in g:
-        # Load from config?
-        host = 'localhost'
-        port = 9200
-        auth = ('admin', 'admin')  # For testing only. Don't store credentials in code.
+# One client per process.  The client owns a urllib3 connection pool, so sharing it across requests means we only pay
+# for the TLS handshake when the pool grows, instead of on every request.
+_opensearch = None
+_opensearch_lock = threading.Lock()
+
 
-        g.opensearch = OpenSearch(
-            hosts=[{'host': host, 'port': port}],
-            http_compress=True,  # enables gzip compression for request bodies
-            http_auth=auth,
-            # client_cert = client_cert_path,
-            # client_key = client_key_path,
-            use_ssl=True,
-            verify_certs=False, # set to true if you have certs
-            ssl_assert_hostname=False,
-            ssl_show_warn=False,
+# Build an OpenSearch client from the app config.  See create_app for the OPENSEARCH_* settings and their defaults.
+def create_opensearch(config):
+    host = config.get("OPENSEARCH_HOST", "localhost")
+    port = int(config.get("OPENSEARCH_PORT", 9200))
+    auth = (config.get("OPENSEARCH_USER", "admin"), config.get("OPENSEARCH_PASSWORD", "admin"))  # For testing only. Set these in config.py or the environment.
 
-        )
+    return OpenSearch(
+        hosts=[{'host': host, 'port': port}],
+        http_compress=True,  # enables gzip compression for request bodies
+        http_auth=auth,
+        # client_cert = client_cert_path,
+        # client_key = client_key_path,
+        use_ssl=config.get("OPENSEARCH_USE_SSL", True),
+        verify_certs=config.get("OPENSEARCH_VERIFY_CERTS", False), # set to true if you have certs
+        ssl_assert_hostname=False,
+        ssl_show_warn=False,
+        pool_maxsize=int(config.get("OPENSEARCH_POOL_MAXSIZE", 10)),  # should be >= the number of threads per worker
+        headers={"Connection": "keep-alive"},
+        timeout=float(config.get("OPENSEARCH_TIMEOUT", 10)),
+        # Retries are for connection errors.  Retrying a timed out search would wait OPENSEARCH_TIMEOUT all over again,
+        # long after the user gave up on it.
+        max_retries=int(config.get("OPENSEARCH_MAX_RETRIES", 3)),
+        retry_on_timeout=config.get("OPENSEARCH_RETRY_ON_TIMEOUT", False),
+    )
 
-    return g.opensearch
+
+# Get the process-wide OpenSearch client, creating it on first use.  We create it lazily rather than in create_app so
+# that a pre-forking server (e.g. gunicorn) gives each worker its own pool instead of sharing sockets across processes.
+def get_opensearch():
+    global _opensearch
+    if _opensearch is None:
+        with _opensearch_lock:
+            if _opensearch is None:
+                _opensearch = create_opensearch(current_app.config)
+    return _opensearch
@@ -0,0 +1,91 @@
+#
+# Loads the app's heavy resources (the prior clicks, the fastText models) in the background, so a worker can start
+# serving as soon as it is up instead of after everything has loaded.  Until a resource has loaded, the code that uses it
+# sees it as missing, the same as if its file didn't exist (e.g. we search without click priors).
+#
+# /ready reports the state and load time of each resource and returns a 503 until they have all finished loading, so a
+# load balancer or a rolling restart can wait for it before sending the worker traffic.
+#
+# Threads don't survive a fork, so if a pre-forking server (e.g. gunicorn --preload) forks its workers while something
+# is still loading, each worker starts loading it again.
+#
+import os
+import threading
+import time
+import traceback
+import weakref
+
+from flask import Blueprint, current_app, jsonify
+
+PENDING = "pending"
+LOADING = "loading"
+LOADED = "loaded"
+FAILED = "failed"
+
+bp = Blueprint('resources', __name__)
+
+
+class Resources:
+
+    def __init__(self, background=True) -> None:
+        self.background = background
+        self.resources = {}  # name -> {"state", "seconds", "error"}
+        self._loaders = {}  # name -> (app, loader), so we can start over after a fork
+        self._lock = threading.Lock()
+        if background:
+            resources = weakref.ref(self)  # don't keep the app alive just for the fork hook
+            os.register_at_fork(after_in_child=lambda: resources() is not None and resources()._after_fork())
+
+    # Run loader() and put what it returns (a dict of config key -> value) into the app config.  In the background unless
+    # we were created with background=False, in which case it has loaded (or failed) by the time this returns.
+    def load(self, app, name, loader):
+        with self._lock:
+            self.resources[name] = {"state": PENDING, "seconds": None, "error": None}
+            self._loaders[name] = (app, loader)
+        if self.background:
+            threading.Thread(target=self._load, args=(app, name, loader), name="load-%s" % name, daemon=True).start()
+        else:
+            self._load(app, name, loader)
+
+    # Ready once nothing is still loading.  A resource that failed to load doesn't stop us serving, same as a missing one.
+    def ready(self):
+        with self._lock:
+            return all(resource["state"] in (LOADED, FAILED) for resource in self.resources.values())
+
+    def status(self):
+        with self._lock:
+            return {name: dict(resource) for name, resource in self.resources.items()}
+
+    def _load(self, app, name, loader):
+        self._set(name, state=LOADING)
+        start = time.perf_counter()
+        try:
+            values = loader()
+            app.config.update(values)
+            self._set(name, state=LOADED, seconds=time.perf_counter() - start)
+            print("Loaded %s in %.2f seconds" % (name, time.perf_counter() - start))
+        except Exception as e:
+            traceback.print_exc()
+            self._set(name, state=FAILED, seconds=time.perf_counter() - start, error=str(e))
+
+    # In a freshly forked child, where the threads that were loading in the parent no longer exist
+    def _after_fork(self):
+        self._lock = threading.Lock()  # another thread may have held it when we forked
+        for name, resource in self.resources.items():
+            if resource["state"] in (PENDING, LOADING):
+                resource["state"] = PENDING
+                (app, loader) = self._loaders[name]
+                threading.Thread(target=self._load, args=(app, name, loader), name="load-%s" % name, daemon=True).start()
+
+    def _set(self, name, **values):
+        with self._lock:
+            self.resources[name].update(values)
+
+
+@bp.route('/ready')
+def ready():
+    resources = current_app.config.get("resources")
+    if resources is None:
+        return jsonify({"ready": True, "resources": {}})
+    is_ready = resources.ready()
+    return jsonify({"ready": is_ready, "resources": resources.status()}), 200 if is_ready else 503
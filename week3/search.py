@@ -70,6 +70,7 @@ def query():
     sort = "_score"
     sortDir = "desc"
     model = "simple"
+    synonym_boost = current_app.config.get("SYNONYM_BOOST", 1.0)
     # TODO: Make these parameters
     ltr_store_name = "week2"
     ltr_model_name = "ltr_model"
@@ -89,22 +90,23 @@ def query():
             explain = True
         model = request.form.get("model", "simple")
         click_prior = get_click_prior(user_query)
+        synonyms = get_synonyms(user_query)
 
         if model == "simple_LTR":
-            query_obj = qu.create_simple_baseline(user_query, click_prior, [], sort, sortDir, size=500)  # We moved create_query to a utility class so we could use it elsewhere.
+            query_obj = qu.create_simple_baseline(user_query, click_prior, [], sort, sortDir, size=500, synonyms=synonyms, synonym_boost=synonym_boost)  # We moved create_query to a utility class so we could use it elsewhere.
             query_obj = lu.create_rescore_ltr_query(user_query, query_obj, click_prior, ltr_model_name, ltr_store_name,
                                                     rescore_size=500, main_query_weight=0)
             print("Simple LTR q: %s" % query_obj)
         elif model == "ht_LTR":
-            query_obj = qu.create_query(user_query, click_prior, [], sort, sortDir, size=500)  # We moved create_query to a utility class so we could use it elsewhere.
+            query_obj = qu.create_query(user_query, click_prior, [], sort, sortDir, size=500, synonyms=synonyms, synonym_boost=synonym_boost)  # We moved create_query to a utility class so we could use it elsewhere.
             query_obj = lu.create_rescore_ltr_query(user_query, query_obj, click_prior, ltr_model_name, ltr_store_name,
                                                     rescore_size=500, main_query_weight=0)
             print("LTR q: %s" % query_obj)
         elif model == "hand_tuned":
-            query_obj = qu.create_query(user_query, click_prior, [], sort, sortDir, size=100)  # We moved create_query to a utility class so we could use it elsewhere.
+            query_obj = qu.create_query(user_query, click_prior, [], sort, sortDir, size=100, synonyms=synonyms, synonym_boost=synonym_boost)  # We moved create_query to a utility class so we could use it elsewhere.
             print("Hand tuned q: %s" % query_obj)
         else:
-            query_obj = qu.create_simple_baseline(user_query, click_prior, [], sort, sortDir, size=100)  # We moved create_query to a utility class so we could use it elsewhere.
+            query_obj = qu.create_simple_baseline(user_query, click_prior, [], sort, sortDir, size=100, synonyms=synonyms, synonym_boost=synonym_boost)  # We moved create_query to a utility class so we could use it elsewhere.
             print("Plain ol q: %s" % query_obj)
     elif request.method == 'GET':  # Handle the case where there is no query or just loading the page
         user_query = request.args.get("query", "*")
@@ -113,21 +115,22 @@ def query():
         sortDir = request.args.get("sortDir", sortDir)
         explain_val = request.args.get("explain", "false")
         click_prior = get_click_prior(user_query)
+        synonyms = get_synonyms(user_query)
         if explain_val == "true":
             explain = True
         if filters_input:
             (filters, display_filters, applied_filters) = process_filters(filters_input)
         model = request.args.get("model", "simiple")
         if model == "simple_LTR":
-            query_obj = qu.create_simple_baseline(user_query, click_prior, filters, sort, sortDir, size=500)
+            query_obj = qu.create_simple_baseline(user_query, click_prior, filters, sort, sortDir, size=500, synonyms=synonyms, synonym_boost=synonym_boost)
             query_obj = lu.create_rescore_ltr_query(user_query, query_obj, click_prior, ltr_model_name, ltr_store_name, rescore_size=500)
         elif model == "ht_LTR":
-            query_obj = qu.create_query(user_query, click_prior, filters, sort, sortDir, size=100)
+            query_obj = qu.create_query(user_query, click_prior, filters, sort, sortDir, size=100, synonyms=synonyms, synonym_boost=synonym_boost)
             query_obj = lu.create_rescore_ltr_query(user_query, query_obj, click_prior, ltr_model_name, ltr_store_name, rescore_size=100)
         elif model == "hand_tuned":
-            query_obj = qu.create_query(user_query, click_prior, filters, sort, sortDir, size=100)
+            query_obj = qu.create_query(user_query, click_prior, filters, sort, sortDir, size=100, synonyms=synonyms, synonym_boost=synonym_boost)
         else:
-            query_obj = qu.create_simple_baseline(user_query, click_prior, filters, sort, sortDir, size=100)
+            query_obj = qu.create_simple_baseline(user_query, click_prior, filters, sort, sortDir, size=100, synonyms=synonyms, synonym_boost=synonym_boost)
     else:
         query_obj = qu.create_query("*", "", [], sort, sortDir, size=100)
 
@@ -146,22 +149,21 @@ def query():
 
 def get_click_prior(user_query):
     click_prior = ""
-    if current_app.config.get("priors_gb"):
-        try:
-            prior_doc_ids = None
-            prior_doc_id_weights = None
-            query_times_seen = 0  # careful here
-            prior_clicks_for_query = None
-            prior_clicks_for_query = current_app.config["priors_gb"].get_group(user_query)
-            if prior_clicks_for_query is not None and len(prior_clicks_for_query) > 0:
-                prior_doc_ids = prior_clicks_for_query.sku.drop_duplicates()
-                prior_doc_id_weights = prior_clicks_for_query.sku.value_counts()  # histogram gives us the click counts for all the doc_ids
-                query_times_seen = prior_clicks_for_query.sku.count()
-                click_prior = qu.create_prior_queries(prior_doc_ids, prior_doc_id_weights, query_times_seen)
-        except KeyError as ke:
-            pass
-            # nothing to do here, we just haven't seen this query before in our training set
+    prior_query_map = current_app.config.get("prior_query_map")
+    if prior_query_map is not None:
+        # empty if we haven't seen this query before in our training set
+        click_prior = prior_query_map.get(user_query, "")
     print("prior: %s" % click_prior)
     return click_prior
 
 
+# The synonyms to expand the query with, from the precomputed table (see utilities/build_synonyms.py), or None if we
+# don't have a table
+def get_synonyms(user_query):
+    synonym_table = current_app.config.get("synonym_table")
+    if synonym_table is None or user_query == "*" or user_query == "#":
+        return None
+    synonyms = qu.expand_synonyms(user_query, synonym_table, max_per_word=current_app.config["SYNONYM_MAX_PER_WORD"],
+                                  max_clauses=current_app.config["SYNONYM_MAX_CLAUSES"])
+    print("synonyms: %s" % synonyms)
+    return synonyms
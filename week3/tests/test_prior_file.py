@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+
+import week3.utilities.query_utils as qu
+
+
+def test_hash_query_is_stable():
+    assert qu.hash_query("tv") == qu.hash_query("tv")
+    assert qu.hash_query("tv") != qu.hash_query("tv ")
+    assert 0 <= qu.hash_query("tv") < 2 ** 64
+
+
+def test_prior_file_matches_the_prior_query_map(clicks_df, tmp_path):
+    path = str(tmp_path / "priors")
+    assert qu.PriorFile.write(clicks_df, path) == 4
+    prior_file = qu.PriorFile(path)
+    prior_query_map = qu.create_prior_query_map(clicks_df)
+    assert len(prior_file) == len(prior_query_map)
+    for query, click_prior_query in prior_query_map.items():
+        assert query in prior_file
+        assert prior_file.get(query) == click_prior_query
+    assert "unseen" not in prior_file
+    assert prior_file.get("unseen", "") == ""
+
+
+def test_get_priors(clicks_df, tmp_path):
+    path = str(tmp_path / "priors")
+    qu.PriorFile.write(clicks_df, path)
+    prior_file = qu.PriorFile(path)
+    (skus, weights) = prior_file.get_priors("tv")
+    assert list(skus) == ["1", "2", "3"]
+    np.testing.assert_allclose(weights, [0.5, 0.25, 0.25])
+    assert prior_file.get_priors("unseen") == (None, None)
+
+
+def test_empty_prior_file(tmp_path):
+    path = str(tmp_path / "priors")
+    qu.PriorFile.write(pd.DataFrame({"query": [], "sku": []}), path)
+    prior_file = qu.PriorFile(path)
+    assert len(prior_file) == 0
+    assert prior_file.get("tv") is None
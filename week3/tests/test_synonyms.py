@@ -0,0 +1,48 @@
+import week3.utilities.query_utils as qu
+
+TABLE = {
+    "tv": [("television", 0.95), ("hdtv", 0.9), ("flatscreen", 0.85)],
+    "laptop": [("notebook", 0.92), ("tv", 0.8)],
+}
+
+
+def test_save_and_load_round_trip(tmp_path):
+    path = str(tmp_path / "synonyms.tsv")
+    qu.save_synonym_table(TABLE, path)
+    assert qu.load_synonym_table(path) == TABLE
+
+
+def test_load_drops_dissimilar_neighbors(tmp_path):
+    path = str(tmp_path / "synonyms.tsv")
+    qu.save_synonym_table(dict(TABLE, cable=[("wire", 0.5)]), path)
+    table = qu.load_synonym_table(path, min_similarity=0.9)
+    assert table == {"tv": [("television", 0.95), ("hdtv", 0.9)], "laptop": [("notebook", 0.92)]}
+
+
+def test_expand_synonyms_limits_and_orders():
+    assert qu.expand_synonyms("TV", TABLE, max_per_word=2) == [("television", 0.95), ("hdtv", 0.9)]
+    assert qu.expand_synonyms("tv laptop", TABLE, max_per_word=2, max_clauses=3) == [
+        ("television", 0.95), ("notebook", 0.92), ("hdtv", 0.9)]
+    assert qu.expand_synonyms("radio", TABLE) == []
+
+
+def test_expand_synonyms_skips_words_in_the_query():
+    assert qu.expand_synonyms("laptop tv", TABLE, max_per_word=2) == [
+        ("television", 0.95), ("notebook", 0.92), ("hdtv", 0.9)]
+
+
+# Every dict in the query
+def walk(obj):
+    if isinstance(obj, dict):
+        yield obj
+        obj = list(obj.values())
+    if isinstance(obj, list):
+        for value in obj:
+            yield from walk(value)
+
+
+def test_synonym_clauses_are_boosted_by_similarity():
+    for create in [qu.create_query, qu.create_simple_baseline]:
+        query_obj = create("tv", "", [], synonyms=[("television", 0.95)], synonym_boost=2.0)
+        assert {"match": {"name": {"query": "television", "boost": 1.9}}} in list(walk(query_obj))
+        assert create("tv", "", []) == create("tv", "", [], synonyms=[])
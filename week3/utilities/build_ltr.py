@@ -35,6 +35,8 @@ if __name__ == "__main__":
                          help='The OpenSearch host name')
     general.add_argument("-p", '--port', type=int, default=9200,
                          help='The OpenSearch port')
+    general.add_argument('--no_ssl', action="store_true",
+                         help='Connect over plain HTTP, e.g. to week4/utilities/opensearch_standin.py')
     general.add_argument('--user',
                          help='The OpenSearch admin.  If this is set, the program will prompt for password too. If not set, use default of admin/admin')
     general.add_argument("-l", '--ltr_store', default="week3",
@@ -155,14 +157,14 @@ if __name__ == "__main__":
         password = getpass()
         auth = (args.user, password)
 
-    base_url = "https://{}:{}/".format(host, port)
+    base_url = "{}://{}:{}/".format("http" if args.no_ssl else "https", host, port)
     opensearch = OpenSearch(
         hosts=[{'host': host, 'port': port}],
         http_compress=True,  # enables gzip compression for request bodies
         http_auth=auth,
         # client_cert = client_cert_path,
         # client_key = client_key_path,
-        use_ssl=True,
+        use_ssl=not args.no_ssl,
         verify_certs=False,  # set to true if you have certs
         ssl_assert_hostname=False,
         ssl_show_warn=False,
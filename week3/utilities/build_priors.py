@@ -0,0 +1,29 @@
+####
+#
+#  Precompute the click priors for the search app from the LTR training clicks, so the app doesn't have to read and group
+#  the CSV every time it starts.  By default they are written as a directory of flat arrays that the app's workers memory
+#  map and share (see query_utils.PriorFile).  --format pickle writes the dict query_utils.load_prior_query_map reads.
+#
+###
+import argparse
+
+import pandas as pd
+import query_utils as qu
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build the click priors for the search app.')
+    general = parser.add_argument_group("general")
+    general.add_argument("--input", default="/workspace/ltr_output/train.csv", help="The click CSV to build the priors from")
+    general.add_argument("--output", help="Where to write the priors (default /workspace/ltr_output/priors, or priors.pkl with --format pickle).  Point PRIOR_CLICKS_LOC at it.")
+    general.add_argument("--format", choices=["mmap", "pickle"], default="mmap", help="mmap for a directory of arrays the workers share, pickle for a dict")
+    args = parser.parse_args()
+
+    if args.format == "mmap":
+        output = args.output or "/workspace/ltr_output/priors"
+        num_queries = qu.PriorFile.write(pd.read_csv(args.input), output)
+    else:
+        output = args.output or "/workspace/ltr_output/priors.pkl"
+        prior_query_map = qu.create_prior_query_map(pd.read_csv(args.input))
+        qu.save_prior_query_map(prior_query_map, output)
+        num_queries = len(prior_query_map)
+    print("Saved priors for %s queries to %s" % (num_queries, output))
@@ -0,0 +1,43 @@
+####
+#
+#  Precompute the synonym table the search app expands queries with (see query_utils.expand_synonyms).  For every word
+#  in the fastText synonyms model (or in --words), we look up its nearest neighbors once, here, and keep the ones that are
+#  at least --min_similarity similar.  get_nearest_neighbors compares the word against the whole vocabulary, which is
+#  far too slow to do per query.
+#
+#  The output has a line per word: the word, then tab separated neighbor|similarity pairs, most similar first.
+#
+###
+import argparse
+
+import fasttext
+
+import query_utils as qu
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build the synonym table for query expansion from a fastText model.')
+    general = parser.add_argument_group("general")
+    general.add_argument("--model", default="/workspace/datasets/fasttext/syns_model.bin", help="The fastText synonyms model, e.g. from the week 3 skipgram exercise")
+    general.add_argument("--words", help="Only build neighbors for the words in this file (one per line, or queries to split into words), e.g. the query log words.  Default: the model's vocabulary")
+    general.add_argument("--output", default="/workspace/datasets/fasttext/synonyms.tsv", help="Where to write the table.  Point SYNONYMS_TABLE_LOC at it.")
+    general.add_argument("--k", type=int, default=10, help="How many neighbors to look at per word")
+    general.add_argument("--min_similarity", type=float, default=0.75, help="Drop neighbors less similar than this.  The app can raise it further with SYNONYM_MIN_SIMILARITY")
+    args = parser.parse_args()
+
+    model = fasttext.load_model(args.model)
+    if args.words:
+        with open(args.words) as input:
+            words = sorted({word for line in input for word in line.lower().split()})
+    else:
+        words = model.get_words()
+    print("Finding neighbors for %s words" % len(words))
+    table = {}
+    for idx, word in enumerate(words):
+        if idx % 10000 == 0:
+            print("Progress: %s" % idx)
+        neighbors = [(neighbor, similarity) for (similarity, neighbor) in model.get_nearest_neighbors(word, k=args.k)
+                     if similarity >= args.min_similarity and neighbor != word]
+        if neighbors:
+            table[word] = neighbors
+    qu.save_synonym_table(table, args.output)
+    print("Saved synonyms for %s words to %s" % (len(table), args.output))
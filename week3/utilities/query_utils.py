@@ -1,4 +1,9 @@
+import hashlib
 import math
+import os
+import pickle
+
+import numpy as np
 # some helpful tools for dealing with queries
 def create_stats_query(aggs, extended=True):
     print("Creating stats query from %s" % aggs)
@@ -41,7 +46,169 @@ def create_prior_queries(doc_ids, doc_id_weights, query_times_seen): # total imp
 
 
 
-def create_simple_baseline(user_query, click_prior_query, filters, sort="_score", sortDir="desc", size=10, include_aggs=True, highlight=True, source=None):
+# The click prior query for every query in the clicks, precomputed with create_prior_queries exactly as
+# search.get_click_prior used to do it per request.  Returns query -> click prior query
+def create_prior_query_map(clicks_df):
+    prior_query_map = {}
+    for query, prior_clicks_for_query in clicks_df.groupby("query"):
+        prior_doc_ids = prior_clicks_for_query.sku.drop_duplicates()
+        prior_doc_id_weights = prior_clicks_for_query.sku.value_counts()  # histogram gives us the click counts for all the doc_ids
+        query_times_seen = prior_clicks_for_query.sku.count()
+        prior_query_map[query] = create_prior_queries(prior_doc_ids, prior_doc_id_weights, query_times_seen)
+    return prior_query_map
+
+
+# Save the prior query map (see utilities/build_priors.py) so the app can load it instead of grouping the clicks CSV
+def save_prior_query_map(prior_query_map, path):
+    with open(path, "wb") as output:
+        pickle.dump(prior_query_map, output, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_prior_query_map(path):
+    with open(path, "rb") as input:
+        return pickle.load(input)
+
+
+# A 64 bit hash of the query that is the same in every process (unlike hash()), for PriorFile
+def hash_query(query):
+    return int.from_bytes(hashlib.blake2b(str(query).encode("utf-8"), digest_size=8).digest(), "little")
+
+
+# The click priors as flat arrays in a directory of .npy files that every worker memory maps, so N workers on a box share
+# one copy of them in the page cache instead of each holding its own dict:
+#   hashes         -- the sorted hash_query of each query
+#   starts         -- query i's skus and weights are skus[starts[i]:starts[i + 1]] (and the same for weights)
+#   skus, weights  -- the clicked skus of every query and their share of its clicks
+#   clause_starts  -- query i's click prior query (as from create_prior_queries) is clauses[clause_starts[i]:clause_starts[i + 1]]
+#   clauses        -- the utf-8 bytes of every query's click prior query
+# Looking up a query is a binary search over the hashes.  We don't keep the queries themselves, so two queries with the
+# same 64 bit hash would share priors, which with a few hundred thousand queries is vanishingly unlikely.
+class PriorFile:
+
+    FILES = ["hashes", "starts", "skus", "weights", "clause_starts", "clauses"]
+
+    def __init__(self, path) -> None:
+        self.path = path
+        arrays = {name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r", allow_pickle=False) for name in self.FILES}
+        self.hashes = arrays["hashes"]
+        self.starts = arrays["starts"]
+        self.skus = arrays["skus"]
+        self.weights = arrays["weights"]
+        self.clause_starts = arrays["clause_starts"]
+        self.clauses = arrays["clauses"]
+
+    # Group the clicks the same way as create_prior_query_map and write them to the directory at path
+    @staticmethod
+    def write(clicks_df, path):
+        entries = []
+        for query, prior_clicks_for_query in clicks_df.groupby("query"):
+            prior_doc_ids = prior_clicks_for_query.sku.drop_duplicates()
+            prior_doc_id_weights = prior_clicks_for_query.sku.value_counts()
+            query_times_seen = prior_clicks_for_query.sku.count()
+            entries.append((hash_query(query), prior_doc_ids.astype(str).to_numpy(),
+                            (prior_doc_id_weights[prior_doc_ids] / query_times_seen).to_numpy(dtype=np.float64),
+                            create_prior_queries(prior_doc_ids, prior_doc_id_weights, query_times_seen).encode("utf-8")))
+        entries.sort(key=lambda entry: entry[0])
+        starts = np.zeros(len(entries) + 1, dtype=np.int64)
+        np.cumsum([len(entry[1]) for entry in entries], out=starts[1:])
+        clause_starts = np.zeros(len(entries) + 1, dtype=np.int64)
+        np.cumsum([len(entry[3]) for entry in entries], out=clause_starts[1:])
+        arrays = {
+            "hashes": np.array([entry[0] for entry in entries], dtype=np.uint64),
+            "starts": starts,
+            "skus": np.concatenate([entry[1] for entry in entries]).astype(str) if entries else np.array([], dtype=str),
+            "weights": np.concatenate([entry[2] for entry in entries]) if entries else np.array([], dtype=np.float64),
+            "clause_starts": clause_starts,
+            "clauses": np.frombuffer(b"".join(entry[3] for entry in entries), dtype=np.uint8),
+        }
+        os.makedirs(path, exist_ok=True)
+        for name in PriorFile.FILES:
+            np.save(os.path.join(path, name + ".npy"), arrays[name], allow_pickle=False)
+        return len(entries)
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def _find(self, query):
+        key = np.uint64(hash_query(query))
+        idx = int(np.searchsorted(self.hashes, key))
+        if idx < len(self.hashes) and self.hashes[idx] == key:
+            return idx
+        return None
+
+    def __contains__(self, query):
+        return self._find(query) is not None
+
+    # The click prior query for the query, like dict.get on create_prior_query_map's map
+    def get(self, query, default=None):
+        idx = self._find(query)
+        if idx is None:
+            return default
+        return self.clauses[self.clause_starts[idx]:self.clause_starts[idx + 1]].tobytes().decode("utf-8")
+
+    # Returns (skus, weights) for the query, or (None, None) if we haven't seen it
+    def get_priors(self, query):
+        idx = self._find(query)
+        if idx is None:
+            return None, None
+        start, end = self.starts[idx], self.starts[idx + 1]
+        return self.skus[start:end], self.weights[start:end]
+
+
+# Synonym tables, from utilities/build_synonyms.py: a line per word with its tab separated neighbor|similarity pairs, most
+# similar first.  Returns word -> [(neighbor, similarity)], keeping the neighbors at least min_similarity similar.
+def load_synonym_table(path, min_similarity=0.0):
+    table = {}
+    with open(path) as input:
+        for line in input:
+            fields = line.rstrip("\n").split("\t")
+            neighbors = []
+            for field in fields[1:]:
+                (neighbor, _, similarity) = field.rpartition("|")
+                if neighbor and float(similarity) >= min_similarity:
+                    neighbors.append((neighbor, float(similarity)))
+            if neighbors:
+                table[fields[0]] = neighbors
+    return table
+
+
+def save_synonym_table(table, path):
+    with open(path, "w") as output:
+        for word, neighbors in table.items():
+            output.write("\t".join([word] + ["%s|%.4f" % (neighbor, similarity) for neighbor, similarity in neighbors]) + "\n")
+
+
+# The synonyms to expand the query with: up to max_per_word neighbors of each of its words and at most max_clauses in all,
+# most similar first, as [(neighbor, similarity)].  Neighbors that are already in the query are skipped.
+def expand_synonyms(user_query, synonym_table, max_per_word=2, max_clauses=6):
+    words = user_query.lower().split()
+    seen = set(words)
+    synonyms = []
+    for word in words:
+        for (neighbor, similarity) in synonym_table.get(word, [])[:max_per_word]:
+            if neighbor not in seen:
+                seen.add(neighbor)
+                synonyms.append((neighbor, similarity))
+    synonyms.sort(key=lambda synonym: -synonym[1])
+    return synonyms[:max_clauses]
+
+
+# A name match for each synonym, boosted by how similar it is, so that the expansion adds recall without outscoring the
+# user's own words.  There's one clause per synonym, so expand_synonyms' max_clauses bounds the cost.
+def add_synonym_clauses(should_clauses, synonyms, synonym_boost=1.0):
+    for (neighbor, similarity) in synonyms or []:
+        should_clauses.append({
+            "match": {
+                "name": {
+                    "query": neighbor,
+                    "boost": synonym_boost * similarity
+                }
+            }
+        })
+
+
+def create_simple_baseline(user_query, click_prior_query, filters, sort="_score", sortDir="desc", size=10, include_aggs=True, highlight=True, source=None,
+                           synonyms=None, synonym_boost=1.0):
 
     query_obj = {
         'size': size,
@@ -106,6 +273,7 @@ def create_simple_baseline(user_query, click_prior_query, filters, sort="_score"
 
         }
     }
+    add_synonym_clauses(query_obj["query"]["bool"]["should"], synonyms, synonym_boost)
     if click_prior_query != "":
         query_obj["query"]["bool"]["should"].append({
                         "query_string":{  # This may feel like cheating, but it's really not, esp. in ecommerce where you have all this prior data,  You just can't let the test clicks leak in, which is why we split on date
@@ -137,7 +305,8 @@ def create_simple_baseline(user_query, click_prior_query, filters, sort="_score"
     return query_obj
 
 # Hardcoded query here.  Better to use search templates or other query config.
-def create_query(user_query, click_prior_query, filters, sort="_score", sortDir="desc", size=10, include_aggs=True, highlight=True, source=None):
+def create_query(user_query, click_prior_query, filters, sort="_score", sortDir="desc", size=10, include_aggs=True, highlight=True, source=None,
+                 synonyms=None, synonym_boost=1.0):
     query_obj = {
         'size': size,
         "sort":[
@@ -252,6 +421,7 @@ def create_query(user_query, click_prior_query, filters, sort="_score", sortDir=
             }
         }
     }
+    add_synonym_clauses(query_obj["query"]["function_score"]["query"]["bool"]["should"], synonyms, synonym_boost)
     if click_prior_query != "":
         query_obj["query"]["function_score"]["query"]["bool"]["should"].append({
                         "query_string":{  # This may feel like cheating, but it's really not, esp. in ecommerce where you have all this prior data,  You just can't let the test clicks leak in, which is why we split on date
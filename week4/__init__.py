@@ -1,3 +1,4 @@
+import gc
 import os
 
 from flask import Flask
@@ -5,6 +6,22 @@ from flask import render_template
 
 import fasttext
 
+import week4.utilities.query_utils as qu
+from week4.degradation import Degrader
+from week4.hedging import Hedger
+from week4.metrics import SearchMetrics
+from week4.query_classifier import QueryClassifier
+from week4.resources import Resources
+from week4.search_cache import SearchCache
+from week4.singleflight import SingleFlight
+from week4.spelling import SpellingCorrector
+from week4.typeahead import Typeahead
+
+def create_query_classifier(config, query_model):
+    return QueryClassifier(query_model, threshold=config["QUERY_CLASS_THRESHOLD"], cache_size=config["QUERY_CLASS_CACHE_SIZE"],
+                           batch_wait=config["QUERY_CLASS_BATCH_WAIT"], max_batch=config["QUERY_CLASS_MAX_BATCH"])
+
+
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__, instance_relative_config=True)
@@ -12,18 +29,181 @@ def create_app(test_config=None):
     if test_config is None:
         # load the instance config, if it exists, when not testing
         app.config.from_pyfile('config.py', silent=True)
-        QUERY_CLASS_MODEL_LOC = os.environ.get("QUERY_CLASS_MODEL_LOC", "/workspace/datasets/fasttext/query_model.bin")
-        if QUERY_CLASS_MODEL_LOC and os.path.isfile(QUERY_CLASS_MODEL_LOC):
-            app.config["query_model"] = fasttext.load_model(QUERY_CLASS_MODEL_LOC)
-        else:
-            print("No query model found.  Have you run fasttext?")
-        print("QUERY_CLASS_MODEL_LOC: %s" % QUERY_CLASS_MODEL_LOC)
     else:
         # load the test config if passed in
         app.config.from_mapping(test_config)
 
     app.config["index_name"] = os.environ.get("INDEX_NAME", "bbuy_products")
     
+    # OpenSearch connection settings.  Set them in the instance config or the environment.
+    # The client itself is created once per process in opensearch.get_opensearch
+    app.config.setdefault("OPENSEARCH_HOST", os.environ.get("OPENSEARCH_HOST", "localhost"))
+    app.config.setdefault("OPENSEARCH_PORT", int(os.environ.get("OPENSEARCH_PORT", 9200)))
+    app.config.setdefault("OPENSEARCH_USER", os.environ.get("OPENSEARCH_USER", "admin"))
+    app.config.setdefault("OPENSEARCH_PASSWORD", os.environ.get("OPENSEARCH_PASSWORD", "admin"))
+    app.config.setdefault("OPENSEARCH_USE_SSL", os.environ.get("OPENSEARCH_USE_SSL", "true").lower() == "true")
+    app.config.setdefault("OPENSEARCH_VERIFY_CERTS", os.environ.get("OPENSEARCH_VERIFY_CERTS", "false").lower() == "true")
+    app.config.setdefault("OPENSEARCH_POOL_MAXSIZE", int(os.environ.get("OPENSEARCH_POOL_MAXSIZE", 10)))
+    app.config.setdefault("OPENSEARCH_ASYNC_POOL_MAXSIZE", int(os.environ.get("OPENSEARCH_ASYNC_POOL_MAXSIZE", 100)))  # see asgi.py
+    app.config.setdefault("OPENSEARCH_TIMEOUT", float(os.environ.get("OPENSEARCH_TIMEOUT", 10)))
+    app.config.setdefault("OPENSEARCH_MAX_RETRIES", int(os.environ.get("OPENSEARCH_MAX_RETRIES", 3)))
+    app.config.setdefault("OPENSEARCH_RETRY_ON_TIMEOUT", os.environ.get("OPENSEARCH_RETRY_ON_TIMEOUT", "false").lower() == "true")
+
+    # Response cache in front of opensearch.search.  Bump LTR_MODEL_VERSION when you upload a new LTR model and
+    # INDEX_GENERATION when you reindex so that old responses are no longer served.
+    app.config.setdefault("SEARCH_CACHE_ENABLED", os.environ.get("SEARCH_CACHE_ENABLED", "true").lower() == "true")
+    app.config.setdefault("SEARCH_CACHE_MAX_BYTES", int(os.environ.get("SEARCH_CACHE_MAX_BYTES", 64 * 1024 * 1024)))
+    app.config.setdefault("SEARCH_CACHE_TTL", float(os.environ.get("SEARCH_CACHE_TTL", 60)))
+    app.config.setdefault("SEARCH_CACHE_STALE_TTL", float(os.environ.get("SEARCH_CACHE_STALE_TTL", 300)))
+    app.config.setdefault("LTR_MODEL_VERSION", os.environ.get("LTR_MODEL_VERSION", "1"))
+    app.config.setdefault("INDEX_GENERATION", os.environ.get("INDEX_GENERATION", "1"))
+    if app.config["SEARCH_CACHE_ENABLED"]:
+        app.config["search_cache"] = SearchCache(max_bytes=app.config["SEARCH_CACHE_MAX_BYTES"],
+                                                 ttl=app.config["SEARCH_CACHE_TTL"],
+                                                 stale_ttl=app.config["SEARCH_CACHE_STALE_TTL"])
+
+    # Identical searches running at the same time share one OpenSearch call, see singleflight.py
+    app.config.setdefault("SEARCH_SINGLE_FLIGHT", os.environ.get("SEARCH_SINGLE_FLIGHT", "true").lower() == "true")
+    if app.config["SEARCH_SINGLE_FLIGHT"]:
+        app.config["single_flight"] = SingleFlight()
+
+    # Hedged searches: a search that is still running after the SEARCH_HEDGE_PERCENTILE latency of the recent searches
+    # (and at least SEARCH_HEDGE_MIN_DELAY seconds) is sent again to another replica, see hedging.py.  Every first search
+    # and hedge needs a connection of its own, so OPENSEARCH_POOL_MAXSIZE grows to fit them.
+    app.config.setdefault("SEARCH_HEDGE", os.environ.get("SEARCH_HEDGE", "false").lower() == "true")
+    app.config.setdefault("SEARCH_HEDGE_PERCENTILE", float(os.environ.get("SEARCH_HEDGE_PERCENTILE", 95)))
+    app.config.setdefault("SEARCH_HEDGE_MIN_DELAY", float(os.environ.get("SEARCH_HEDGE_MIN_DELAY", 0.01)))
+    app.config.setdefault("SEARCH_HEDGE_WORKERS", int(os.environ.get("SEARCH_HEDGE_WORKERS", 16)))
+    # the first searches run in their own pool, which should cover every search this process can have in flight
+    app.config.setdefault("SEARCH_HEDGE_PRIMARY_WORKERS", int(os.environ.get("SEARCH_HEDGE_PRIMARY_WORKERS", 64)))
+    if app.config["SEARCH_HEDGE"]:
+        app.config["hedger"] = Hedger(percentile=app.config["SEARCH_HEDGE_PERCENTILE"], min_delay=app.config["SEARCH_HEDGE_MIN_DELAY"],
+                                      workers=app.config["SEARCH_HEDGE_WORKERS"],
+                                      primary_workers=app.config["SEARCH_HEDGE_PRIMARY_WORKERS"])
+        app.config["OPENSEARCH_POOL_MAXSIZE"] = max(app.config["OPENSEARCH_POOL_MAXSIZE"],
+                                                    app.config["SEARCH_HEDGE_PRIMARY_WORKERS"] + app.config["SEARCH_HEDGE_WORKERS"])
+
+    # Send the template id and parameters instead of the query bodies.  Store the templates first with
+    # build_ltr.py --upload_search_templates
+    app.config.setdefault("USE_SEARCH_TEMPLATES", os.environ.get("USE_SEARCH_TEMPLATES", "false").lower() == "true")
+    # Have the LTR models rescore their window without _source or highlighting and then only fetch the documents on the
+    # page we are displaying
+    app.config.setdefault("TWO_PHASE_RETRIEVAL", os.environ.get("TWO_PHASE_RETRIEVAL", "true").lower() == "true")
+    app.config.setdefault("RESULTS_PAGE_SIZE", int(os.environ.get("RESULTS_PAGE_SIZE", 100)))
+    # Paging.  The LTR models page through their rescore window, which we keep for RESCORE_WINDOW_TTL seconds.  The other
+    # models page with search_after, on a point in time if SEARCH_PAGING_PIT is set (requires OpenSearch 2.4+)
+    app.config.setdefault("RESCORE_WINDOW_TTL", float(os.environ.get("RESCORE_WINDOW_TTL", 600)))
+    app.config.setdefault("SEARCH_PAGING_PIT", os.environ.get("SEARCH_PAGING_PIT", "false").lower() == "true")
+    app.config.setdefault("SEARCH_PIT_KEEP_ALIVE", os.environ.get("SEARCH_PIT_KEEP_ALIVE", "5m"))
+    # A window is up to 500 hits, with their _source and highlights unless TWO_PHASE_RETRIEVAL is on, so any window that
+    # fits in RESCORE_WINDOW_CACHE_BYTES is worth keeping
+    app.config.setdefault("RESCORE_WINDOW_CACHE_BYTES", int(os.environ.get("RESCORE_WINDOW_CACHE_BYTES", 32 * 1024 * 1024)))
+    app.config["rescore_windows"] = SearchCache(max_bytes=app.config["RESCORE_WINDOW_CACHE_BYTES"],
+                                                max_entry_bytes=app.config["RESCORE_WINDOW_CACHE_BYTES"],
+                                                ttl=app.config["RESCORE_WINDOW_TTL"])
+    # Broad queries (CHEAP_COUNTING_MAX_WORDS words or fewer, e.g. "*" or "laptop") stop counting hits at
+    # CHEAP_TRACK_TOTAL_HITS and compute their facets from the FACET_SAMPLE_SHARD_SIZE best matches on each shard
+    # (at most FACET_SAMPLE_MAX_DOCS_PER_VALUE per value of FACET_SAMPLE_DIVERSIFY_FIELD, if set).  The page says the
+    # counts are estimates.  See query_utils.limit_counting
+    app.config.setdefault("CHEAP_COUNTING", os.environ.get("CHEAP_COUNTING", "true").lower() == "true")
+    app.config.setdefault("CHEAP_COUNTING_MAX_WORDS", int(os.environ.get("CHEAP_COUNTING_MAX_WORDS", 1)))
+    app.config.setdefault("CHEAP_TRACK_TOTAL_HITS", int(os.environ.get("CHEAP_TRACK_TOTAL_HITS", 1000)))
+    app.config.setdefault("FACET_SAMPLE_SHARD_SIZE", int(os.environ.get("FACET_SAMPLE_SHARD_SIZE", 1000)))
+    app.config.setdefault("FACET_SAMPLE_DIVERSIFY_FIELD", os.environ.get("FACET_SAMPLE_DIVERSIFY_FIELD", ""))
+    app.config.setdefault("FACET_SAMPLE_MAX_DOCS_PER_VALUE", int(os.environ.get("FACET_SAMPLE_MAX_DOCS_PER_VALUE", 100)))
+    app.config.setdefault("COMPARE_SIZE", int(os.environ.get("COMPARE_SIZE", 10)))  # hits per model on the compare page
+    app.config["search_metrics"] = SearchMetrics()
+    # Every search has SEARCH_DEADLINE seconds (0 for no deadline), after which OpenSearch returns the results it has
+    # found so far.  Once the p95 of the recent searches goes over DEGRADE_P95_SECONDS or there are more than
+    # DEGRADE_MAX_IN_FLIGHT searches running (0 to ignore either), the searches get cheaper: the LTR models rescore
+    # DEGRADED_RESCORE_SIZE docs, then we drop the facets, then the highlighting.  See degradation.py
+    app.config.setdefault("SEARCH_DEADLINE", float(os.environ.get("SEARCH_DEADLINE", 2.0)))
+    app.config.setdefault("DEGRADE_P95_SECONDS", float(os.environ.get("DEGRADE_P95_SECONDS", 1.0)))
+    app.config.setdefault("DEGRADE_MAX_IN_FLIGHT", int(os.environ.get("DEGRADE_MAX_IN_FLIGHT", 32)))
+    app.config.setdefault("DEGRADED_RESCORE_SIZE", int(os.environ.get("DEGRADED_RESCORE_SIZE", 100)))
+    if app.config["DEGRADE_P95_SECONDS"] > 0 or app.config["DEGRADE_MAX_IN_FLIGHT"] > 0:
+        app.config["degrader"] = Degrader(app.config["DEGRADE_P95_SECONDS"], app.config["DEGRADE_MAX_IN_FLIGHT"])
+    # Query classification.  Predictions are cached per normalized query and cache misses are batched, waiting up to
+    # QUERY_CLASS_BATCH_WAIT seconds (0 to turn batching off) for other requests to join.  We only filter on a category
+    # (QUERY_CLASS_FIELD) when its confidence is at least QUERY_CLASS_THRESHOLD.  Down to QUERY_CLASS_BOOST_THRESHOLD,
+    # we boost the category by QUERY_CLASS_BOOST instead.  See search.classify_query
+    app.config.setdefault("QUERY_CLASS_THRESHOLD", float(os.environ.get("QUERY_CLASS_THRESHOLD", 0.5)))
+    app.config.setdefault("QUERY_CLASS_BOOST_THRESHOLD", float(os.environ.get("QUERY_CLASS_BOOST_THRESHOLD", 0.2)))
+    app.config.setdefault("QUERY_CLASS_BOOST", float(os.environ.get("QUERY_CLASS_BOOST", 10.0)))
+    app.config.setdefault("QUERY_CLASS_FIELD", os.environ.get("QUERY_CLASS_FIELD", "categoryPathIds.keyword"))
+    app.config.setdefault("QUERY_CLASS_CACHE_SIZE", int(os.environ.get("QUERY_CLASS_CACHE_SIZE", 10000)))
+    app.config.setdefault("QUERY_CLASS_BATCH_WAIT", float(os.environ.get("QUERY_CLASS_BATCH_WAIT", 0.002)))
+    app.config.setdefault("QUERY_CLASS_MAX_BATCH", int(os.environ.get("QUERY_CLASS_MAX_BATCH", 64)))
+    if app.config.get("query_model") is not None:
+        app.config["query_classifier"] = create_query_classifier(app.config, app.config["query_model"])
+
+    # Typeahead, see /search/suggest.  Queries seen fewer than TYPEAHEAD_MIN_COUNT times are never suggested.
+    app.config.setdefault("TYPEAHEAD_SIZE", int(os.environ.get("TYPEAHEAD_SIZE", 10)))
+    app.config.setdefault("TYPEAHEAD_MIN_COUNT", int(os.environ.get("TYPEAHEAD_MIN_COUNT", 2)))
+
+    # Spelling correction.  We suggest a correction when a search finds fewer than SPELLING_MIN_HITS hits.  Words seen
+    # fewer than SPELLING_MIN_COUNT times aren't suggested.  Once the corrector has loaded, the queries drop their fuzzy
+    # name match, unless SPELLING_REPLACES_FUZZY is false.
+    app.config.setdefault("SPELLING_MIN_HITS", int(os.environ.get("SPELLING_MIN_HITS", 3)))
+    app.config.setdefault("SPELLING_MIN_COUNT", int(os.environ.get("SPELLING_MIN_COUNT", 2)))
+    app.config.setdefault("SPELLING_REPLACES_FUZZY", os.environ.get("SPELLING_REPLACES_FUZZY", "true").lower() == "true")
+
+    # The query model, the priors, the spelling corrector and the typeahead load in the background (see resources.py), check /ready to see when they're done.
+    # Set LOAD_RESOURCES_IN_BACKGROUND=false to load them before create_app returns.
+    # With PRELOAD_MODELS=true they load before create_app returns and everything loaded so far is moved out of the
+    # garbage collector's reach (gc.freeze), so a pre-forking server that creates the app before forking, e.g.
+    #   PRELOAD_MODELS=true gunicorn --preload -w 4 'week4:create_app()'
+    # shares one copy of the models, priors, spelling corrector and typeahead between its workers, instead of each worker
+    # loading its own.
+    app.config.setdefault("PRELOAD_MODELS", os.environ.get("PRELOAD_MODELS", "false").lower() == "true")
+    app.config.setdefault("LOAD_RESOURCES_IN_BACKGROUND", os.environ.get("LOAD_RESOURCES_IN_BACKGROUND", "true").lower() == "true"
+                          and not app.config["PRELOAD_MODELS"])
+    resources = app.config["resources"] = Resources(background=app.config["LOAD_RESOURCES_IN_BACKGROUND"])
+    if test_config is None:
+        QUERY_CLASS_MODEL_LOC = os.environ.get("QUERY_CLASS_MODEL_LOC", "/workspace/datasets/fasttext/query_model.bin")
+        print("QUERY_CLASS_MODEL_LOC: %s" % QUERY_CLASS_MODEL_LOC)
+        if QUERY_CLASS_MODEL_LOC and os.path.isfile(QUERY_CLASS_MODEL_LOC):
+            resources.load(app, "query_model", lambda: {
+                "query_classifier": create_query_classifier(app.config, fasttext.load_model(QUERY_CLASS_MODEL_LOC))
+            })
+        else:
+            print("No query model found.  Have you run fasttext?")
+        # Prefer the priors precomputed by utilities/build_priors.py, they load much faster than the clicks CSV
+        PRIOR_CLICKS_LOC = os.environ.get("PRIOR_CLICKS_LOC")
+        if not PRIOR_CLICKS_LOC:
+            PRIOR_CLICKS_LOC = "/workspace/ltr_output/priors.npz"
+            if not os.path.isfile(PRIOR_CLICKS_LOC):
+                PRIOR_CLICKS_LOC = "/workspace/ltr_output/train.csv"
+        print("PRIOR CLICKS: %s" % PRIOR_CLICKS_LOC)
+        if PRIOR_CLICKS_LOC and os.path.isfile(PRIOR_CLICKS_LOC):
+            PRIORS_TOP_K = int(os.environ.get("PRIORS_TOP_K", 0)) or None
+            resources.load(app, "prior_clicks", lambda: {
+                "prior_index": qu.PriorIndex.from_file(PRIOR_CLICKS_LOC, top_k=PRIORS_TOP_K)
+            })
+        else:
+            print("No prior clicks to load.  This may effect quality. Run ltr-end-to-end.sh per week 2 if you want")
+        SPELLING_QUERIES_LOC = os.environ.get("SPELLING_QUERIES_LOC", "/workspace/ltr_output/train.csv")
+        SPELLING_NAMES_LOC = os.environ.get("SPELLING_NAMES_LOC", "/workspace/datasets/fasttext/titles.txt")
+        print("SPELLING_QUERIES_LOC: %s, SPELLING_NAMES_LOC: %s" % (SPELLING_QUERIES_LOC, SPELLING_NAMES_LOC))
+        SPELLING_QUERIES_LOC = SPELLING_QUERIES_LOC if SPELLING_QUERIES_LOC and os.path.isfile(SPELLING_QUERIES_LOC) else None
+        SPELLING_NAMES_LOC = SPELLING_NAMES_LOC if SPELLING_NAMES_LOC and os.path.isfile(SPELLING_NAMES_LOC) else None
+        if SPELLING_QUERIES_LOC or SPELLING_NAMES_LOC:
+            resources.load(app, "spelling_corrector", lambda: {
+                "spelling_corrector": SpellingCorrector.from_files(SPELLING_QUERIES_LOC, SPELLING_NAMES_LOC,
+                                                                   min_count=app.config["SPELLING_MIN_COUNT"])
+            })
+        else:
+            print("No vocabulary for the spelling corrector.  Run week3/extractTitles.py for the product names")
+        TYPEAHEAD_QUERIES_LOC = os.environ.get("TYPEAHEAD_QUERIES_LOC", "/workspace/ltr_output/train.csv")
+        print("TYPEAHEAD_QUERIES_LOC: %s" % TYPEAHEAD_QUERIES_LOC)
+        if TYPEAHEAD_QUERIES_LOC and os.path.isfile(TYPEAHEAD_QUERIES_LOC):
+            resources.load(app, "typeahead", lambda: {
+                "typeahead": Typeahead.from_csv(TYPEAHEAD_QUERIES_LOC, min_count=app.config["TYPEAHEAD_MIN_COUNT"],
+                                                top_n=app.config["TYPEAHEAD_SIZE"])
+            })
+        else:
+            print("No queries to build the typeahead from.  Point TYPEAHEAD_QUERIES_LOC at a CSV with a query column")
+
     # ensure the instance folder exists
     try:
         os.makedirs(app.instance_path)
@@ -37,6 +217,13 @@ def create_app(test_config=None):
 
     from . import search
     app.register_blueprint(search.bp)
+    from . import metrics
+    app.register_blueprint(metrics.bp)
+    from . import resources
+    app.register_blueprint(resources.bp)
     app.add_url_rule('/', view_func=search.query)
 
+    if app.config["PRELOAD_MODELS"]:
+        gc.collect()
+        gc.freeze()
     return app
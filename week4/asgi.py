@@ -0,0 +1,212 @@
+#
+# The search app for an ASGI server, e.g.
+#   uvicorn --factory week4.asgi:create_asgi_app --port 3000
+# Under WSGI every request holds a worker thread for as long as OpenSearch takes, so the number of threads caps how many
+# searches we can have in flight.  Here /search/query and /search/api run on the event loop instead: they run the same
+# search as the Flask views (search.run_search) through the AsyncOpenSearch client, and the blocking work (the prior
+# lookup, the query classifier and the spelling corrector) runs in the default thread pool, so waiting on OpenSearch
+# doesn't tie up anything.  They share the Flask app's config, caches, templates and request parsing.  Everything else
+# (the other pages, /metrics, /ready, static files) is passed on to the Flask app, which runs in a thread.
+#
+# The response cache works as usual, but concurrent misses don't share a search (singleflight.py) and slow searches aren't
+# hedged (hedging.py): both are built on threads.
+#
+import asyncio
+import io
+import sys
+import time
+
+from asgiref.wsgi import WsgiToAsgi
+from flask import Response, current_app
+from werkzeug.exceptions import HTTPException
+
+import week4.search as search
+from week4 import create_app
+from week4.metrics import SearchTimer, finish_request
+from week4.opensearch import close_async_opensearch, get_async_opensearch
+
+
+# The OpenSearch calls (and the blocking work) search.run_search makes, for the asyncio app.  See search.SyncSearcher.
+class AsyncSearcher:
+
+    def __init__(self, opensearch) -> None:
+        self.opensearch = opensearch
+
+    # The thread runs in a copy of our context, so it has the Flask app and request too
+    async def run(self, func, *args):
+        return await asyncio.to_thread(func, *args)
+
+    async def search_cached(self, query_obj, index_name, cache_key=None, timer=None, on_load=None):
+        async def load():
+            response = await self.search(query_obj, index_name, timer)
+            if on_load is not None:
+                on_load(response)
+            return response
+        return await get_or_load(cache_key, load)
+
+    async def search(self, query_obj, index_name, timer=None):
+        start = time.perf_counter()
+        (method, kwargs) = search.get_search_call(query_obj, index_name)
+        response = await getattr(self.opensearch, method)(**kwargs)
+        search.record_search_time(timer, start, response)
+        return response
+
+    async def fetch_page_cached(self, response, user_query, index_name, offset, page_size, window_id=None, timer=None,
+                                highlight=True, source=None):
+        async def load():
+            page_query = search.create_page_query(response, user_query, offset, page_size, highlight, source)
+            docs_response = None
+            if page_query is not None:
+                start = time.perf_counter()
+                docs_response = await self.opensearch.search(body=page_query, index=index_name)
+                search.record_search_time(timer, start, docs_response)
+            return search.merge_page(response, offset, page_size, docs_response)
+        page_key = search.get_page_key(window_id, offset, page_size, highlight, source) if window_id is not None else None
+        return await get_or_load(page_key, load)
+
+    async def open_point_in_time(self, index_name):
+        response = await self.opensearch.create_pit(index=index_name, keep_alive=current_app.config["SEARCH_PIT_KEEP_ALIVE"])
+        return response["pit_id"]
+
+
+# The cached response for key, or await load() for it (and cache it, if it's complete).  No key means don't cache.
+async def get_or_load(key, load):
+    search_cache = current_app.config.get("search_cache")
+    if search_cache is None or key is None:
+        return await load()
+    response = search_cache.get(key)
+    if response is None:
+        response = await load()
+        if search.is_complete_response(response):
+            search_cache.put(key, response)
+    return response
+
+
+# search.query, on the event loop
+async def query():
+    timer = SearchTimer()
+    with timer.time("parse"):
+        params = search.get_search_params()
+    result = await search.run_search(AsyncSearcher(get_async_opensearch()), params, timer, current_app.config["RESULTS_PAGE_SIZE"])
+    did_you_mean = None
+    if params["page"] == 1:
+        with timer.time("spelling"):
+            did_you_mean = await asyncio.to_thread(search.get_did_you_mean, params["user_query"], result["response"])
+    with timer.time("render"):
+        html = search.render_results(params, result, did_you_mean)
+    return finish_request(timer, html)
+
+
+# search.api, on the event loop
+async def api():
+    timer = SearchTimer()
+    with timer.time("parse"):
+        params = search.get_search_params()
+        (size, include_facets) = search.get_api_params()
+    result = await search.run_search(AsyncSearcher(get_async_opensearch()), params, timer, size, source=search.API_SOURCE,
+                                     highlight=False, include_aggs=include_facets)
+    with timer.time("render"):
+        body = Response(search.dumps_json(search.create_api_result(params, result, include_facets)), mimetype="application/json")
+    return finish_request(timer, body)
+
+
+# The Flask endpoints we serve on the event loop.  "query" is the Flask app's / route.
+ASYNC_VIEWS = {"search.query": query, "query": query, "search.api": api}
+
+
+def create_asgi_app(test_config=None):
+    app = create_app(test_config)
+    wsgi_app = WsgiToAsgi(app)
+
+    async def asgi_app(scope, receive, send):
+        if scope["type"] == "lifespan":
+            await run_lifespan(receive, send)
+            return
+        view = get_async_view(app, scope) if scope["type"] == "http" else None
+        if view is None:
+            await wsgi_app(scope, receive, send)
+            return
+        body = await read_body(receive)
+        # the same steps as Flask.full_dispatch_request, but awaiting the view
+        with app.request_context(create_environ(scope, body)):
+            try:
+                try:
+                    response = app.preprocess_request()  # the before_request hooks
+                    if response is None:
+                        response = await view()
+                except Exception as e:
+                    response = app.handle_user_exception(e)
+                response = app.finalize_request(response)
+            except Exception as e:
+                response = app.handle_exception(e)
+        await send_response(send, response)
+    asgi_app.flask_app = app
+    return asgi_app
+
+
+# The async view for the request, or None if the Flask app should handle it
+def get_async_view(app, scope):
+    try:
+        (endpoint, _) = app.url_map.bind("localhost").match(scope["path"], method=scope["method"])
+    except HTTPException:  # not found, wrong method or a redirect: Flask knows what to do
+        return None
+    return ASYNC_VIEWS.get(endpoint)
+
+
+async def run_lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await close_async_opensearch()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return body
+        body += message.get("body", b"")
+        if not message.get("more_body", False):
+            return body
+
+
+# The WSGI environ for an ASGI http request, so the Flask request (and get_search_params) can read it
+def create_environ(scope, body):
+    root_path = scope.get("root_path", "")
+    path = scope["path"]
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": root_path,
+        "PATH_INFO": path[len(root_path):] if path.startswith(root_path) else path,
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": "HTTP/%s" % scope.get("http_version", "1.1"),
+        "REMOTE_ADDR": scope["client"][0] if scope.get("client") else "",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": False,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for (name, value) in scope.get("headers", []):
+        name = name.decode("latin1").upper().replace("-", "_")
+        if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            name = "HTTP_" + name
+        value = value.decode("latin1")
+        environ[name] = environ[name] + "," + value if name in environ else value
+    return environ
+
+
+async def send_response(send, response):
+    await send({"type": "http.response.start", "status": response.status_code,
+                "headers": [(name.lower().encode("latin1"), value.encode("latin1")) for (name, value) in response.headers.items()]})
+    await send({"type": "http.response.body", "body": response.get_data()})
@@ -0,0 +1,87 @@
+#
+# Deadline-aware degradation for the search page.  On a traffic spike we would rather serve a cheaper search on time
+# than time out on the full one, so when the recent p95 latency or the number of requests in flight crosses its
+# threshold we start dropping the expensive parts of the search, one step at a time:
+#
+#   shrink_rescore -- the LTR models rescore a smaller window (e.g. 100 docs instead of 500)
+#   drop_aggs      -- no facets
+#   skip_highlight -- no highlighting
+#
+# The further over the threshold we are, the more steps we take (each step keeps the ones before it).  Independently of
+# that, every search carries a deadline that OpenSearch enforces as a timeout, returning whatever it found by then.
+#
+# The counts are per process and are exposed at /metrics.
+#
+import threading
+from collections import deque
+
+# In the order we take them
+STEPS = ["shrink_rescore", "drop_aggs", "skip_highlight"]
+# How far over the threshold (the larger of p95 / DEGRADE_P95_SECONDS and in flight / DEGRADE_MAX_IN_FLIGHT) we have to
+# be to take each step
+STEP_PRESSURES = [1.0, 1.5, 2.0]
+
+
+class Degrader:
+
+    def __init__(self, p95_threshold, max_in_flight, window=200, min_samples=20) -> None:
+        self.p95_threshold = p95_threshold  # seconds, 0 to ignore the latency
+        self.max_in_flight = max_in_flight  # 0 to ignore the requests in flight
+        self.min_samples = min_samples  # don't trust a p95 over fewer requests than this
+        self.latencies = deque(maxlen=window)  # the total time of the last `window` requests
+        self.in_flight = 0
+        self.requests = 0
+        self.degraded = {step: 0 for step in STEPS}  # how many requests took each step
+        self.timed_out = 0  # searches that hit their deadline and returned partial results
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def finish(self, secs):
+        with self._lock:
+            self.in_flight -= 1
+            self.latencies.append(secs)
+
+    # The p95 of the recent requests, or None if we haven't seen enough of them yet
+    def p95(self):
+        with self._lock:
+            latencies = sorted(self.latencies)
+        if len(latencies) < self.min_samples:
+            return None
+        return latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+
+    def pressure(self):
+        pressure = 0.0
+        if self.p95_threshold > 0:
+            p95 = self.p95()
+            if p95 is not None:
+                pressure = p95 / self.p95_threshold
+        if self.max_in_flight > 0:
+            pressure = max(pressure, self.in_flight / self.max_in_flight)
+        return pressure
+
+    # The steps to take for a request starting now, and count them
+    def get_steps(self):
+        pressure = self.pressure()
+        steps = [step for step, step_pressure in zip(STEPS, STEP_PRESSURES) if pressure >= step_pressure]
+        with self._lock:
+            self.requests += 1
+            for step in steps:
+                self.degraded[step] += 1
+        return steps
+
+    def record_response(self, response):
+        if response.get("timed_out"):
+            with self._lock:
+                self.timed_out += 1
+
+    def stats(self):
+        p95 = self.p95()
+        with self._lock:
+            stats = {"in_flight": self.in_flight, "requests_total": self.requests, "timed_out_total": self.timed_out,
+                     "recent_p95_seconds": p95 if p95 is not None else 0.0}
+            for step in STEPS:
+                stats["%s_total" % step] = self.degraded[step]
+            return stats
@@ -0,0 +1,119 @@
+#
+# Hedged requests (see "The Tail at Scale", Dean and Barroso).  A search that hasn't come back by the time most searches
+# have (the `percentile` of the recent latencies) is usually stuck behind something on one node, e.g. a GC pause, rather
+# than being slow everywhere.  So rather than keep waiting, we send the same search again with a different `preference`,
+# which routes it to a (probably) different copy of each shard, and use whichever answers first.  Only the slowest
+# searches get hedged, so it costs a few percent more searches to cut the tail.
+#
+# The sync OpenSearch client can't abort a request it has sent, so "cancelling" the loser means it's dropped if it
+# hasn't started yet and its response is ignored if it has.  For the same reason the first search can't run on the
+# caller's thread: the caller has to be free to return as soon as the hedge answers.  So first searches and hedges run in
+# separate pools, and a hedge never queues behind first searches when we're busy, which is exactly when we need it.
+#
+# stats() reports how often we hedged and won, and the p99 we served against the p99 the first search alone would have
+# given us.
+#
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class Hedger:
+
+    def __init__(self, percentile=95, min_delay=0.01, workers=16, primary_workers=64, window=1000, min_samples=50) -> None:
+        self.percentile = percentile
+        self.min_delay = min_delay  # never hedge sooner than this many seconds
+        self.min_samples = min_samples  # don't hedge until we've seen this many searches
+        self.latencies = deque(maxlen=window)  # how long the searches we served took
+        self.primary_latencies = deque(maxlen=window)  # how long the first search took, whether or not we used it
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self._delay = None  # cached, see get_delay
+        self._delay_at = 0
+        self._lock = threading.Lock()
+        # threads are only started as they're needed, so primary_workers can comfortably cover every request in flight
+        self._primaries = ThreadPoolExecutor(max_workers=primary_workers, thread_name_prefix="search-primary")
+        self._hedges = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="search-hedge")
+
+    # Call search(preference), hedging with a second call if the first is slow.  Returns the first successful response,
+    # and only raises if both calls fail.
+    def call(self, search):
+        start = time.perf_counter()
+        delay = self.get_delay()
+        if delay is None:  # still warming up
+            response = search(None)
+            secs = time.perf_counter() - start
+            self._record(secs, hedged=False, hedge_won=False)
+            self._record_primary(secs)
+            return response
+        primary = self._primaries.submit(search, None)
+        primary.add_done_callback(lambda future: self._record_primary(time.perf_counter() - start, future))
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            response = primary.result()
+            self._record(time.perf_counter() - start, hedged=False, hedge_won=False)
+            return response
+        # a custom preference string picks the shard copies by hash, so a fresh one usually avoids the slow copy
+        hedge = self._hedges.submit(search, "hedge-%s" % uuid.uuid4().hex)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                for other in pending:
+                    other.cancel()
+                self._record(time.perf_counter() - start, hedged=True, hedge_won=future is hedge)
+                return future.result()
+        self._record(time.perf_counter() - start, hedged=True, hedge_won=False)
+        raise error
+
+    # The recent `percentile` latency, recomputed at most once a second, or None if we haven't seen enough searches
+    def get_delay(self):
+        now = time.monotonic()
+        if now - self._delay_at < 1.0:
+            return self._delay
+        with self._lock:
+            latencies = sorted(self.primary_latencies)
+        self._delay = max(self.min_delay, percentile(latencies, self.percentile)) if len(latencies) >= self.min_samples else None
+        self._delay_at = now
+        return self._delay
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self.latencies)
+            primary_latencies = sorted(self.primary_latencies)
+            stats = {"calls_total": self.calls, "hedged_total": self.hedged, "hedge_wins_total": self.hedge_wins,
+                     "hedge_rate": self.hedged / self.calls if self.calls else 0.0}
+        p99 = percentile(latencies, 99) if latencies else 0.0
+        primary_p99 = percentile(primary_latencies, 99) if primary_latencies else 0.0
+        stats.update({"delay_seconds": self._delay or 0.0, "p99_seconds": p99, "primary_p99_seconds": primary_p99,
+                      "p99_improvement_seconds": primary_p99 - p99})
+        return stats
+
+    def _record(self, secs, hedged, hedge_won):
+        with self._lock:
+            self.calls += 1
+            self.latencies.append(secs)
+            if hedged:
+                self.hedged += 1
+            if hedge_won:
+                self.hedge_wins += 1
+
+    # Only first searches that ran and succeeded count towards the delay: a cancelled one never ran, and a failure says
+    # nothing about how long a search takes
+    def _record_primary(self, secs, future=None):
+        if future is not None and (future.cancelled() or future.exception() is not None):
+            return
+        with self._lock:
+            self.primary_latencies.append(secs)
+
+
+# The pct percentile of a sorted list
+def percentile(values, pct):
+    return values[min(len(values) - 1, int(pct / 100.0 * len(values)))]
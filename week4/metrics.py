@@ -0,0 +1,162 @@
+#
+# Per-stage latency metrics for the search app.  Each search request gets a SearchTimer that records how long each stage
+# took (filter parsing, prior lookup, classification, query building, OpenSearch, rendering).  When the request is done,
+# the timings are added to a histogram per (model, stage) and returned to the browser as a Server-Timing header.
+#
+# The histograms are exposed in the Prometheus text format at /metrics.  They are per process, so when running several
+# workers, scrape each of them (or sum them up) to get the whole picture.
+#
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Blueprint, Response, current_app, make_response
+
+# the models the search page supports, plus the compare page which runs all of them and the explain page.  Anything
+# else is reported as simple, since that is what query() falls back to
+MODELS = ["simple", "hand_tuned", "simple_LTR", "ht_LTR", "compare", "explain"]
+# in seconds
+DEFAULT_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+bp = Blueprint('metrics', __name__)
+
+
+class Histogram:
+
+    def __init__(self, buckets=DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    # Estimate a percentile from the bucket counts, using the upper bound of the bucket the percentile falls in
+    def percentile(self, pct):
+        if self.count == 0:
+            return None
+        rank = pct / 100.0 * self.count
+        seen = 0
+        for idx, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.buckets[idx] if idx < len(self.buckets) else float("inf")
+        return float("inf")
+
+
+class SearchMetrics:
+
+    def __init__(self, buckets=DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self.stages = {}  # (model, stage) -> Histogram
+        self.requests = {}  # model -> Histogram of the total request time
+        self._lock = threading.Lock()
+
+    def observe(self, timer):
+        model = timer.model if timer.model in MODELS else "simple"
+        with self._lock:
+            for (stage, secs) in timer.timings.items():
+                histogram = self.stages.get((model, stage))
+                if histogram is None:
+                    histogram = self.stages[(model, stage)] = Histogram(self.buckets)
+                histogram.observe(secs)
+            histogram = self.requests.get(model)
+            if histogram is None:
+                histogram = self.requests[model] = Histogram(self.buckets)
+            histogram.observe(timer.elapsed())
+
+    # Render everything in the Prometheus text exposition format
+    def to_prometheus(self):
+        lines = []
+        with self._lock:
+            lines.append("# HELP search_stage_seconds Time spent in each stage of a search request.")
+            lines.append("# TYPE search_stage_seconds histogram")
+            for (model, stage), histogram in sorted(self.stages.items()):
+                self.__append_histogram(lines, "search_stage_seconds", 'model="%s",stage="%s"' % (model, stage), histogram)
+            lines.append("# HELP search_request_seconds Total time spent on a search request.")
+            lines.append("# TYPE search_request_seconds histogram")
+            for model, histogram in sorted(self.requests.items()):
+                self.__append_histogram(lines, "search_request_seconds", 'model="%s"' % model, histogram)
+        return "\n".join(lines) + "\n"
+
+    def __append_histogram(self, lines, name, labels, histogram):
+        cumulative = 0
+        for bucket, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            lines.append('%s_bucket{%s,le="%s"} %s' % (name, labels, bucket, cumulative))
+        lines.append('%s_bucket{%s,le="+Inf"} %s' % (name, labels, histogram.count))
+        lines.append("%s_sum{%s} %.6f" % (name, labels, histogram.sum))
+        lines.append("%s_count{%s} %s" % (name, labels, histogram.count))
+
+
+# Records the time spent in each stage of a single request.  Not thread-safe, each request gets its own.
+class SearchTimer:
+
+    def __init__(self, model=None) -> None:
+        self.model = model
+        self.start = time.perf_counter()
+        self.timings = {}  # stage name -> seconds, in the order the stages ran
+
+    @contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def record(self, stage, secs):
+        self.timings[stage] = self.timings.get(stage, 0.0) + secs
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    # See https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Server-Timing.  Durations are in milliseconds.
+    def server_timing(self):
+        timings = ["%s;dur=%.2f" % (stage, secs * 1000) for stage, secs in self.timings.items()]
+        timings.append("total;dur=%.2f" % (self.elapsed() * 1000))
+        return ", ".join(timings)
+
+
+# Add the request's timings to the app's metrics and return the response body with a Server-Timing header
+def finish_request(timer, body):
+    search_metrics = current_app.config.get("search_metrics")
+    if search_metrics is not None:
+        search_metrics.observe(timer)
+    response = make_response(body)
+    response.headers["Server-Timing"] = timer.server_timing()
+    return response
+
+
+# Render a stats() dict (e.g. from QueryClassifier) as Prometheus gauges named <prefix>_<stat>
+def stats_to_prometheus(prefix, stats):
+    return "".join("%s_%s %s\n" % (prefix, name, value) for name, value in stats.items())
+
+
+@bp.route('/metrics')
+def metrics():
+    search_metrics = current_app.config.get("search_metrics")
+    body = search_metrics.to_prometheus() if search_metrics is not None else ""
+    query_classifier = current_app.config.get("query_classifier")
+    if query_classifier is not None:
+        body += stats_to_prometheus("query_classifier", query_classifier.stats())
+    search_cache = current_app.config.get("search_cache")
+    if search_cache is not None:
+        body += stats_to_prometheus("search_cache", search_cache.stats())
+    rescore_windows = current_app.config.get("rescore_windows")
+    if rescore_windows is not None:
+        body += stats_to_prometheus("rescore_windows", rescore_windows.stats())
+    single_flight = current_app.config.get("single_flight")
+    if single_flight is not None:
+        body += stats_to_prometheus("search_single_flight", single_flight.stats())
+    hedger = current_app.config.get("hedger")
+    if hedger is not None:
+        body += stats_to_prometheus("search_hedge", hedger.stats())
+    degrader = current_app.config.get("degrader")
+    if degrader is not None:
+        body += stats_to_prometheus("search_degradation", degrader.stats())
+    return Response(body, mimetype="text/plain; version=0.0.4")
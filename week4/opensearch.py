@@ -1,25 +1,89 @@
-from flask import g, current_app
-from opensearchpy import OpenSearch
+import asyncio
+import threading
+import weakref
 
-# Create an OpenSearch client instance and put it into Flask shared space for use by the application
+from flask import current_app
+from opensearchpy import AsyncOpenSearch, OpenSearch
+
+# One client per process.  The client owns a urllib3 connection pool, so sharing it across requests means we only pay
+# for the TLS handshake when the pool grows, instead of on every request.
+_opensearch = None
+_opensearch_lock = threading.Lock()
+# The asyncio app's clients (see asgi.py), one per event loop: the client's aiohttp session belongs to the loop it was
+# created on
+_async_opensearch = weakref.WeakKeyDictionary()
+
+
+# Build an OpenSearch client from the app config.  See create_app for the OPENSEARCH_* settings and their defaults.
+def create_opensearch(config):
+    host = config.get("OPENSEARCH_HOST", "localhost")
+    port = int(config.get("OPENSEARCH_PORT", 9200))
+    auth = (config.get("OPENSEARCH_USER", "admin"), config.get("OPENSEARCH_PASSWORD", "admin"))  # For testing only. Set these in config.py or the environment.
+
+    return OpenSearch(
+        hosts=[{'host': host, 'port': port}],
+        http_compress=True,  # enables gzip compression for request bodies
+        http_auth=auth,
+        # client_cert = client_cert_path,
+        # client_key = client_key_path,
+        use_ssl=config.get("OPENSEARCH_USE_SSL", True),
+        verify_certs=config.get("OPENSEARCH_VERIFY_CERTS", False), # set to true if you have certs
+        ssl_assert_hostname=False,
+        ssl_show_warn=False,
+        pool_maxsize=int(config.get("OPENSEARCH_POOL_MAXSIZE", 10)),  # should be >= the number of threads per worker
+        headers={"Connection": "keep-alive"},
+        timeout=float(config.get("OPENSEARCH_TIMEOUT", 10)),
+        # Retries are for connection errors.  Retrying a timed out search would wait OPENSEARCH_TIMEOUT all over again,
+        # long after the user (and SEARCH_DEADLINE) gave up on it.
+        max_retries=int(config.get("OPENSEARCH_MAX_RETRIES", 3)),
+        retry_on_timeout=config.get("OPENSEARCH_RETRY_ON_TIMEOUT", False),
+    )
+
+
+# Get the process-wide OpenSearch client, creating it on first use.  We create it lazily rather than in create_app so
+# that a pre-forking server (e.g. gunicorn) gives each worker its own pool instead of sharing sockets across processes.
 def get_opensearch():
-    if 'opensearch' not in g:
-        # Load from config?
-        host = 'localhost'
-        port = 9200
-        auth = ('admin', 'admin')  # For testing only. Don't store credentials in code.
-
-        g.opensearch = OpenSearch(
-            hosts=[{'host': host, 'port': port}],
-            http_compress=True,  # enables gzip compression for request bodies
-            http_auth=auth,
-            # client_cert = client_cert_path,
-            # client_key = client_key_path,
-            use_ssl=True,
-            verify_certs=False, # set to true if you have certs
-            ssl_assert_hostname=False,
-            ssl_show_warn=False,
-
-        )
-
-    return g.opensearch
+    global _opensearch
+    if _opensearch is None:
+        with _opensearch_lock:
+            if _opensearch is None:
+                _opensearch = create_opensearch(current_app.config)
+    return _opensearch
+
+
+# The same as create_opensearch, but for asyncio.  Requests wait for a free connection rather than a thread, so
+# OPENSEARCH_ASYNC_POOL_MAXSIZE caps how many searches a process has in flight.
+def create_async_opensearch(config):
+    host = config.get("OPENSEARCH_HOST", "localhost")
+    port = int(config.get("OPENSEARCH_PORT", 9200))
+    auth = (config.get("OPENSEARCH_USER", "admin"), config.get("OPENSEARCH_PASSWORD", "admin"))
+
+    return AsyncOpenSearch(
+        hosts=[{'host': host, 'port': port}],
+        http_compress=True,
+        http_auth=auth,
+        use_ssl=config.get("OPENSEARCH_USE_SSL", True),
+        verify_certs=config.get("OPENSEARCH_VERIFY_CERTS", False),
+        ssl_assert_hostname=False,
+        ssl_show_warn=False,
+        maxsize=int(config.get("OPENSEARCH_ASYNC_POOL_MAXSIZE", 100)),
+        timeout=float(config.get("OPENSEARCH_TIMEOUT", 10)),
+        max_retries=int(config.get("OPENSEARCH_MAX_RETRIES", 3)),
+        retry_on_timeout=config.get("OPENSEARCH_RETRY_ON_TIMEOUT", False),
+    )
+
+
+# Get the running event loop's AsyncOpenSearch client, creating it on first use
+def get_async_opensearch():
+    loop = asyncio.get_running_loop()
+    opensearch = _async_opensearch.get(loop)
+    if opensearch is None:
+        opensearch = _async_opensearch[loop] = create_async_opensearch(current_app.config)
+    return opensearch
+
+
+# Close the running event loop's client, if it has one, e.g. when the server shuts down
+async def close_async_opensearch():
+    opensearch = _async_opensearch.pop(asyncio.get_running_loop(), None)
+    if opensearch is not None:
+        await opensearch.close()
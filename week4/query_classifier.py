@@ -0,0 +1,121 @@
+#
+# Wraps the fastText query classification model so we don't run it on every request.  Our query distribution is very
+# skewed, so we cache the prediction for each (normalized) query in an LRU.  On a miss, concurrent requests are collected
+# into micro-batches so that fastText is called once per batch instead of once per query.
+#
+# We cache the raw prediction and its confidence, and only turn it into a category in get_category, so a prediction below
+# the threshold is never used as a filter, even once it is cached.
+#
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from queue import Empty, Queue
+
+import week4.utilities.query_utils as qu
+
+LABEL_PREFIX = "__label__"
+
+
+class QueryClassifier:
+
+    def __init__(self, model, threshold=0.5, cache_size=10000, batch_wait=0.002, max_batch=64) -> None:
+        self.model = model
+        self.threshold = threshold
+        self.cache_size = cache_size
+        self.batch_wait = batch_wait  # seconds to wait for more queries to join a batch.  0 turns batching off.
+        self.max_batch = max_batch
+        self.hits = 0
+        self.misses = 0
+        self.batches = 0
+        self.batched_queries = 0
+        self._cache = OrderedDict()  # normalized query -> (category, confidence)
+        self._lock = threading.Lock()
+        self._queue = Queue()
+        self._worker = None
+
+    # The category to filter on, or None if we aren't confident enough in the prediction
+    def get_category(self, user_query):
+        (category, confidence) = self.predict(user_query)
+        if category is None or confidence < self.threshold:
+            return None
+        return category
+
+    # The top category and its confidence, whatever the confidence
+    def predict(self, user_query):
+        norm_query = qu.normalize_query(user_query)
+        if not norm_query:
+            return None, 0.0
+        with self._lock:
+            prediction = self._cache.get(norm_query)
+            if prediction is not None:
+                self._cache.move_to_end(norm_query)
+                self.hits += 1
+                return prediction
+            self.misses += 1
+        if self.batch_wait > 0:
+            prediction = self._predict_batched(norm_query)
+        else:
+            prediction = self._predict_all([norm_query])[norm_query]
+        with self._lock:
+            self._cache[norm_query] = prediction
+            self._cache.move_to_end(norm_query)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return prediction
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self._cache), "hits": self.hits, "misses": self.misses,
+                    "hit_rate": self.hits / lookups if lookups else 0.0,
+                    "batches": self.batches, "batched_queries": self.batched_queries}
+
+    # Hand the query to the batching thread and wait for its prediction
+    def _predict_batched(self, norm_query):
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((norm_query, future))
+        return future.result()
+
+    # Start the batching thread on first use, so a pre-forking server starts one per worker
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run_batches, name="query-classifier", daemon=True)
+                    self._worker.start()
+
+    def _run_batches(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.batch_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except Empty:
+                    break
+            try:
+                predictions = self._predict_all(list(dict.fromkeys(norm_query for (norm_query, future) in batch)))
+                for (norm_query, future) in batch:
+                    future.set_result(predictions[norm_query])
+            except Exception as e:
+                for (norm_query, future) in batch:
+                    future.set_exception(e)
+
+    # Run the model once over all the queries.  Returns normalized query -> (category, confidence)
+    def _predict_all(self, norm_queries):
+        (labels, probs) = self.model.predict(norm_queries, k=1)
+        with self._lock:
+            self.batches += 1
+            self.batched_queries += len(norm_queries)
+        predictions = {}
+        for norm_query, query_labels, query_probs in zip(norm_queries, labels, probs):
+            if len(query_labels) == 0:
+                predictions[norm_query] = (None, 0.0)
+            else:
+                predictions[norm_query] = (query_labels[0].replace(LABEL_PREFIX, "", 1), float(query_probs[0]))
+        return predictions
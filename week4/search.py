@@ -1,17 +1,56 @@
 #
 # The main search hooks for the Search Flask application.
 #
+import hashlib
+import json
+import logging
+import time
+
+from opensearchpy import NotFoundError
 from flask import (
-    Blueprint, redirect, render_template, request, url_for, current_app
+    Blueprint, Response, g, redirect, render_template, request, url_for, current_app
 )
 
+try:
+    import orjson  # much faster than json for the API responses, but optional
+except ImportError:
+    orjson = None
+
+from week4.metrics import SearchTimer, finish_request
+
 from week4.opensearch import get_opensearch
+from week4.search_cache import SearchCache
 
 import week4.utilities.query_utils as qu
 import week4.utilities.ltr_utils as lu
+import week4.utilities.search_utils as su
 
 bp = Blueprint('search', __name__, url_prefix='/search')
 
+# Query objects are big, so we only log them at DEBUG.  Pass the objects as arguments (not pre-formatted strings) so that
+# nothing gets formatted unless DEBUG is on.
+logger = logging.getLogger(__name__)
+
+# TODO: Make these parameters
+LTR_STORE_NAME = "week2"
+LTR_MODEL_NAME = "ltr_model"
+# a unique field to break ties on, so that search_after doesn't skip or repeat hits with the same sort value
+SORT_TIEBREAKER = "sku.keyword"
+# The model whose query the LTR models rescore, which we page through once we're past the end of the rescore window
+FIRST_PHASE_MODELS = {"simple_LTR": "simple", "ht_LTR": "hand_tuned"}
+# The models shown side by side on the compare page, in order, and the fields it displays
+COMPARE_MODELS = ["simple", "hand_tuned", "simple_LTR", "ht_LTR"]
+COMPARE_SOURCE = ["sku", "productId", "name", "regularPrice", "image"]
+# The fields and the most hits the JSON API returns
+API_SOURCE = ["sku", "name"]
+API_MAX_SIZE = 500
+# search_utils.get_explain_query_for_type's name for each model
+EXPLAIN_TYPES = {"simple": "simple", "hand_tuned": "hand_tuned", "simple_LTR": "ltr_simple", "ht_LTR": "ltr_hand_tuned"}
+# The pages that count towards the requests in flight and the recent latency (see degradation.py), and the least time we
+# give OpenSearch when a request is already past its deadline
+DEGRADED_ENDPOINTS = {"search.query", "search.api"}
+MIN_SEARCH_TIMEOUT_MS = 50
+
 
 # Process the filters requested by the user and return a tuple that is appropriate for use in: the query, URLs displaying the filter and the display of the applied filters
 # filters -- convert the URL GET structure into an OpenSearch filter query
@@ -30,7 +69,7 @@ def process_filters(filters_input):
         if type == "range":
             from_val = request.args.get(filter + ".from", None)
             to_val = request.args.get(filter + ".to", None)
-            print("from: {}, to: {}".format(from_val, to_val))
+            logger.debug("from: %s, to: %s", from_val, to_val)
             # we need to turn the "to-from" syntax of aggregations to the "gte,lte" syntax of range filters.
             to_from = {}
             if from_val:
@@ -52,124 +91,775 @@ def process_filters(filters_input):
             filters.append(the_filter)
             display_filters.append("{}: {}".format(display_name, key))
             applied_filters += "&{}.fieldName={}&{}.key={}".format(filter, field, filter, key)
-    print("Filters: {}".format(filters))
+    logger.debug("Filters: %s", filters)
 
     return filters, display_filters, applied_filters
 
-def get_query_category(user_query, query_class_model):
-    print("IMPLEMENT ME: get_query_category")
-    return None
+# The category to filter on, or None if we have no classifier or it isn't confident enough.  See QueryClassifier
+def get_query_category(user_query, query_classifier):
+    if query_classifier is None:
+        return None
+    query_category = query_classifier.get_category(user_query)
+    logger.debug("category: %s", query_category)
+    return query_category
 
 
-@bp.route('/query', methods=['GET', 'POST'])
-def query():
-    opensearch = get_opensearch()
-    # Put in your code to query opensearch.  Set error as appropriate.
-    error = None
-    user_query = None
-    query_obj = None
-    display_filters = None
-    applied_filters = ""
-    filters = None
-    sort = "_score"
-    sortDir = "desc"
-    model = "simple"
-    # TODO: Make these parameters
-    ltr_store_name = "week2"
-    ltr_model_name = "ltr_model"
-    explain = False
-    if request.method == 'POST':  # a query has been submitted
-        user_query = request.form['query']
-        if not user_query:
-            user_query = "*"
-        sort = request.form["sort"]
-        if not sort:
-            sort = "_score"
-        sortDir = request.form["sortDir"]
-        if not sortDir:
-            sortDir = "desc"
-        explain_val = request.form.get("explain", "false")
-        if explain_val == "true":
-            explain = True
-        model = request.form.get("model", "simple")
-        click_prior = get_click_prior(user_query)
+# What to do with the query's predicted category: "filter" to the category when the classifier is confident
+# (QUERY_CLASS_THRESHOLD), "boost" it when it is less sure (QUERY_CLASS_BOOST_THRESHOLD), otherwise nothing (None).
+# category=off in the request turns it off, and match all (*) searches, which are about no category, skip it.  Returns
+# (category, action).
+def classify_query(user_query, query_classifier, params):
+    if query_classifier is None or params.get("category") == "off" or qu.normalize_query(user_query) in ("", "*"):
+        return None, None
+    (category, confidence) = query_classifier.predict(user_query)
+    logger.debug("category: %s (%s)", category, confidence)
+    if category is None:
+        return None, None
+    if confidence >= current_app.config["QUERY_CLASS_THRESHOLD"]:
+        return category, "filter"
+    if confidence >= current_app.config["QUERY_CLASS_BOOST_THRESHOLD"]:
+        return category, "boost"
+    return None, None
 
-        if model == "simple_LTR":
-            query_obj = qu.create_simple_baseline(user_query, click_prior, [], sort, sortDir, size=500)  # We moved create_query to a utility class so we could use it elsewhere.
-            query_obj = lu.create_rescore_ltr_query(user_query, query_obj, click_prior, ltr_model_name, ltr_store_name,
-                                                    rescore_size=500, main_query_weight=0)
-            print("Simple LTR q: %s" % query_obj)
-        elif model == "ht_LTR":
-            query_obj = qu.create_query(user_query, click_prior, [], sort, sortDir, size=500)  # We moved create_query to a utility class so we could use it elsewhere.
-            query_obj = lu.create_rescore_ltr_query(user_query, query_obj, click_prior, ltr_model_name, ltr_store_name,
-                                                    rescore_size=500, main_query_weight=0)
-            print("LTR q: %s" % query_obj)
-        elif model == "hand_tuned":
-            query_obj = qu.create_query(user_query, click_prior, [], sort, sortDir, size=100)  # We moved create_query to a utility class so we could use it elsewhere.
-            print("Hand tuned q: %s" % query_obj)
-        else:
-            query_obj = qu.create_simple_baseline(user_query, click_prior, [], sort, sortDir, size=100)  # We moved create_query to a utility class so we could use it elsewhere.
-            print("Plain ol q: %s" % query_obj)
-    elif request.method == 'GET':  # Handle the case where there is no query or just loading the page
-        user_query = request.args.get("query", "*")
+
+def create_category_filter(category):
+    return {"term": {current_app.config["QUERY_CLASS_FIELD"]: category}}
+
+
+# Score the docs in the category higher without changing which docs match: the original query has to match and the
+# category clause only adds to the score
+def add_category_boost(query_obj, category):
+    if category is None:
+        return query_obj
+    boost_clause = {"term": {current_app.config["QUERY_CLASS_FIELD"]: {"value": category, "boost": current_app.config["QUERY_CLASS_BOOST"]}}}
+    query_obj["query"] = {"bool": {"must": [query_obj["query"]], "should": [boost_clause]}}
+    return query_obj
+
+
+# Pull the search parameters out of the request.  POSTs come from the search box, GETs come from the links on the results
+# page (filters, sorting) or from loading the page.
+def get_search_params():
+    params = {
+        "user_query": None,
+        "filters": None,
+        "display_filters": None,
+        "applied_filters": "",
+        "sort": "_score",
+        "sortDir": "desc",
+        "model": "simple",
+        "explain": False,  # link each hit to /search/explain
+        "page": 1,
+        "search_after": None,  # the sort values of the last hit on the previous page
+        "pit": None,  # the point in time id we are paging through, if any
+        "window": None,  # the id of the LTR rescore window we are paging through, if any
+        "start": None,  # where the first phase order picks up after the LTR rescore window
+        "category": None  # "off" to search without the predicted category, see classify_query
+    }
+    if request.method == 'POST':  # a query has been submitted
+        params["user_query"] = request.form['query'] or "*"
+        params["filters"] = []
+        params["sort"] = request.form["sort"] or "_score"
+        params["sortDir"] = request.form["sortDir"] or "desc"
+        params["explain"] = request.form.get("explain", "false") == "true"
+        params["model"] = request.form.get("model", "simple")
+    else:  # Handle the case where there is no query or just loading the page
+        params["user_query"] = request.args.get("query", "*")
         filters_input = request.args.getlist("filter.name")
-        sort = request.args.get("sort", sort)
-        sortDir = request.args.get("sortDir", sortDir)
-        explain_val = request.args.get("explain", "false")
-        click_prior = get_click_prior(user_query)
-        if explain_val == "true":
-            explain = True
+        params["sort"] = request.args.get("sort", params["sort"])
+        params["sortDir"] = request.args.get("sortDir", params["sortDir"])
+        params["explain"] = request.args.get("explain", "false") == "true"
         if filters_input:
-            (filters, display_filters, applied_filters) = process_filters(filters_input)
-        model = request.args.get("model", "simiple")
-        if model == "simple_LTR":
-            query_obj = qu.create_simple_baseline(user_query, click_prior, filters, sort, sortDir, size=500)
-            query_obj = lu.create_rescore_ltr_query(user_query, query_obj, click_prior, ltr_model_name, ltr_store_name, rescore_size=500)
-        elif model == "ht_LTR":
-            query_obj = qu.create_query(user_query, click_prior, filters, sort, sortDir, size=100)
-            query_obj = lu.create_rescore_ltr_query(user_query, query_obj, click_prior, ltr_model_name, ltr_store_name, rescore_size=100)
-        elif model == "hand_tuned":
-            query_obj = qu.create_query(user_query, click_prior, filters, sort, sortDir, size=100)
-        else:
-            query_obj = qu.create_simple_baseline(user_query, click_prior, filters, sort, sortDir, size=100)
+            (params["filters"], params["display_filters"], params["applied_filters"]) = process_filters(filters_input)
+        params["model"] = request.args.get("model", "simple")
+        params["page"] = max(request.args.get("page", 1, type=int), 1)
+        search_after = request.args.get("search_after")
+        if search_after:
+            try:
+                params["search_after"] = json.loads(search_after)
+            except ValueError:
+                params["page"] = 1  # start over
+        params["pit"] = request.args.get("pit")
+        params["window"] = request.args.get("window")
+        params["start"] = request.args.get("start", type=int)
+        params["category"] = request.args.get("category")
+    return params
+
+
+# Create the query for the given model.  Searches submitted from the search box (POST) rescore a bigger hand tuned window
+# and rely solely on the LTR score, see the POST handling in query()
+def create_search_query(user_query, click_prior, filters, sort, sortDir, model, ltr_model_name, ltr_store_name,
+                        ht_ltr_size=100, main_query_weight=1, highlight=True, source=None, size=100, sort_tiebreaker=None,
+                        fuzzy=True, rescore_size=None, include_aggs=True):
+    if model == "simple_LTR":
+        window = min(500, rescore_size or 500)
+        query_obj = qu.create_simple_baseline(user_query, click_prior, filters, sort, sortDir, size=window, highlight=highlight, source=source, fuzzy=fuzzy)  # We moved create_query to a utility class so we could use it elsewhere.
+        query_obj = lu.create_rescore_ltr_query(user_query, query_obj, click_prior, ltr_model_name, ltr_store_name,
+                                                rescore_size=window, main_query_weight=main_query_weight)
+    elif model == "ht_LTR":
+        window = min(ht_ltr_size, rescore_size or ht_ltr_size)
+        query_obj = qu.create_query(user_query, click_prior, filters, sort, sortDir, size=window, highlight=highlight, source=source,
+                                    fuzzy=fuzzy)
+        query_obj = lu.create_rescore_ltr_query(user_query, query_obj, click_prior, ltr_model_name, ltr_store_name,
+                                                rescore_size=window, main_query_weight=main_query_weight)
+    elif model == "hand_tuned":
+        query_obj = qu.create_query(user_query, click_prior, filters, sort, sortDir, size=size, highlight=highlight, source=source,
+                                    sort_tiebreaker=sort_tiebreaker, fuzzy=fuzzy)
+    else:
+        query_obj = qu.create_simple_baseline(user_query, click_prior, filters, sort, sortDir, size=size, highlight=highlight, source=source,
+                                              sort_tiebreaker=sort_tiebreaker, fuzzy=fuzzy)
+    if not include_aggs:
+        query_obj.pop("aggs", None)
+    logger.debug("%s q: %s", model, query_obj)
+    return query_obj
+
+
+# Same as create_search_query, but returns a request for the model's stored search template (see
+# query_utils.create_search_templates) so that we only send the parameters to OpenSearch
+def create_search_template_request(user_query, click_prior, filters, sort, sortDir, model, ltr_model_name, ltr_store_name,
+                                   ht_ltr_size=100, main_query_weight=1, highlight=True, source=None, size=100, sort_tiebreaker=None,
+                        fuzzy=True, rescore_size=None, include_aggs=True):
+    if model not in qu.TEMPLATE_MODELS:
+        model = "simple"
+    if model == "simple_LTR":
+        window = min(500, rescore_size or 500)
+        params = qu.create_search_template_params(user_query, click_prior, filters, sort, sortDir, size=window, source=source,
+                                                  ltr_model_name=ltr_model_name, ltr_store_name=ltr_store_name,
+                                                  rescore_size=window, main_query_weight=main_query_weight, fuzzy=fuzzy)
+    elif model == "ht_LTR":
+        window = min(ht_ltr_size, rescore_size or ht_ltr_size)
+        params = qu.create_search_template_params(user_query, click_prior, filters, sort, sortDir, size=window, source=source,
+                                                  ltr_model_name=ltr_model_name, ltr_store_name=ltr_store_name,
+                                                  rescore_size=window, main_query_weight=main_query_weight, fuzzy=fuzzy)
     else:
-        query_obj = qu.create_query("*", "", [], sort, sortDir, size=100)
-
-    query_class_model = current_app.config["query_model"]
-    query_category = get_query_category(user_query, query_class_model)
-    if query_category is not None:
-        print("IMPLEMENT ME: add this into the filters object so that it gets applied at search time.  This should look like your `term` filter from week 1 for department but for categories instead")
-    #print("query obj: {}".format(query_obj))
-    response = opensearch.search(body=query_obj, index=current_app.config["index_name"], explain=explain)
+        params = qu.create_search_template_params(user_query, click_prior, filters, sort, sortDir, size=size, source=source,
+                                                  sort_tiebreaker=sort_tiebreaker, fuzzy=fuzzy)
+    template_request = {"id": qu.get_search_template_id(model, highlight=highlight, include_aggs=include_aggs), "params": params}
+    logger.debug("%s template q: %s", model, template_request)
+    return template_request
+
+
+def dumps_json(obj):
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":"))
+
+
+def is_ltr_model(model):
+    return model in ("simple_LTR", "ht_LTR")
+
+
+# In two phase retrieval, the LTR models rescore their window without fetching _source or highlighting, and then we
+# fetch the documents for just the page we display.  See fetch_page.
+def use_two_phase_retrieval(model):
+    return current_app.config.get("TWO_PHASE_RETRIEVAL") and is_ltr_model(model)
+
+
+# Once the spelling corrector has loaded, it takes care of typos and we can drop the (expensive) fuzzy name match
+def use_fuzzy_matching():
+    return not (current_app.config.get("SPELLING_REPLACES_FUZZY") and current_app.config.get("spelling_corrector") is not None)
+
+
+# A correction for the query if it didn't find much, otherwise None
+def get_did_you_mean(user_query, response):
+    spelling_corrector = current_app.config.get("spelling_corrector")
+    if spelling_corrector is None or response["hits"]["total"]["value"] >= current_app.config["SPELLING_MIN_HITS"]:
+        return None
+    return spelling_corrector.correct(user_query)
+
+
+# The steps to degrade this search by, none unless we're under load.  See degradation.py
+def get_degradation_steps():
+    degrader = current_app.config.get("degrader")
+    return degrader.get_steps() if degrader is not None else []
+
+
+# Have OpenSearch stop at what's left of the request's SEARCH_DEADLINE and return what it found by then.  Templates can't
+# take a timeout, so they only get the other degradation steps.
+def add_deadline(query_obj, timer):
+    deadline = current_app.config.get("SEARCH_DEADLINE")
+    if not deadline or ("id" in query_obj and "params" in query_obj):
+        return query_obj
+    remaining_ms = max(int((deadline - timer.elapsed()) * 1000), MIN_SEARCH_TIMEOUT_MS)
+    query_obj["timeout"] = "%dms" % remaining_ms
+    return query_obj
+
+
+# Responses that hit their deadline are partial, so we don't cache them
+def is_complete_response(response):
+    return not response.get("timed_out")
+
+
+@bp.before_request
+def start_request():
+    degrader = current_app.config.get("degrader")
+    if degrader is not None and request.endpoint in DEGRADED_ENDPOINTS:
+        g.degrader_start = time.perf_counter()
+        degrader.start()
+
+
+@bp.teardown_request
+def end_request(exception=None):
+    degrader = current_app.config.get("degrader")
+    start = g.pop("degrader_start", None)
+    if degrader is not None and start is not None:
+        degrader.finish(time.perf_counter() - start)
+
+
+# The templates always count everything, see limit_counting
+def use_search_templates(user_query):
+    return (current_app.config.get("USE_SEARCH_TEMPLATES") and qu.can_use_search_template(user_query)
+            and not use_cheap_counting(user_query))
+
+
+# Broad queries ("*" and single words) match most of the index, and counting their hits and computing their facets is
+# most of what they cost, so we cap the count and sample the facets for them
+def use_cheap_counting(user_query):
+    if not current_app.config.get("CHEAP_COUNTING"):
+        return False
+    words = qu.normalize_query(user_query).split()
+    return len(words) <= current_app.config["CHEAP_COUNTING_MAX_WORDS"]
+
+
+# See query_utils.limit_counting.  Use qu.unwrap_sampled_aggs on the response.
+def limit_counting(query_obj, user_query):
+    if use_cheap_counting(user_query) and not ("id" in query_obj and "params" in query_obj):
+        config = current_app.config
+        qu.limit_counting(query_obj, track_total_hits=config["CHEAP_TRACK_TOTAL_HITS"], shard_size=config["FACET_SAMPLE_SHARD_SIZE"],
+                          diversify_field=config["FACET_SAMPLE_DIVERSIFY_FIELD"] or None,
+                          max_docs_per_value=config["FACET_SAMPLE_MAX_DOCS_PER_VALUE"])
+    return query_obj
+
+
+@bp.route('/query', methods=['GET', 'POST'])
+def query():
+    timer = SearchTimer()
+    # Put in your code to query opensearch.  Set error as appropriate.
+    error = None
+    with timer.time("parse"):
+        params = get_search_params()
+    result = run_sync(run_search(SyncSearcher(get_opensearch()), params, timer, current_app.config["RESULTS_PAGE_SIZE"]))
     # Postprocess results here if you so desire
+    did_you_mean = None
+    if params["page"] == 1:
+        with timer.time("spelling"):
+            did_you_mean = get_did_you_mean(params["user_query"], result["response"])
 
-    #print(response)
+    #logger.debug("response: %s", response)
     if error is None:
-        return render_template("search_results.jinja2", query=user_query, search_response=response,
-                               display_filters=display_filters, applied_filters=applied_filters,
-                               sort=sort, sortDir=sortDir, model=model, explain=explain, query_category=query_category)
+        with timer.time("render"):
+            html = render_results(params, result, did_you_mean)
+        return finish_request(timer, html)
     else:
         redirect(url_for("index"))
 
 
-def get_click_prior(user_query):
-    click_prior = ""
-    if current_app.config.get("priors_gb"):
+# A JSON version of query() for programs (and load tests): the same parameters and the same search, but it returns just
+# the sku, name and score of each hit (plus the facets, if facets=true) and skips the HTML rendering.  size sets the number
+# of hits per page, default RESULTS_PAGE_SIZE.  Pass next_page's arguments back to get the next page.
+@bp.route('/api', methods=['GET', 'POST'])
+def api():
+    timer = SearchTimer()
+    with timer.time("parse"):
+        params = get_search_params()
+        (size, include_facets) = get_api_params()
+    result = run_sync(run_search(SyncSearcher(get_opensearch()), params, timer, size, source=API_SOURCE, highlight=False,
+                                 include_aggs=include_facets))
+    with timer.time("render"):
+        body = Response(dumps_json(create_api_result(params, result, include_facets)), mimetype="application/json")
+    return finish_request(timer, body)
+
+
+# The API's page size and whether it returns the facets
+def get_api_params():
+    values = request.values
+    size = max(min(values.get("size", current_app.config["RESULTS_PAGE_SIZE"], type=int), API_MAX_SIZE), 0)
+    include_facets = values.get("facets", "false").lower() == "true"
+    return size, include_facets
+
+
+# The search behind query() and api(): the prior lookup, the query classification (and the fallback when the category
+# finds nothing), degradation and the deadline, and paging, through the LTR rescore window and past it or with
+# search_after.  Returns the page of results (with the sampled facets unwrapped) and what the page needs to show about
+# it: the paging args for the next page (None on the last page), the predicted category and what we did with it, and how
+# we degraded the search.
+#
+# It's async so that the asyncio app (see asgi.py) can await OpenSearch without tying up a thread.  searcher makes the
+# OpenSearch calls and runs the blocking work (prior lookup, classification); the Flask views pass a SyncSearcher, whose
+# awaits never suspend, and run the search with run_sync.
+async def run_search(searcher, params, timer, page_size, source=None, highlight=True, include_aggs=True):
+    user_query = params["user_query"]
+    filters = params["filters"]
+    sort = params["sort"]
+    sortDir = params["sortDir"]
+    model = params["model"]
+    page = params["page"]
+    timer.model = model
+    index_name = current_app.config["index_name"]
+    with timer.time("prior"):
+        click_prior = await searcher.run(get_click_prior, user_query)
+    with timer.time("classify"):
+        (query_category, category_action) = await searcher.run(classify_query, user_query,
+                                                                current_app.config.get("query_classifier"), params)
+    # Under load we search more cheaply, see degradation.py
+    degraded = get_degradation_steps()
+    rescore_size = current_app.config["DEGRADED_RESCORE_SIZE"] if "shrink_rescore" in degraded else None
+    include_aggs = include_aggs and "drop_aggs" not in degraded
+    highlight = highlight and "skip_highlight" not in degraded
+    if degraded:
+        logger.info("Degrading %s search for %s: %s", model, user_query, degraded)
+    fuzzy = use_fuzzy_matching()
+    # We search within the predicted category, unless that finds nothing, in which case the prediction was probably wrong
+    # and we search again without it
+    while True:
+        search_filters = filters
+        category_boost = None
+        if category_action == "filter":
+            search_filters = (filters or []) + [create_category_filter(query_category)]
+        elif category_action == "boost":
+            category_boost = query_category
+        # POST and GET build slightly different LTR queries, so keep their cache entries apart
+        cache_key = get_search_cache_key(user_query, search_filters, sort, sortDir, model, LTR_STORE_NAME, LTR_MODEL_NAME,
+                                         [request.method, category_boost, page_size, source, highlight, include_aggs] + degraded)
+        next_page = None  # the paging args for the next page, if there is one
+        # Past the end of the rescore window there are no LTR scores, so the LTR models carry on in first phase order
+        past_window = is_ltr_model(model) and page > 1 and (params["start"] is not None or params["search_after"] is not None)
+        if is_ltr_model(model) and not past_window:
+            # We page through the rescore window rather than rescoring again for every page, so that the pages are
+            # consistent with each other
+            two_phase = use_two_phase_retrieval(model)
+            window = get_rescore_window(params["window"]) if page > 1 else None
+            window_id = params["window"] if window is not None else get_rescore_window_id(cache_key)
+            if window is None:
+                with timer.time("build_query"):
+                    create = create_search_template_request if use_search_templates(user_query) and category_boost is None else create_search_query
+                    if request.method == 'POST':
+                        query_obj = create(user_query, click_prior, search_filters, sort, sortDir, model, LTR_MODEL_NAME, LTR_STORE_NAME,
+                                           ht_ltr_size=500, main_query_weight=0, highlight=highlight and not two_phase,
+                                           source=False if two_phase else source, fuzzy=fuzzy, rescore_size=rescore_size,
+                                           include_aggs=include_aggs)
+                    else:
+                        query_obj = create(user_query, click_prior, search_filters, sort, sortDir, model, LTR_MODEL_NAME, LTR_STORE_NAME,
+                                           highlight=highlight and not two_phase, source=False if two_phase else source, fuzzy=fuzzy,
+                                           rescore_size=rescore_size, include_aggs=include_aggs)
+                    add_category_boost(query_obj, category_boost)
+                    limit_counting(query_obj, user_query)
+                    add_deadline(query_obj, timer)
+                with timer.time("search"):
+                    window = await searcher.search_cached(query_obj, index_name, cache_key, timer=timer,
+                                                          on_load=get_rescore_window_saver(window_id))
+            offset = (page - 1) * page_size
+            if two_phase:
+                with timer.time("fetch_page"):
+                    response = await searcher.fetch_page_cached(window, user_query, index_name, offset, page_size, window_id,
+                                                                timer=timer, highlight=highlight, source=source)
+            else:
+                response = slice_page(window, offset, page_size)
+            window_size = len(window["hits"]["hits"])
+            if offset + page_size < window_size:
+                next_page = {"page": page + 1, "window": window_id}
+            elif window["hits"]["total"]["value"] > window_size:
+                next_page = {"page": page + 1, "start": window_size}
+        else:
+            # Relevance and field sorts page with search_after (on a point in time, if enabled), so we never fetch more than
+            # a page at a time.  The first page past an LTR rescore window starts at the end of the window instead.
+            search_after = params["search_after"] if page > 1 else None
+            start = params["start"] if past_window and search_after is None else None
+            with timer.time("build_query"):
+                create = (create_search_template_request if use_search_templates(user_query) and search_after is None and start is None
+                          and category_boost is None else create_search_query)
+                query_obj = create(user_query, click_prior, search_filters, sort, sortDir, FIRST_PHASE_MODELS.get(model, model),
+                                   LTR_MODEL_NAME, LTR_STORE_NAME, size=page_size, sort_tiebreaker=SORT_TIEBREAKER, fuzzy=fuzzy,
+                                   highlight=highlight, source=source, include_aggs=include_aggs)
+                add_category_boost(query_obj, category_boost)
+                limit_counting(query_obj, user_query)
+                add_deadline(query_obj, timer)
+                if start is not None:
+                    query_obj["from"] = start
+            pit_id = None
+            if search_after is not None:
+                query_obj["search_after"] = search_after
+                if current_app.config.get("SEARCH_PAGING_PIT"):
+                    pit_id = params["pit"] or await searcher.open_point_in_time(index_name)
+                    query_obj["pit"] = {"id": pit_id, "keep_alive": current_app.config["SEARCH_PIT_KEEP_ALIVE"]}
+            with timer.time("search"):
+                if pit_id is not None:  # specific to this user's snapshot, so not worth caching
+                    response = await searcher.search(query_obj, index_name, timer=timer)
+                    pit_id = response.get("pit_id", pit_id)
+                else:
+                    response = await searcher.search_cached(query_obj, index_name, SearchCache.make_key(cache_key, search_after, start),
+                                                            timer=timer)
+            hits = response["hits"]["hits"]
+            if hits and len(hits) == page_size and "sort" in hits[-1]:
+                next_page = {"page": page + 1, "search_after": json.dumps(hits[-1]["sort"])}
+                if pit_id is not None:
+                    next_page["pit"] = pit_id
+        if category_action == "filter" and page == 1 and response["hits"]["total"]["value"] == 0:
+            category_action = "fallback"
+            params["category"] = "off"  # so the next pages search without it too
+            continue
+        break
+    response = qu.unwrap_sampled_aggs(response)
+    degrader = current_app.config.get("degrader")
+    if degrader is not None:
+        degrader.record_response(response)
+    return {"response": response, "next_page": next_page, "query_category": query_category,
+            "category_action": category_action, "degraded": degraded}
+
+
+# Run a coroutine whose awaits all finish straight away (e.g. run_search with a SyncSearcher) and return its result
+def run_sync(coroutine):
+    try:
+        coroutine.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coroutine.close()
+    raise RuntimeError("run_sync can't wait for anything, use an event loop")
+
+
+# The OpenSearch calls (and the blocking work) run_search makes, for the Flask views: each one runs to completion before
+# its await returns, so the search never suspends.  See asgi.AsyncSearcher for the asyncio version.
+class SyncSearcher:
+
+    def __init__(self, opensearch) -> None:
+        self.opensearch = opensearch
+
+    async def run(self, func, *args):
+        return func(*args)
+
+    async def search_cached(self, query_obj, index_name, cache_key=None, timer=None, on_load=None):
+        return search_cached(self.opensearch, query_obj, index_name, cache_key, timer=timer, on_load=on_load)
+
+    async def search(self, query_obj, index_name, timer=None):
+        return search_opensearch(self.opensearch, query_obj, index_name, timer)
+
+    async def fetch_page_cached(self, response, user_query, index_name, offset, page_size, window_id=None, timer=None,
+                                highlight=True, source=None):
+        return fetch_page_cached(self.opensearch, response, user_query, index_name, offset, page_size, window_id, timer=timer,
+                                 highlight=highlight, source=source)
+
+    async def open_point_in_time(self, index_name):
+        return open_point_in_time(self.opensearch, index_name)
+
+
+def render_results(params, result, did_you_mean=None):
+    return render_template("search_results.jinja2", query=params["user_query"], search_response=result["response"],
+                           display_filters=params["display_filters"], applied_filters=params["applied_filters"],
+                           sort=params["sort"], sortDir=params["sortDir"], model=params["model"], explain=params["explain"],
+                           query_category=result["query_category"], page=params["page"],
+                           next_page_url=get_page_url(params, **result["next_page"]) if result["next_page"] else None,
+                           first_page_url=get_page_url(params) if params["page"] > 1 else None, did_you_mean=did_you_mean,
+                           did_you_mean_url=get_page_url(dict(params, user_query=did_you_mean)) if did_you_mean else None,
+                           degraded=result["degraded"], category_action=result["category_action"])
+
+
+def create_api_result(params, result, include_facets):
+    response = result["response"]
+    api_result = {
+        "query": params["user_query"],
+        "model": params["model"],
+        "took": response.get("took"),
+        "total": response["hits"]["total"]["value"],
+        "total_is_lower_bound": response["hits"]["total"].get("relation") == "gte",
+        "hits": [{"sku": get_first(hit, "sku"), "name": get_first(hit, "name"), "score": hit.get("_score")}
+                 for hit in response["hits"]["hits"]],
+        "next_page": result["next_page"],
+        "category": result["query_category"],
+        "category_action": result["category_action"],
+        "degraded": result["degraded"]
+    }
+    if "facets_sample_size" in response:
+        api_result["facets_sample_size"] = response["facets_sample_size"]
+    if include_facets:
+        api_result["facets"] = {name: [{"key": bucket["key"], "count": bucket["doc_count"]} for bucket in agg["buckets"]]
+                                for name, agg in response.get("aggregations", {}).items() if "buckets" in agg}
+    return api_result
+
+
+# Autocomplete for the search box: the top completions of prefix from the query logs, most popular first
+@bp.route('/suggest')
+def suggest():
+    typeahead = current_app.config.get("typeahead")
+    prefix = request.args.get("prefix", "")
+    n = max(min(request.args.get("n", current_app.config["TYPEAHEAD_SIZE"], type=int), 100), 0)
+    suggestions = [query for (query, count) in typeahead.suggest(prefix, n)] if typeahead is not None else []
+    return Response(dumps_json({"prefix": prefix, "suggestions": suggestions}), mimetype="application/json")
+
+
+# Explain how one model scores one product for a query, as JSON.  The results pages link here for each hit when
+# explain=true, rather than having OpenSearch explain every hit in the window.
+@bp.route('/explain')
+def explain():
+    user_query = request.args.get("query", "*")
+    sku = request.args.get("sku")
+    model = request.args.get("model", "simple")
+    if not sku:
+        return Response(dumps_json({"error": "sku is required"}), status=400, mimetype="application/json")
+    model = model if model in EXPLAIN_TYPES else "simple"
+    timer = SearchTimer("explain")
+    opensearch = get_opensearch()
+    index_name = current_app.config["index_name"]
+    with timer.time("prior"):
+        click_prior = get_click_prior(user_query)
+    with timer.time("build_query"):
+        query_obj, _ = su.get_explain_query_for_type(user_query, EXPLAIN_TYPES[model], click_prior, LTR_MODEL_NAME,
+                                                     LTR_STORE_NAME, fuzzy=use_fuzzy_matching())
+    cache_key = get_search_cache_key(user_query, None, None, None, model, LTR_STORE_NAME, LTR_MODEL_NAME, ("explain", sku))
+    loader = collapse_concurrent(cache_key, lambda: opensearch.explain(index=index_name, id=sku, body=query_obj))
+    search_cache = current_app.config.get("search_cache")
+    with timer.time("opensearch"):
         try:
-            prior_doc_ids = None
-            prior_doc_id_weights = None
-            query_times_seen = 0  # careful here
-            prior_clicks_for_query = None
-            prior_clicks_for_query = current_app.config["priors_gb"].get_group(user_query)
-            if prior_clicks_for_query is not None and len(prior_clicks_for_query) > 0:
-                prior_doc_ids = prior_clicks_for_query.sku.drop_duplicates()
-                prior_doc_id_weights = prior_clicks_for_query.sku.value_counts()  # histogram gives us the click counts for all the doc_ids
-                query_times_seen = prior_clicks_for_query.sku.count()
-                click_prior = qu.create_prior_queries(prior_doc_ids, prior_doc_id_weights, query_times_seen)
-        except KeyError as ke:
-            pass
-            # nothing to do here, we just haven't seen this query before in our training set
-    print("prior: %s" % click_prior)
-    return click_prior
+            response = search_cache.get_or_load(cache_key, loader) if search_cache is not None else loader()
+        except NotFoundError:
+            return Response(dumps_json({"error": "no product with sku %s" % sku}), status=404, mimetype="application/json")
+    with timer.time("render"):
+        body = Response(dumps_json({"query": user_query, "sku": sku, "model": model, "matched": response.get("matched"),
+                                    "explanation": response.get("explanation")}), mimetype="application/json")
+    return finish_request(timer, body)
+
+
+# Run the query through every model in a single _msearch and show the results side by side, so we can compare the models
+# without paying for the prior lookup and a round trip per model
+@bp.route('/compare', methods=['GET', 'POST'])
+def compare():
+    timer = SearchTimer("compare")
+    opensearch = get_opensearch()
+    with timer.time("parse"):
+        params = get_search_params()
+    user_query = params["user_query"]
+    filters = params["filters"]
+    sort = params["sort"]
+    sortDir = params["sortDir"]
+    with timer.time("prior"):
+        click_prior = get_click_prior(user_query)
+    compare_size = current_app.config["COMPARE_SIZE"]
+    index_name = current_app.config["index_name"]
+    fuzzy = use_fuzzy_matching()
+    with timer.time("build_query"):
+        searches = []
+        for model in COMPARE_MODELS:
+            if request.method == 'POST':
+                query_obj = create_search_query(user_query, click_prior, filters, sort, sortDir, model, LTR_MODEL_NAME, LTR_STORE_NAME,
+                                                ht_ltr_size=500, main_query_weight=0, highlight=False, source=COMPARE_SOURCE, fuzzy=fuzzy)
+            else:
+                query_obj = create_search_query(user_query, click_prior, filters, sort, sortDir, model, LTR_MODEL_NAME, LTR_STORE_NAME,
+                                                highlight=False, source=COMPARE_SOURCE, fuzzy=fuzzy)
+            # The rescore window is set separately, so we only need to return the top hits.  The aggs would be the same
+            # for every model, so skip them.
+            query_obj["size"] = compare_size
+            query_obj.pop("aggs", None)
+            limit_counting(query_obj, user_query)
+            searches.append({"index": index_name})
+            searches.append(query_obj)
+    start = time.perf_counter()
+    with timer.time("opensearch"):
+        response = opensearch.msearch(body=searches)
+    timer.record("opensearch_took", response.get("took", 0) / 1000)
+    with timer.time("render"):
+        html = render_template("compare_results.jinja2", query=user_query, models=COMPARE_MODELS,
+                               search_responses=response["responses"], sort=sort, sortDir=sortDir,
+                               round_trip=(time.perf_counter() - start) * 1000)
+    return finish_request(timer, html)
+
+
+# The canonical cache key for a search: everything that changes the response, with the query normalized and the filters
+# serialized with sorted keys
+def get_search_cache_key(user_query, filters, sort, sortDir, model, ltr_store_name, ltr_model_name, variant=None):
+    return SearchCache.make_key(qu.normalize_query(user_query), filters or [], sort, sortDir, model,
+                                ltr_store_name, ltr_model_name, current_app.config.get("LTR_MODEL_VERSION"),
+                                current_app.config["index_name"], current_app.config.get("INDEX_GENERATION"), use_fuzzy_matching(),
+                                variant)
+
+
+# Run the search through the response cache, if we have one.  Searches without a cache_key always go to OpenSearch.
+# Cache misses for the same key at the same time share one search, see singleflight.py.  on_load, if given, is called
+# with the response whenever we actually search (not on cache hits, nor for requests that shared the search).
+def search_cached(opensearch, query_obj, index_name, cache_key=None, timer=None, on_load=None):
+    search_cache = current_app.config.get("search_cache")
+    hedger = current_app.config.get("hedger")
+
+    def load():
+        response = search_opensearch(opensearch, query_obj, index_name, timer, hedger=hedger)
+        if on_load is not None:
+            on_load(response)
+        return response
+    if cache_key is None:
+        return load()
+    loader = collapse_concurrent(cache_key, load)
+    if search_cache is None:
+        return loader()
+    return search_cache.get_or_load(cache_key, loader, cacheable=is_complete_response)
+
+
+# Wrap loader so that concurrent calls for the same key share one call.  The wrapper may run in the cache's refresh
+# thread, so it can't look anything up in the app config itself.
+def collapse_concurrent(key, loader):
+    single_flight = current_app.config.get("single_flight")
+    if single_flight is None:
+        return loader
+    return lambda: single_flight.do(key, loader)
+
+
+# The URL for another page of the current search.  page_args are the paging parameters, see get_search_params
+def get_page_url(params, **page_args):
+    args = {"query": params["user_query"], "sort": params["sort"], "sortDir": params["sortDir"], "model": params["model"]}
+    if params["explain"]:
+        args["explain"] = "true"
+    if params.get("category"):
+        args["category"] = params["category"]
+    args.update(page_args)
+    return url_for("search.query", **args) + params["applied_filters"]
+
 
+# The id we keep the LTR rescore window for a search under.  It only depends on the search, so every request for the
+# same search shares one window.
+def get_rescore_window_id(cache_key):
+    return hashlib.blake2b(cache_key.encode("utf-8"), digest_size=16).hexdigest()
 
+
+# A function that keeps an LTR rescore window around under window_id, so we can page through it (see
+# get_rescore_window).  It may be called from the cache's refresh thread, so it can't look up the app config itself.
+def get_rescore_window_saver(window_id):
+    rescore_windows = current_app.config.get("rescore_windows")
+    if rescore_windows is None:
+        return None
+
+    def save(window):
+        if is_complete_response(window):
+            rescore_windows.put(window_id, window)
+    return save
+
+
+# None if we don't have the window (or it has expired), in which case we need to run the search again
+def get_rescore_window(window_id):
+    rescore_windows = current_app.config.get("rescore_windows")
+    if rescore_windows is None or window_id is None:
+        return None
+    return rescore_windows.get(window_id)
+
+
+def open_point_in_time(opensearch, index_name):
+    response = opensearch.create_pit(index=index_name, keep_alive=current_app.config["SEARCH_PIT_KEEP_ALIVE"])
+    return response["pit_id"]
+
+
+# A copy of the response with just hits[offset:offset + page_size] in it
+def slice_page(response, offset, page_size):
+    page_response = dict(response)
+    page_response["hits"] = dict(response["hits"], hits=response["hits"]["hits"][offset:offset + page_size])
+    return page_response
+
+
+# Second phase of two phase retrieval: fetch the _source and highlights for hits[offset:offset + page_size] of an id-only
+# response and return a copy of the response with just those hits in it.  The scores (and explanations) come from the
+# id-only response, so the page is in the same order as the rescored window.
+def fetch_page(opensearch, response, user_query, index_name, offset, page_size, timer=None, highlight=True, source=None):
+    page_query = create_page_query(response, user_query, offset, page_size, highlight, source)
+    docs_response = None
+    if page_query is not None:
+        start = time.perf_counter()
+        docs_response = opensearch.search(body=page_query, index=index_name)
+        record_search_time(timer, start, docs_response)
+    return merge_page(response, offset, page_size, docs_response)
+
+
+# The query for the documents on a page of an id-only response (see fetch_page), or None if the page is empty
+def create_page_query(response, user_query, offset, page_size, highlight=True, source=None):
+    hits = response["hits"]["hits"][offset:offset + page_size]
+    if len(hits) == 0:
+        return None
+    return qu.create_ids_query(user_query, [hit["_id"] for hit in hits], highlight=highlight, source=source)
+
+
+# A copy of the id-only response with its hits[offset:offset + page_size], filled in from docs_response
+def merge_page(response, offset, page_size, docs_response):
+    page_hits = []
+    took = response.get("took", 0)
+    if docs_response is not None:
+        took += docs_response.get("took", 0)
+        docs = {doc["_id"]: doc for doc in docs_response["hits"]["hits"]}
+        for hit in response["hits"]["hits"][offset:offset + page_size]:
+            doc = docs.get(hit["_id"])
+            if doc is None:
+                continue  # deleted since the first phase
+            page_hit = dict(hit, _source=doc.get("_source", {}))
+            if "highlight" in doc:
+                page_hit["highlight"] = doc["highlight"]
+            page_hits.append(page_hit)
+    page_response = dict(response, took=took)
+    page_response["hits"] = dict(response["hits"], hits=page_hits)
+    return page_response
+
+
+# fetch_page through the response cache.  window_id (see get_rescore_window_id) says which window the page is from: a
+# request can page through a window some other request made, e.g. a GET for page 2 of a POSTed search.
+def fetch_page_cached(opensearch, response, user_query, index_name, offset, page_size, window_id=None, timer=None, highlight=True,
+                      source=None):
+    search_cache = current_app.config.get("search_cache")
+    if window_id is None:
+        return fetch_page(opensearch, response, user_query, index_name, offset, page_size, timer, highlight, source)
+    page_key = get_page_key(window_id, offset, page_size, highlight, source)
+    loader = collapse_concurrent(page_key, lambda: fetch_page(opensearch, response, user_query, index_name, offset, page_size,
+                                                              timer, highlight, source))
+    if search_cache is None:
+        return loader()
+    return search_cache.get_or_load(page_key, loader, cacheable=is_complete_response)
+
+
+def get_page_key(window_id, offset, page_size, highlight, source):
+    return SearchCache.make_key(window_id, "page", offset, page_size, highlight, source)
+
+
+# Call opensearch.search (or search_template, for requests from create_search_template_request), recording the round trip
+# time and the time OpenSearch says it took (the difference is the network, (de)serialization and queueing).  With a
+# hedger, slow searches are sent again to another replica, see hedging.py.
+# May be called from the cache's refresh thread, so no Flask context here.
+def search_opensearch(opensearch, query_obj, index_name, timer=None, explain=False, hedger=None):
+    start = time.perf_counter()
+    if hedger is not None and "pit" not in query_obj:  # a point in time is pinned to its own shard copies
+        response = hedger.call(lambda preference: send_search(opensearch, query_obj, index_name, explain, preference))
+    else:
+        response = send_search(opensearch, query_obj, index_name, explain)
+    record_search_time(timer, start, response)
+    return response
+
+
+# Record the round trip since start and the time OpenSearch says the search took
+def record_search_time(timer, start, response):
+    if timer is not None:
+        timer.record("opensearch", time.perf_counter() - start)
+        timer.record("opensearch_took", response.get("took", 0) / 1000)
+
+
+def send_search(opensearch, query_obj, index_name, explain=False, preference=None):
+    (method, kwargs) = get_search_call(query_obj, index_name, explain, preference)
+    return getattr(opensearch, method)(**kwargs)
+
+
+# The client method to send query_obj with ("search" or "search_template") and its arguments.  The sync and the async
+# clients take the same ones.
+def get_search_call(query_obj, index_name, explain=False, preference=None):
+    kwargs = {"preference": preference} if preference is not None else {}
+    if "id" in query_obj and "params" in query_obj:  # query bodies never have a top level id
+        if explain:
+            query_obj = dict(query_obj, explain=True)
+        return "search_template", dict(kwargs, body=query_obj, index=index_name)
+    if "timeout" in query_obj:  # see add_deadline
+        kwargs["allow_partial_search_results"] = True
+    if "pit" in query_obj:  # the point in time already knows which index it is on
+        return "search", dict(kwargs, body=query_obj, explain=explain)
+    return "search", dict(kwargs, body=query_obj, index=index_name, explain=explain)
+
+
+# The first value of a hit's field, or None if the document doesn't have it
+def get_first(hit, field):
+    return (hit.get("_source", {}).get(field) or [None])[0]
+
+
+def get_click_prior(user_query):
+    click_prior = ""
+    prior_index = current_app.config.get("prior_index")
+    if prior_index is not None:
+        # empty if we haven't seen this query before in our training set
+        click_prior = prior_index.get_prior_query(user_query)
+    logger.debug("prior: %s", click_prior)
+    return click_prior
@@ -0,0 +1,139 @@
+#
+# An in-process cache for OpenSearch responses.  Our traffic is heavily skewed towards a small number of head queries, so
+# even a small cache saves us from running the same query + LTR rescore over and over again.
+#
+# Entries are evicted least-recently-used first once the cache is over its byte budget and expire after `ttl` seconds.
+# If `stale_ttl` is set, an expired entry can still be served for that many more seconds while a background thread
+# refreshes it (stale-while-revalidate), so popular queries never wait on OpenSearch once they are in the cache.
+#
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# How many hits estimate_size serializes to size up a search response
+SIZE_SAMPLE_HITS = 5
+
+
+class SearchCache:
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_entry_bytes=4 * 1024 * 1024, ttl=60, stale_ttl=0,
+                 refresh_workers=2) -> None:
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_entry_bytes, max_bytes)
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.current_bytes = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejections = 0  # entries too big to cache, see max_entry_bytes
+        self._entries = OrderedDict()  # key -> (value, size in bytes, fresh until, stale until)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._refresher = ThreadPoolExecutor(max_workers=refresh_workers, thread_name_prefix="search-cache-refresh") if stale_ttl > 0 else None
+
+    # Create a canonical key from the parts of a request that change the response.  The parts must be JSON-serializable.
+    # Sorting the keys means two filters dicts that only differ in key order get the same key.
+    @staticmethod
+    def make_key(*parts):
+        return json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+
+    # Return the cached value for the key, calling loader() to fetch (and cache) it on a miss.  If cacheable is given,
+    # only values it returns True for are cached (e.g. not partial results).
+    def get_or_load(self, key, loader, cacheable=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, size, fresh_until, stale_until = entry
+                if now < fresh_until:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                if now < stale_until:
+                    self._entries.move_to_end(key)
+                    self.stale_hits += 1
+                    if key not in self._refreshing:
+                        self._refreshing.add(key)
+                        self._refresher.submit(self._refresh, key, loader, cacheable)
+                    return value
+                self._remove(key)
+            self.misses += 1
+        value = loader()
+        if cacheable is None or cacheable(value):
+            self.put(key, value)
+        return value
+
+    # Return the cached value for the key, or None if we don't have it (or it has expired).  Never refreshes.
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() >= entry[2]:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    # Cache value under key.  size is its size in bytes, estimated if not given.
+    def put(self, key, value, size=None):
+        if size is None:
+            size = estimate_size(value)
+        now = time.monotonic()
+        with self._lock:
+            if size > self.max_entry_bytes:
+                self.rejections += 1
+                return False  # too big to be worth the space, e.g. a huge explain
+            if key in self._entries:
+                self._remove(key)
+            while self._entries and self.current_bytes + size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+            self._entries[key] = (value, size, now + self.ttl, now + self.ttl + self.stale_ttl)
+            self.current_bytes += size
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self.current_bytes, "hits": self.hits,
+                    "stale_hits": self.stale_hits, "misses": self.misses, "evictions": self.evictions,
+                    "rejections": self.rejections}
+
+    # Caller must hold the lock
+    def _remove(self, key):
+        value, size, fresh_until, stale_until = self._entries.pop(key)
+        self.current_bytes -= size
+
+    def _refresh(self, key, loader, cacheable=None):
+        try:
+            value = loader()
+            if cacheable is None or cacheable(value):
+                self.put(key, value)
+        except Exception as e:
+            print("Unable to refresh cache entry %s: %s" % (key, e))  # keep serving the stale entry until it runs out
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+
+def dumps(value):
+    return json.dumps(value, separators=(",", ":"), default=str)
+
+
+# Roughly how many bytes value takes up as JSON.  Serializing a 500 hit LTR window just to measure it would cost more than
+# most of what we do with it, so for search responses we serialize a few hits and scale up.
+def estimate_size(value):
+    hits = value.get("hits") if isinstance(value, dict) else None
+    if not isinstance(hits, dict) or not hits.get("hits"):
+        return len(dumps(value))
+    sample = hits["hits"][::max(1, len(hits["hits"]) // SIZE_SAMPLE_HITS)][:SIZE_SAMPLE_HITS]  # spread over the window
+    rest = dict(value, hits=dict(hits, hits=[]))
+    return len(dumps(rest)) + len(dumps(sample)) * len(hits["hits"]) // len(sample)
@@ -0,0 +1,56 @@
+#
+# Collapses concurrent identical searches into one OpenSearch call.  When a query starts trending, lots of requests for it
+# miss the response cache at the same time (before the first of them has been able to fill it), and without this they
+# would all run the same query and LTR rescore.  With it, the first request for a key (the leader) makes the call and
+# the others that arrive while it is running wait for it and share its result (or its exception).
+#
+# This is not a cache: once the call returns, the next request for the key makes a new call.
+#
+import threading
+
+
+class _Call:
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+
+    def __init__(self) -> None:
+        self.calls = 0  # calls we made
+        self.collapsed = 0  # requests that shared another request's call instead of making their own
+        self._in_flight = {}  # key -> _Call
+        self._lock = threading.Lock()
+
+    # Return fn(), sharing the call with any other thread doing the same key at the same time
+    def do(self, key, fn):
+        with self._lock:
+            call = self._in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = self._in_flight[key] = _Call()
+                self.calls += 1
+            else:
+                self.collapsed += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            call.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {"calls_total": self.calls, "collapsed_total": self.collapsed, "in_flight": len(self._in_flight)}
@@ -0,0 +1,130 @@
+#
+# "Did you mean" spelling correction, using the symmetric delete algorithm (see https://github.com/wolfgarbe/SymSpell).
+#
+# The vocabulary is the words in the query logs (weighted by how often they were searched) plus the words in the product
+# names.  For every word we index the strings we get by deleting up to max_edit_distance characters from it.  To correct
+# a word we generate its deletes the same way and look them up: any vocabulary word sharing a delete with it is a
+# candidate, and we pick the closest candidate, breaking ties by frequency.  All of the expensive work happens when we
+# build the index, so a lookup is a handful of dict lookups.
+#
+# We only correct queries that didn't find much (see search.get_did_you_mean), and we correct each word on its own.
+#
+import re
+from collections import Counter
+
+import pandas as pd
+
+import week4.utilities.query_utils as qu
+
+WORD_RE = re.compile(r"\w+")
+
+
+class SpellingCorrector:
+
+    def __init__(self, word_counts, max_edit_distance=2, prefix_length=7, min_word_length=3) -> None:
+        self.word_counts = word_counts  # word -> frequency
+        self.max_edit_distance = max_edit_distance
+        self.prefix_length = prefix_length  # only the first prefix_length characters are indexed, which keeps the index small
+        self.min_word_length = min_word_length  # shorter words are usually acronyms, model numbers, etc., so leave them be
+        self.deletes = {}  # delete -> the words it came from
+        for word in word_counts:
+            for delete in self._get_deletes(word):
+                self.deletes.setdefault(delete, []).append(word)
+
+    # word_counts from the queries (searched count times each) and the product names (once each)
+    @classmethod
+    def from_vocabulary(cls, query_counts=None, names=None, min_count=2, **kwargs):
+        word_counts = Counter()
+        if query_counts is not None:
+            for query, count in query_counts.items():
+                for word in WORD_RE.findall(qu.normalize_query(query)):
+                    word_counts[word] += count
+        if names is not None:
+            for name in names:
+                word_counts.update(WORD_RE.findall(qu.normalize_query(name)))
+        word_counts = {word: count for word, count in word_counts.items() if count >= min_count and not word.isdigit()}
+        print("Built spelling corrector for %s words" % len(word_counts))
+        return cls(word_counts, **kwargs)
+
+    # queries_file is a CSV with a query column (e.g. the click logs), names_file has one product name per line (e.g. the
+    # output of week3/extractTitles.py).  Either can be None.
+    @classmethod
+    def from_files(cls, queries_file=None, names_file=None, min_count=2, **kwargs):
+        query_counts = None
+        names = None
+        if queries_file is not None:
+            query_counts = pd.read_csv(queries_file, usecols=["query"])["query"].dropna().astype(str).value_counts()
+        if names_file is not None:
+            with open(names_file) as input:
+                names = [line.strip() for line in input]
+        return cls.from_vocabulary(query_counts, names, min_count, **kwargs)
+
+    def __len__(self):
+        return len(self.word_counts)
+
+    # The corrected query, or None if we don't have a correction for any of its words
+    def correct(self, user_query):
+        words = qu.normalize_query(user_query).split()
+        corrected = [self.correct_word(word) for word in words]
+        if corrected == words:
+            return None
+        return " ".join(corrected)
+
+    # The most likely word the user meant.  The word itself if it's in the vocabulary or we have nothing better.
+    def correct_word(self, word):
+        if word in self.word_counts or len(word) < self.min_word_length or not word.isalpha():
+            return word
+        best = None
+        best_key = None
+        seen = set()
+        for delete in self._get_deletes(word):
+            for candidate in self.deletes.get(delete, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                distance = edit_distance(word, candidate, self.max_edit_distance)
+                if distance > self.max_edit_distance:
+                    continue
+                key = (distance, -self.word_counts[candidate])
+                if best_key is None or key < best_key:
+                    best = candidate
+                    best_key = key
+        return best if best is not None else word
+
+    # The word's prefix and everything we can get by deleting up to max_edit_distance characters from it
+    def _get_deletes(self, word):
+        word = word[:self.prefix_length]
+        deletes = {word}
+        edits = [word]
+        for _ in range(self.max_edit_distance):
+            next_edits = []
+            for edit in edits:
+                if len(edit) <= 1:
+                    continue
+                for idx in range(len(edit)):
+                    delete = edit[:idx] + edit[idx + 1:]
+                    if delete not in deletes:
+                        deletes.add(delete)
+                        next_edits.append(delete)
+            edits = next_edits
+        return deletes
+
+
+# Damerau-Levenshtein distance (optimal string alignment), giving up once it's over max_distance
+def edit_distance(a, b, max_distance):
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous_previous = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous_previous[j - 2] + 1)
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous_previous = previous
+        previous = current
+    return previous[len(b)]
@@ -0,0 +1,81 @@
+import html
+import re
+import threading
+
+import pytest
+from opensearchpy import OpenSearch
+
+import week4.opensearch
+from week4 import create_app
+from week4.utilities.opensearch_standin import StandIn, create_server
+
+
+# A stand-in with no latency, so the tests don't wait on it
+@pytest.fixture
+def standin():
+    return StandIn(num_products=1000, max_hits=300, latency_ms=0, jitter_ms=0)
+
+
+# The port of a stand-in server running in a background thread
+@pytest.fixture
+def standin_port(standin):
+    server = create_server("localhost", 0, standin)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def standin_client(standin_port):
+    return OpenSearch(hosts=[{"host": "localhost", "port": standin_port}], use_ssl=False)
+
+
+# The config for an app that searches the stand-in.  Pages are 10 hits and the searches never degrade, so the tests see
+# the full search.
+@pytest.fixture
+def test_config(standin_port, monkeypatch):
+    monkeypatch.setattr(week4.opensearch, "_opensearch", None)  # the client is per process, see get_opensearch
+    return {"TESTING": True, "OPENSEARCH_HOST": "localhost", "OPENSEARCH_PORT": standin_port, "OPENSEARCH_USE_SSL": False,
+            "RESULTS_PAGE_SIZE": 10, "DEGRADE_P95_SECONDS": 0, "DEGRADE_MAX_IN_FLIGHT": 0}
+
+
+# The search app.  Put anything it would load in the background (e.g. query_classifier) in app.config yourself.
+@pytest.fixture
+def app(test_config):
+    return create_app(test_config)
+
+
+# The searches the stand-in has run, so tests can check what the app sent
+@pytest.fixture
+def searches(standin, monkeypatch):
+    searches = []
+    search = standin.search
+
+    def record(query_obj):
+        searches.append(query_obj)
+        return search(query_obj)
+    monkeypatch.setattr(standin, "search", record)
+    return searches
+
+
+# A results page: the ids of the products on it, the next page's URL (or None) and the whole page
+class ResultsPage:
+
+    def __init__(self, html_page) -> None:
+        self.html = html_page
+        self.product_ids = re.findall(r'<span class="search-result-header">ID</span>: (\d+)', self.html)
+        next_page = re.search(r'<a href="([^"]+)">Next page</a>', self.html)
+        self.next_url = html.unescape(next_page.group(1)) if next_page else None
+
+
+@pytest.fixture
+def get_results(app):
+    client = app.test_client()
+
+    def get_results(url, data=None):
+        response = client.post(url, data=data) if data is not None else client.get(url)
+        assert response.status_code == 200
+        return ResultsPage(response.get_data(as_text=True))
+    return get_results
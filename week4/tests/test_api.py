@@ -0,0 +1,82 @@
+import json
+
+from week4.degradation import STEPS
+
+
+# Stands in for QueryClassifier, see test_category_search.py
+class FakeClassifier:
+
+    def predict(self, user_query):
+        return "cat_%s" % user_query.split()[0], 0.9
+
+
+# A Degrader that is always under as much load as we tell it
+class FakeDegrader:
+
+    def __init__(self, steps) -> None:
+        self.steps = steps
+        self.started = 0
+
+    def start(self):
+        self.started += 1
+
+    def finish(self, secs):
+        pass
+
+    def get_steps(self):
+        return list(self.steps)
+
+    def record_response(self, response):
+        pass
+
+
+def get_api(client, url, data=None):
+    response = client.post(url, data=data) if data is not None else client.get(url)
+    assert response.status_code == 200
+    return json.loads(response.get_data(as_text=True))
+
+
+def test_api_returns_the_hits_and_pages(app, searches):
+    client = app.test_client()
+    first = get_api(client, "/search/api?query=laptop&model=simple&size=5")
+    assert len(first["hits"]) == 5
+    assert set(first["hits"][0]) == {"sku", "name", "score"}
+    assert "facets" not in first and "aggs" not in searches[-1]
+    assert searches[-1]["_source"] == ["sku", "name"]
+    second = get_api(client, "/search/api?query=laptop&model=simple&size=5&page=%(page)s&search_after=%(search_after)s"
+                     % first["next_page"])
+    assert not {hit["sku"] for hit in first["hits"]} & {hit["sku"] for hit in second["hits"]}
+
+
+def test_api_facets(app):
+    result = get_api(app.test_client(), "/search/api?query=laptop&facets=true")
+    assert "department" in result["facets"]
+
+
+def test_api_classifies_the_query_like_the_results_page(app, searches):
+    app.config["query_classifier"] = FakeClassifier()
+    result = get_api(app.test_client(), "/search/api?query=laptop")
+    assert result["category"] == "cat_laptop"
+    assert result["category_action"] in ("filter", "fallback")
+    assert "cat_laptop" in json.dumps(searches[0])
+
+
+def test_api_posts_rescore_the_bigger_window(app, searches):
+    get_api(app.test_client(), "/search/api", data={"query": "laptop", "sort": "_score", "sortDir": "desc", "model": "ht_LTR"})
+    rescore = [query_obj for query_obj in searches if "rescore" in query_obj][0]["rescore"]
+    assert rescore["window_size"] == 500
+    assert rescore["query"]["query_weight"] == 0
+
+
+def test_api_searches_have_a_deadline(app, searches):
+    get_api(app.test_client(), "/search/api?query=laptop")
+    assert searches[-1]["timeout"].endswith("ms")
+
+
+def test_api_degrades_under_load(app, searches):
+    degrader = app.config["degrader"] = FakeDegrader(STEPS)
+    result = get_api(app.test_client(), "/search/api?query=laptop&facets=true&model=ht_LTR")
+    assert result["degraded"] == STEPS
+    assert result["facets"] == {}
+    assert "aggs" not in searches[0]
+    assert degrader.started == 1
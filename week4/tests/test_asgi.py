@@ -0,0 +1,109 @@
+import asyncio
+import json
+import time
+from urllib.parse import urlencode, urlparse
+
+import pytest
+
+import week4.opensearch
+from week4.asgi import create_asgi_app
+from week4.opensearch import close_async_opensearch
+from week4.tests.conftest import ResultsPage
+from week4.tests.test_paging import get_args
+
+
+@pytest.fixture
+def asgi_app(test_config):
+    return create_asgi_app(test_config)
+
+
+# Send one request to the ASGI app and return its status, headers and body
+async def call(asgi_app, path, query=None, form=None):
+    body = urlencode(form).encode("utf-8") if form is not None else b""
+    headers = [(b"content-type", b"application/x-www-form-urlencoded"), (b"content-length", str(len(body)).encode())] if form else []
+    scope = {"type": "http", "http_version": "1.1", "method": "POST" if form is not None else "GET", "scheme": "http",
+             "path": path, "root_path": "", "query_string": urlencode(query or {}).encode("utf-8"), "headers": headers,
+             "server": ("localhost", 3000), "client": ("127.0.0.1", 50000)}
+    requests = [{"type": "http.request", "body": body, "more_body": False}]
+    messages = []
+
+    async def receive():
+        if requests:
+            return requests.pop(0)
+        await asyncio.sleep(3600)  # nothing more to read until the response has been sent
+
+    async def send(message):
+        messages.append(message)
+    await asyncio.wait_for(asgi_app(scope, receive, send), 10)
+    headers = {name.decode("latin1"): value.decode("latin1") for (name, value) in messages[0]["headers"]}
+    return messages[0]["status"], headers, b"".join(message.get("body", b"") for message in messages[1:])
+
+
+# Run coroutine on a fresh event loop, closing the loop's OpenSearch client afterwards
+def run(coroutine):
+    async def run_and_close():
+        try:
+            return await coroutine
+        finally:
+            await close_async_opensearch()
+    return asyncio.run(run_and_close())
+
+
+def test_async_results_page_matches_the_flask_one(asgi_app, get_results):
+    (status, headers, body) = run(call(asgi_app, "/search/query", {"query": "laptop", "model": "ht_LTR"}))
+    assert status == 200
+    assert headers["content-type"].startswith("text/html")
+    assert "server-timing" in headers
+    page = ResultsPage(body.decode("utf-8"))
+    flask_page = get_results("/search/query?query=laptop&model=ht_LTR")
+    assert len(page.product_ids) == 10
+    assert page.product_ids == flask_page.product_ids
+    assert "window=" in page.next_url
+    (_, _, body) = run(call(asgi_app, urlparse(page.next_url).path, get_args(page.next_url)))
+    assert ResultsPage(body.decode("utf-8")).product_ids == get_results(flask_page.next_url).product_ids
+
+
+def test_async_api_matches_the_flask_one(asgi_app, app):
+    (status, _, body) = run(call(asgi_app, "/search/api", form={"query": "laptop", "sort": "_score", "sortDir": "desc",
+                                                               "model": "ht_LTR"}))
+    assert status == 200
+    result = json.loads(body)
+    flask_result = json.loads(app.test_client().post("/search/api", data={"query": "laptop", "sort": "_score", "sortDir": "desc",
+                                                                          "model": "ht_LTR"}).get_data())
+    assert result["hits"] == flask_result["hits"]
+    assert result["next_page"] == flask_result["next_page"]
+
+
+def test_searches_dont_tie_up_a_thread(asgi_app, standin):
+    standin.latency_ms = 200
+    queries = ["laptop %s" % i for i in range(20)]
+
+    async def search_all():
+        return await asyncio.gather(*[call(asgi_app, "/search/api", {"query": query, "model": "simple"}) for query in queries])
+    start = time.perf_counter()
+    responses = run(search_all())
+    # 20 searches at 200ms each, all in flight at once
+    assert time.perf_counter() - start < 2.0
+    assert [status for (status, _, _) in responses] == [200] * 20
+    assert week4.opensearch._opensearch is None  # the sync client was never used
+
+
+def test_other_pages_go_to_flask(asgi_app):
+    (status, _, body) = run(call(asgi_app, "/search/suggest", {"prefix": "lap"}))
+    assert status == 200
+    assert json.loads(body) == {"prefix": "lap", "suggestions": []}
+    (status, _, _) = run(call(asgi_app, "/no/such/page"))
+    assert status == 404
+
+
+def test_lifespan(asgi_app):
+    messages = [{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message["type"])
+    asyncio.run(asgi_app({"type": "lifespan"}, receive, send))
+    assert sent == ["lifespan.startup.complete", "lifespan.shutdown.complete"]
@@ -0,0 +1,78 @@
+import json
+
+import pytest
+
+CATEGORY_FIELD = "categoryPathIds.keyword"
+
+
+# Stands in for QueryClassifier: predicts "cat_<first word>" with the given confidence
+class FakeClassifier:
+
+    def __init__(self, confidence) -> None:
+        self.confidence = confidence
+        self.queries = []
+
+    def predict(self, user_query):
+        self.queries.append(user_query)
+        return "cat_%s" % user_query.split()[0], self.confidence
+
+
+def uses_category(query_obj):
+    return CATEGORY_FIELD in json.dumps(query_obj)
+
+
+def is_category_filter(clause):
+    return clause.get("term", {}).get(CATEGORY_FIELD) == "cat_laptop"
+
+
+def find_filters(query_obj):
+    filters = []
+
+    def walk(obj):
+        if isinstance(obj, dict):
+            if isinstance(obj.get("filter"), list):
+                filters.extend(obj["filter"])
+            for value in obj.values():
+                walk(value)
+        elif isinstance(obj, list):
+            for value in obj:
+                walk(value)
+    walk(query_obj)
+    return filters
+
+
+@pytest.mark.parametrize("confidence, action", [(0.9, "filter"), (0.5, "filter"), (0.3, "boost"), (0.1, None)])
+def test_the_confidence_decides_what_we_do_with_the_category(app, get_results, searches, confidence, action):
+    app.config["query_classifier"] = FakeClassifier(confidence)
+    page = get_results("/search/query?query=laptop&model=simple")
+    query_obj = searches[-1]
+    if action == "filter":
+        assert any(is_category_filter(clause) for clause in find_filters(query_obj))
+        assert "showing only that category" in page.html
+    elif action == "boost":
+        assert not any(is_category_filter(clause) for clause in find_filters(query_obj))
+        assert query_obj["query"]["bool"]["should"][0]["term"][CATEGORY_FIELD]["value"] == "cat_laptop"
+        assert "ranking that category higher" in page.html
+    else:
+        assert not uses_category(query_obj)
+        assert "Your query categorization model predicted" not in page.html
+
+
+def test_a_category_with_no_hits_falls_back_to_every_category(app, standin, get_results, searches, monkeypatch):
+    app.config["query_classifier"] = FakeClassifier(0.9)
+    match = standin.match
+    monkeypatch.setattr(standin, "match", lambda query_obj: [] if uses_category(query_obj) else match(query_obj))
+    page = get_results("/search/query?query=laptop&model=simple")
+    assert len(searches) == 2
+    assert uses_category(searches[0]) and not uses_category(searches[1])
+    assert len(page.product_ids) == 10
+    assert "but it had no results" in page.html
+    assert "category=off" in page.next_url  # so the next pages don't try the category again
+
+
+def test_match_all_searches_are_not_classified(app, get_results, searches):
+    classifier = app.config["query_classifier"] = FakeClassifier(0.9)
+    get_results("/search/query?query=*&model=simple")
+    get_results("/search/query", data={"query": "", "sort": "_score", "sortDir": "desc", "model": "simple"})
+    assert classifier.queries == []
+    assert not any(uses_category(query_obj) for query_obj in searches)
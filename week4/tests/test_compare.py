@@ -0,0 +1,62 @@
+import re
+
+import pytest
+
+from week4.opensearch import get_opensearch
+from week4.search import COMPARE_MODELS, COMPARE_SOURCE
+from week4.utilities.opensearch_standin import create_error
+
+
+# The calls the app makes on its OpenSearch client, by method
+@pytest.fixture
+def calls(app, monkeypatch):
+    calls = []
+    with app.app_context():
+        opensearch = get_opensearch()
+    for method in ["search", "search_template", "msearch"]:
+        def record(*args, method=method, call=getattr(opensearch, method), **kwargs):
+            calls.append(method)
+            return call(*args, **kwargs)
+        monkeypatch.setattr(opensearch, method, record)
+    return calls
+
+
+def get_compare(app, url, data=None):
+    client = app.test_client()
+    response = client.post(url, data=data) if data is not None else client.get(url)
+    assert response.status_code == 200
+    return response.get_data(as_text=True)
+
+
+def test_compare_searches_every_model_in_one_msearch(app, calls, searches):
+    html = get_compare(app, "/search/compare?query=laptop")
+    assert calls == ["msearch"]
+    assert len(searches) == len(COMPARE_MODELS)
+    for query_obj in searches:
+        assert query_obj["size"] == app.config["COMPARE_SIZE"]
+        assert query_obj["_source"] == COMPARE_SOURCE
+        assert "aggs" not in query_obj and "highlight" not in query_obj
+    assert ["rescore" in query_obj for query_obj in searches] == ["LTR" in model for model in COMPARE_MODELS]
+    for model in COMPARE_MODELS:
+        assert "<h2>%s</h2>" % model in html
+    assert len(re.findall(r'<li class="search-result">', html)) == len(COMPARE_MODELS) * app.config["COMPARE_SIZE"]
+
+
+def test_compare_posts_rescore_the_bigger_window(app, searches):
+    get_compare(app, "/search/compare", data={"query": "laptop", "sort": "_score", "sortDir": "desc"})
+    rescores = [query_obj["rescore"] for query_obj in searches if "rescore" in query_obj]
+    assert len(rescores) == 2
+    assert all(rescore["window_size"] == 500 and rescore["query"]["query_weight"] == 0 for rescore in rescores)
+
+
+def test_compare_shows_the_models_that_failed(app, standin, monkeypatch):
+    search = standin.search
+
+    def fail_rescores(query_obj):
+        if "rescore" in query_obj:
+            return 400, create_error("resource_not_found_exception", "Unknown model", 400)
+        return search(query_obj)
+    monkeypatch.setattr(standin, "search", fail_rescores)
+    html = get_compare(app, "/search/compare?query=laptop")
+    assert html.count("Failed: Unknown model") == 2
+    assert len(re.findall(r'<li class="search-result">', html)) == 2 * app.config["COMPARE_SIZE"]
@@ -0,0 +1,53 @@
+from week4.degradation import STEPS, Degrader
+
+
+def test_no_steps_under_the_thresholds():
+    degrader = Degrader(p95_threshold=1.0, max_in_flight=10, min_samples=5)
+    for _ in range(10):
+        degrader.start()
+        degrader.finish(0.5)
+    assert degrader.get_steps() == []
+
+
+def test_p95_needs_min_samples():
+    degrader = Degrader(p95_threshold=1.0, max_in_flight=0, min_samples=5)
+    for _ in range(4):
+        degrader.start()
+        degrader.finish(10.0)
+    assert degrader.p95() is None
+    assert degrader.get_steps() == []
+    degrader.start()
+    degrader.finish(10.0)
+    assert degrader.get_steps() == STEPS
+
+
+def test_steps_follow_the_latency_pressure():
+    for (p95, steps) in [(0.9, []), (1.0, ["shrink_rescore"]), (1.6, ["shrink_rescore", "drop_aggs"]), (2.5, STEPS)]:
+        degrader = Degrader(p95_threshold=1.0, max_in_flight=0, min_samples=1)
+        degrader.start()
+        degrader.finish(p95)
+        assert degrader.get_steps() == steps
+
+
+def test_steps_follow_the_requests_in_flight():
+    degrader = Degrader(p95_threshold=0, max_in_flight=4)
+    for _ in range(6):
+        degrader.start()
+    assert degrader.get_steps() == ["shrink_rescore", "drop_aggs"]
+    for _ in range(5):
+        degrader.finish(0.1)
+    assert degrader.get_steps() == []
+
+
+def test_stats_count_steps_and_timeouts():
+    degrader = Degrader(p95_threshold=0, max_in_flight=1)
+    degrader.start()
+    degrader.get_steps()
+    degrader.record_response({"timed_out": True})
+    degrader.record_response({"timed_out": False})
+    stats = degrader.stats()
+    assert stats["requests_total"] == 1
+    assert stats["shrink_rescore_total"] == 1
+    assert stats["drop_aggs_total"] == 0
+    assert stats["timed_out_total"] == 1
+    assert stats["in_flight"] == 1
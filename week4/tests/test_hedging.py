@@ -0,0 +1,112 @@
+import threading
+import time
+
+import pytest
+
+from week4.hedging import Hedger, percentile
+
+
+# A search that takes `first_secs` for the first search (preference None) and `hedge_secs` for a hedge
+def create_search(first_secs, hedge_secs=0.0, first_error=None, hedge_error=None):
+    preferences = []
+    lock = threading.Lock()
+
+    def search(preference):
+        with lock:
+            preferences.append(preference)
+        time.sleep(first_secs if preference is None else hedge_secs)
+        error = first_error if preference is None else hedge_error
+        if error is not None:
+            raise error
+        return {"preference": preference}
+    return search, preferences
+
+
+def create_warm_hedger(delay=0.05):
+    hedger = Hedger(percentile=95, min_delay=delay, min_samples=5)
+    (search, _) = create_search(0.0)
+    for _ in range(5):
+        hedger.call(search)
+    hedger._delay_at = 0  # recompute the delay now rather than in a second
+    assert hedger.get_delay() == delay
+    return hedger
+
+
+def test_percentile():
+    values = list(range(100))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile(values, 100) == 99
+    assert percentile([7], 95) == 7
+
+
+def test_no_hedging_while_warming_up():
+    hedger = Hedger(min_samples=5)
+    (search, preferences) = create_search(0.0)
+    assert hedger.get_delay() is None
+    assert hedger.call(search) == {"preference": None}
+    assert preferences == [None]
+    assert hedger.stats()["hedged_total"] == 0
+
+
+def test_fast_searches_are_not_hedged():
+    hedger = create_warm_hedger(delay=0.5)
+    (search, preferences) = create_search(0.0)
+    assert hedger.call(search) == {"preference": None}
+    assert preferences == [None]
+
+
+def test_slow_search_is_hedged_and_the_hedge_wins():
+    hedger = create_warm_hedger(delay=0.05)
+    (search, preferences) = create_search(1.0, hedge_secs=0.0)
+    start = time.perf_counter()
+    response = hedger.call(search)
+    assert time.perf_counter() - start < 0.5
+    assert response["preference"].startswith("hedge-")
+    assert len(preferences) == 2
+    stats = hedger.stats()
+    assert stats["hedged_total"] == 1
+    assert stats["hedge_wins_total"] == 1
+
+
+def test_failed_hedge_falls_back_to_the_first_search():
+    hedger = create_warm_hedger(delay=0.05)
+    (search, _) = create_search(0.2, hedge_error=ValueError("hedge failed"))
+    assert hedger.call(search) == {"preference": None}
+    assert hedger.stats()["hedge_wins_total"] == 0
+
+
+def test_raises_when_both_fail():
+    hedger = create_warm_hedger(delay=0.05)
+    (search, _) = create_search(0.1, first_error=ValueError("first failed"), hedge_error=ValueError("hedge failed"))
+    with pytest.raises(ValueError):
+        hedger.call(search)
+
+
+def test_only_successful_first_searches_set_the_delay():
+    hedger = create_warm_hedger(delay=0.05)
+    samples = len(hedger.primary_latencies)
+    (search, _) = create_search(0.1, first_error=ValueError("first failed"))
+    hedger.call(search)  # the hedge answers
+    time.sleep(0.2)  # let the first search fail
+    assert len(hedger.primary_latencies) == samples
+
+
+def test_cancelled_first_searches_dont_set_the_delay():
+    hedger = Hedger(min_delay=0.05, min_samples=5, primary_workers=1)
+    (search, _) = create_search(0.0)
+    for _ in range(5):
+        hedger.call(search)
+    hedger._delay_at = 0
+    # a slow search holds the only primary worker, so the next first search is still queued when its hedge answers,
+    # and is cancelled before it runs
+    (slow_search, _) = create_search(0.3)
+    blocker = threading.Thread(target=hedger.call, args=(slow_search,))
+    blocker.start()
+    time.sleep(0.01)
+    (queued_search, preferences) = create_search(0.0, hedge_secs=0.0)
+    assert hedger.call(queued_search)["preference"].startswith("hedge-")
+    blocker.join()  # returns once its own hedge answers
+    time.sleep(0.4)  # let the slow search finish
+    assert preferences.count(None) == 0
+    assert len(hedger.primary_latencies) == 5 + 1  # just the slow search
@@ -0,0 +1,56 @@
+import pytest
+
+from week4.utilities.query_utils import HIGHLIGHT_FIELDS
+
+MORE_WORDS = "And then some more words about it. " * 20
+
+
+# Products whose long descriptions run on for longer than a fragment
+@pytest.fixture
+def long_descriptions(standin, monkeypatch):
+    get_product = standin.get_product
+
+    def get_long_product(sku):
+        product = get_product(sku)
+        return dict(product, longDescription=[product["longDescription"][0] + ". " + MORE_WORDS]) if product else None
+    monkeypatch.setattr(standin, "get_product", get_long_product)
+    return get_long_product
+
+
+def get_page_fetch(searches):
+    return [query_obj for query_obj in searches if "ids" in query_obj.get("query", {})][0]
+
+
+def test_page_fetch_highlights_the_user_query(get_results, searches):
+    get_results("/search/query?query=laptop&model=ht_LTR")
+    highlight = get_page_fetch(searches)["highlight"]
+    assert highlight["type"] == "unified"
+    assert highlight["fields"] == HIGHLIGHT_FIELDS
+    assert highlight["highlight_query"]["multi_match"] == {"query": "laptop", "fields": list(HIGHLIGHT_FIELDS)}
+
+
+def test_single_phase_searches_ask_for_the_same_fragments(get_results, searches):
+    get_results("/search/query?query=laptop&model=simple")
+    assert searches[-1]["highlight"]["fields"] == HIGHLIGHT_FIELDS
+
+
+def test_results_show_the_first_fragment(get_results, long_descriptions):
+    page = get_results("/search/query?query=laptop&model=ht_LTR")
+    sku = int(page.product_ids[0]) - 1000000  # see opensearch_standin.create_product
+    description = long_descriptions(sku)["longDescription"][0]
+    fragment_size = HIGHLIGHT_FIELDS["longDescription"]["fragment_size"]
+    results = page.html[:page.html.index('<div id="pagination">')]  # the debug section after it has the whole response
+    first_word = description.split()[0]
+    assert "<em>%s</em>%s\n" % (first_word, description[len(first_word):fragment_size]) in results
+    assert MORE_WORDS not in results
+    assert "<em>Product</em> %s\n" % sku in results  # the whole name
+
+
+def test_match_all_isnt_highlighted(get_results, searches):
+    get_results("/search/query?query=*&model=ht_LTR")
+    assert "highlight" not in get_page_fetch(searches)
+
+
+def test_api_isnt_highlighted(app, searches):
+    assert app.test_client().get("/search/api?query=laptop&model=ht_LTR").status_code == 200
+    assert not any("highlight" in query_obj for query_obj in searches)
@@ -0,0 +1,37 @@
+import week4.utilities.query_utils as qu
+
+
+def test_facets_are_computed_over_a_sample():
+    query_obj = qu.create_simple_baseline("tv", "", [], size=10)
+    aggs = query_obj["aggs"]
+    qu.limit_counting(query_obj, track_total_hits=500, shard_size=200)
+    assert query_obj["track_total_hits"] == 500
+    assert query_obj["aggs"] == {qu.SAMPLER_AGG: {"sampler": {"shard_size": 200}, "aggs": aggs}}
+
+
+def test_diversified_sample():
+    query_obj = qu.limit_counting(qu.create_simple_baseline("tv", "", [], size=10), diversify_field="department.keyword",
+                                  max_docs_per_value=50)
+    assert query_obj["aggs"][qu.SAMPLER_AGG]["diversified_sampler"] == {"shard_size": 1000, "field": "department.keyword",
+                                                                         "max_docs_per_value": 50}
+
+
+def test_without_aggs_only_the_count_is_limited():
+    query_obj = qu.limit_counting(qu.create_simple_baseline("tv", "", [], size=10, include_aggs=False))
+    assert query_obj["track_total_hits"] == 1000
+    assert "aggs" not in query_obj
+
+
+def test_unwrap_sampled_aggs():
+    department = {"buckets": [{"key": "TV", "doc_count": 3}]}
+    response = {"hits": {"total": {"value": 1000, "relation": "gte"}, "hits": []},
+                "aggregations": {qu.SAMPLER_AGG: {"doc_count": 800, "department": department}}}
+    unwrapped = qu.unwrap_sampled_aggs(response)
+    assert unwrapped["aggregations"] == {"department": department}
+    assert unwrapped["facets_sample_size"] == 800
+    assert response["aggregations"][qu.SAMPLER_AGG]["doc_count"] == 800  # the cached response isn't changed
+
+
+def test_unwrap_leaves_other_responses_alone():
+    response = {"hits": {"hits": []}, "aggregations": {"department": {"buckets": []}}}
+    assert qu.unwrap_sampled_aggs(response) is response
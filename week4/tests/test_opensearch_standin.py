@@ -0,0 +1,92 @@
+import json
+
+import pytest
+from opensearchpy import NotFoundError
+
+from week4.utilities.opensearch_standin import create_aggregations, create_highlight, get_recording_key
+
+import week4.utilities.query_utils as qu
+
+
+def create_products(departments):
+    return [{"sku": [str(sku)], "department": [department]} for sku, department in enumerate(departments)]
+
+
+def test_sampler_aggregates_the_best_matches():
+    products = create_products(["MUSIC"] * 3 + ["MOBILE"] * 3)
+    aggs = {"department": {"terms": {"field": "department.keyword"}}}
+    query_obj = qu.limit_counting({"aggs": aggs}, shard_size=4)
+    aggregations = create_aggregations(query_obj["aggs"], products)
+    sample = aggregations[qu.SAMPLER_AGG]
+    assert sample["doc_count"] == 4
+    assert sample["department"]["buckets"] == [{"key": "MUSIC", "doc_count": 3}, {"key": "MOBILE", "doc_count": 1}]
+
+
+def test_diversified_sampler_caps_each_value():
+    products = create_products(["MUSIC"] * 3 + ["MOBILE"] * 3)
+    aggs = {"department": {"terms": {"field": "department.keyword"}}}
+    query_obj = qu.limit_counting({"aggs": aggs}, shard_size=3, diversify_field="department.keyword", max_docs_per_value=2)
+    aggregations = create_aggregations(query_obj["aggs"], products)
+    sample = aggregations[qu.SAMPLER_AGG]
+    assert sample["doc_count"] == 3
+    assert sample["department"]["buckets"] == [{"key": "MUSIC", "doc_count": 2}, {"key": "MOBILE", "doc_count": 1}]
+
+
+def test_sampled_aggs_unwrap_like_the_real_thing():
+    products = create_products(["MUSIC"] * 10)
+    aggs = {"department": {"terms": {"field": "department.keyword"}}}
+    response = {"aggregations": create_aggregations(qu.limit_counting({"aggs": aggs}, shard_size=5)["aggs"], products)}
+    unwrapped = qu.unwrap_sampled_aggs(response)
+    assert unwrapped["facets_sample_size"] == 5
+    assert unwrapped["aggregations"]["department"]["buckets"] == [{"key": "MUSIC", "doc_count": 5}]
+
+
+def test_from_and_search_after_page_through_the_same_hits(standin):
+    query_obj = {"query": {"match": {"name": "tv"}}, "size": 10, "sort": [{"_score": "desc"}, {"sku.keyword": "asc"}]}
+    (_, everything) = standin.search(dict(query_obj, size=30))
+    skus = [hit["_id"] for hit in everything["hits"]["hits"]]
+    (_, page) = standin.search(dict(query_obj, **{"from": 10}))
+    assert [hit["_id"] for hit in page["hits"]["hits"]] == skus[10:20]
+    (_, page) = standin.search(dict(query_obj, search_after=page["hits"]["hits"][-1]["sort"]))
+    assert [hit["_id"] for hit in page["hits"]["hits"]] == skus[20:30]
+
+
+def test_track_total_hits(standin):
+    query_obj = {"query": {"match": {"name": "tv"}}, "size": 0}
+    (_, response) = standin.search(query_obj)
+    total = response["hits"]["total"]["value"]
+    assert total > 5
+    assert response["hits"]["total"]["relation"] == "eq"
+    (_, response) = standin.search(dict(query_obj, track_total_hits=5))
+    assert response["hits"]["total"] == {"value": 5, "relation": "gte"}
+    (_, response) = standin.search(dict(query_obj, track_total_hits=False))
+    assert "total" not in response["hits"]
+
+
+def test_point_in_time(standin_client):
+    pit_id = standin_client.create_pit(index="bbuy_products", keep_alive="1m")["pit_id"]
+    query_obj = {"query": {"match": {"name": "tv"}}, "size": 5, "pit": {"id": pit_id, "keep_alive": "1m"}}
+    response = standin_client.search(body=query_obj)
+    assert response["pit_id"] == pit_id
+    assert len(response["hits"]["hits"]) == 5
+    standin_client.delete_pit(body={"pit_id": [pit_id]})
+    with pytest.raises(NotFoundError):
+        standin_client.search(body=query_obj)
+
+
+def test_recordings_ignore_the_preference(standin, standin_client):
+    body = {"query": {"match": {"name": "tv"}}}
+    key = get_recording_key("POST", "/bbuy_products/_search", json.dumps(body).encode("utf-8"))
+    standin.recordings[key] = (200, {"hits": {"total": {"value": 1, "relation": "eq"}, "hits": [{"_id": "recorded"}]}})
+    response = standin_client.search(body=body, index="bbuy_products", preference="hedge-123")
+    assert response["hits"]["hits"] == [{"_id": "recorded"}]
+
+
+def test_highlights_are_split_into_fragments():
+    product = {"name": ["Product 1"], "longDescription": ["word " * 100]}
+    highlight = {"fields": {"name": {"number_of_fragments": 0}, "longDescription": {"fragment_size": 200, "number_of_fragments": 2},
+                            "shortDescription": {}}}
+    highlights = create_highlight(highlight, product)
+    assert highlights["name"] == ["<em>Product</em> 1"]
+    assert [len(fragment) for fragment in highlights["longDescription"]] == [209, 209]  # 200 characters and the <em> tags
+    assert "shortDescription" not in highlights
@@ -0,0 +1,65 @@
+import json
+from urllib.parse import parse_qs, urlparse
+
+
+def get_args(url):
+    return {name: values[0] for name, values in parse_qs(urlparse(url).query).items()}
+
+
+def count_rescores(searches):
+    return sum(1 for query_obj in searches if "rescore" in query_obj)
+
+
+def count_page_fetches(searches):
+    return sum(1 for query_obj in searches if "ids" in query_obj.get("query", {}))
+
+
+def test_ltr_pages_through_the_rescore_window(get_results, searches):
+    first = get_results("/search/query?query=tv&model=ht_LTR")
+    assert "window" in get_args(first.next_url)
+    rescores = count_rescores(searches)
+    second = get_results(first.next_url)
+    assert count_rescores(searches) == rescores  # the second page comes from the same window
+    assert len(second.product_ids) == 10
+    assert not set(first.product_ids) & set(second.product_ids)
+    assert get_args(second.next_url)["window"] == get_args(first.next_url)["window"]
+
+
+def test_ltr_carries_on_past_the_window_in_first_phase_order(get_results, searches):
+    url = "/search/query?query=tv&model=ht_LTR"
+    product_ids = []
+    args = []
+    for _ in range(13):
+        page = get_results(url)
+        product_ids += page.product_ids
+        url = page.next_url
+        args.append(get_args(url))
+    assert len(product_ids) == len(set(product_ids)) == 130
+    assert [page_args.get("window") is not None for page_args in args[:9]] == [True] * 9
+    assert args[9]["start"] == "100"  # the page after the 100 hit window
+    past_window = [query_obj for query_obj in searches if query_obj.get("from") == 100]
+    assert len(past_window) == 1 and "rescore" not in past_window[0]
+    assert "search_after" in args[10]  # and then search_after, like the other models
+    assert searches[-1]["search_after"] == json.loads(args[11]["search_after"])
+
+
+def test_search_after_pages(get_results, searches):
+    first = get_results("/search/query?query=laptop&model=simple")
+    search_after = get_args(first.next_url)["search_after"]
+    second = get_results(first.next_url)
+    assert searches[-1]["search_after"] == json.loads(search_after)
+    assert len(second.product_ids) == 10
+    assert not set(first.product_ids) & set(second.product_ids)
+    assert get_args(second.next_url)["page"] == "3"
+
+
+def test_pages_of_a_posted_window_are_not_shared_with_the_get_window(get_results, searches):
+    posted = get_results("/search/query", data={"query": "tv", "sort": "_score", "sortDir": "desc", "model": "ht_LTR"})
+    got = get_results("/search/query?query=tv&model=ht_LTR")
+    assert get_args(posted.next_url)["window"] != get_args(got.next_url)["window"]
+    get_results(got.next_url)
+    fetches = count_page_fetches(searches)
+    get_results(posted.next_url)
+    assert count_page_fetches(searches) == fetches + 1
+    get_results(posted.next_url)  # and now it's cached
+    assert count_page_fetches(searches) == fetches + 1
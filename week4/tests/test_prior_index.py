@@ -0,0 +1,47 @@
+import numpy as np
+
+import week4.utilities.query_utils as qu
+
+
+# The clicks with the queries as users type them, so the priors have to normalize them
+def mess_up(clicks_df):
+    return clicks_df.assign(query=[query.upper() if i % 2 else query + " " for (i, query) in enumerate(clicks_df["query"])])
+
+
+def test_priors_are_normalized_and_weighted_by_clicks(clicks_df):
+    prior_index = qu.PriorIndex.from_clicks(mess_up(clicks_df))
+    (skus, weights) = prior_index.get_priors("  Tv")
+    assert list(skus) == [1, 2, 3]  # most clicked first
+    np.testing.assert_allclose(weights, [0.5, 0.25, 0.25])
+    assert prior_index.get_prior_query("tv") == "1^0.500  2^0.250  3^0.250  "
+    assert "LAPTOP" in prior_index
+    assert prior_index.get_priors("unseen") == (None, None)
+    assert prior_index.get_prior_query("unseen") == ""
+
+
+def test_top_k_keeps_the_most_clicked(clicks_df):
+    prior_index = qu.PriorIndex.from_clicks(mess_up(clicks_df), top_k=1)
+    (skus, weights) = prior_index.get_priors("tv")
+    assert list(skus) == [1]
+    np.testing.assert_allclose(weights, [0.5])  # still a share of all of the query's clicks
+
+
+def test_save_and_load_round_trip(clicks_df, tmp_path):
+    prior_index = qu.PriorIndex.from_clicks(mess_up(clicks_df), top_k=2)
+    path = str(tmp_path / "priors.npz")
+    prior_index.save(path)
+    loaded = qu.PriorIndex.from_file(path)
+    assert len(loaded) == len(prior_index)
+    assert loaded.top_k == 2
+    for query in ["tv", "laptop", "head phones", "ünïcode"]:
+        assert loaded.get_prior_query(query) == prior_index.get_prior_query(query)
+        (skus, weights) = loaded.get_priors(query)
+        (expected_skus, expected_weights) = prior_index.get_priors(query)
+        assert [str(sku) for sku in skus] == [str(sku) for sku in expected_skus]
+        np.testing.assert_allclose(weights, expected_weights)
+
+
+def test_save_and_load_empty(tmp_path):
+    path = str(tmp_path / "priors.npz")
+    qu.PriorIndex({}).save(path)
+    assert len(qu.PriorIndex.load(path)) == 0
@@ -0,0 +1,83 @@
+import threading
+
+from week4.query_classifier import QueryClassifier
+
+
+# Stands in for a fastText model: predicts category "cat_<first word>" with the confidence in `confidences`
+class FakeModel:
+
+    def __init__(self, confidences=None) -> None:
+        self.confidences = confidences or {}
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def predict(self, queries, k=1):
+        with self._lock:
+            self.calls.append(list(queries))
+        labels = [["__label__cat_%s" % query.split()[0]] for query in queries]
+        probs = [[self.confidences.get(query, 0.9)] for query in queries]
+        return labels, probs
+
+
+def test_predictions_are_cached_by_normalized_query():
+    model = FakeModel()
+    classifier = QueryClassifier(model, batch_wait=0)
+    assert classifier.predict("TV") == ("cat_tv", 0.9)
+    assert classifier.predict("  tv ") == ("cat_tv", 0.9)
+    assert model.calls == [["tv"]]
+    assert classifier.stats()["hits"] == 1
+    assert classifier.stats()["misses"] == 1
+
+
+def test_low_confidence_predictions_are_not_used():
+    classifier = QueryClassifier(FakeModel({"tv": 0.3}), threshold=0.5, batch_wait=0)
+    assert classifier.get_category("tv") is None
+    assert classifier.predict("tv") == ("cat_tv", 0.3)  # but still cached
+    assert classifier.get_category("laptop") == "cat_laptop"
+
+
+def test_cache_is_lru():
+    model = FakeModel()
+    classifier = QueryClassifier(model, cache_size=2, batch_wait=0)
+    for query in ["a", "b", "a", "c", "a", "b"]:
+        classifier.predict(query)
+    assert [call[0] for call in model.calls] == ["a", "b", "c", "b"]
+
+
+def test_empty_query_is_not_classified():
+    model = FakeModel()
+    assert QueryClassifier(model, batch_wait=0).predict("   ") == (None, 0.0)
+    assert model.calls == []
+
+
+def test_concurrent_misses_are_batched():
+    model = FakeModel()
+    classifier = QueryClassifier(model, batch_wait=0.2, max_batch=64)
+    queries = ["query %s" % i for i in range(10)] + ["query 0"]
+    results = {}
+    start = threading.Barrier(len(queries))
+
+    def predict(idx, query):
+        start.wait()
+        results[idx] = classifier.predict(query)
+    threads = [threading.Thread(target=predict, args=(idx, query)) for idx, query in enumerate(queries)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(results[idx] == ("cat_query", 0.9) for idx in range(len(queries)))
+    assert sum(len(call) for call in model.calls) == 10  # the duplicate shared its batch's prediction
+    assert len(model.calls) < 10
+    assert classifier.stats()["batches"] == len(model.calls)
+
+
+def test_batch_errors_reach_every_caller():
+    class BrokenModel:
+        def predict(self, queries, k=1):
+            raise ValueError("broken")
+    classifier = QueryClassifier(BrokenModel(), batch_wait=0.001)
+    try:
+        classifier.predict("tv")
+        assert False, "expected the model's error"
+    except ValueError as e:
+        assert str(e) == "broken"
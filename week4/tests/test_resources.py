@@ -0,0 +1,63 @@
+import os
+import threading
+import time
+
+import pytest
+
+from week4.resources import FAILED, LOADED, Resources
+
+
+class FakeApp:
+
+    def __init__(self) -> None:
+        self.config = {}
+
+
+def wait_until_ready(resources, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not resources.ready() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return resources.ready()
+
+
+def test_loads_in_the_foreground():
+    app = FakeApp()
+    resources = Resources(background=False)
+    resources.load(app, "model", lambda: {"model": "loaded"})
+    assert resources.ready()
+    assert app.config["model"] == "loaded"
+    assert resources.status()["model"]["state"] == LOADED
+
+
+def test_not_ready_until_background_loads_finish():
+    app = FakeApp()
+    release = threading.Event()
+    resources = Resources(background=True)
+    resources.load(app, "model", lambda: release.wait(5) and {"model": "loaded"})
+    assert not resources.ready()
+    assert "model" not in app.config
+    release.set()
+    assert wait_until_ready(resources)
+    assert app.config["model"] == "loaded"
+
+
+def test_failed_loads_dont_block_ready():
+    app = FakeApp()
+    resources = Resources(background=True)
+    resources.load(app, "model", lambda: {}["missing"])
+    assert wait_until_ready(resources)
+    assert resources.status()["model"]["state"] == FAILED
+    assert "model" not in app.config
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork")
+def test_forked_child_finishes_loading():
+    app = FakeApp()
+    resources = Resources(background=True)
+    resources.load(app, "model", lambda: time.sleep(0.3) or {"model": os.getpid()})
+    pid = os.fork()
+    if pid == 0:  # the loading thread didn't survive the fork, so the child has to load for itself
+        os._exit(0 if wait_until_ready(resources) and app.config.get("model") == os.getpid() else 1)
+    (_, status) = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert wait_until_ready(resources)
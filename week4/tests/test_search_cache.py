@@ -0,0 +1,86 @@
+import json
+import threading
+import time
+
+from week4.search_cache import SearchCache, estimate_size
+
+
+def create_response(num_hits):
+    return {"took": 3, "hits": {"total": {"value": num_hits, "relation": "eq"},
+                                "hits": [{"_id": str(i), "_score": 1.0, "_source": {"name": ["tv %s" % i]}} for i in range(num_hits)]}}
+
+
+def test_make_key_ignores_dict_order():
+    assert SearchCache.make_key("tv", {"a": 1, "b": 2}) == SearchCache.make_key("tv", {"b": 2, "a": 1})
+    assert SearchCache.make_key("tv", {"a": 1}) != SearchCache.make_key("tv", {"a": 2})
+
+
+def test_get_or_load_only_loads_on_a_miss():
+    cache = SearchCache()
+    calls = []
+    loader = lambda: calls.append(1) or "value"
+    assert cache.get_or_load("key", loader) == "value"
+    assert cache.get_or_load("key", loader) == "value"
+    assert len(calls) == 1
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_uncacheable_values_are_not_cached():
+    cache = SearchCache()
+    cache.get_or_load("key", lambda: {"timed_out": True}, cacheable=lambda value: not value["timed_out"])
+    assert cache.get("key") is None
+
+
+def test_evicts_least_recently_used_over_the_byte_budget():
+    cache = SearchCache(max_bytes=100)
+    cache.put("a", "x", size=40)
+    cache.put("b", "x", size=40)
+    cache.get("a")  # so b is the least recently used
+    cache.put("c", "x", size=40)
+    assert cache.get("a") == "x"
+    assert cache.get("b") is None
+    assert cache.get("c") == "x"
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] == 80
+
+
+def test_skips_entries_bigger_than_max_entry_bytes():
+    cache = SearchCache(max_bytes=100, max_entry_bytes=50)
+    assert not cache.put("a", "x", size=60)
+    assert cache.get("a") is None
+    assert cache.stats()["rejections"] == 1
+
+
+def test_expires_after_ttl():
+    cache = SearchCache(ttl=0.05)
+    cache.put("a", "x")
+    assert cache.get("a") == "x"
+    time.sleep(0.1)
+    assert cache.get("a") is None
+    assert cache.get_or_load("a", lambda: "y") == "y"
+
+
+def test_serves_stale_while_refreshing():
+    cache = SearchCache(ttl=0.05, stale_ttl=10)
+    cache.put("a", "old")
+    time.sleep(0.1)
+    refreshed = threading.Event()
+
+    def loader():
+        refreshed.set()
+        return "new"
+    assert cache.get_or_load("a", loader) == "old"
+    assert refreshed.wait(5)
+    for _ in range(100):  # the refresh thread puts the value after the loader returns
+        if cache.get("a") == "new":
+            break
+        time.sleep(0.01)
+    assert cache.get("a") == "new"
+    assert cache.stats()["stale_hits"] == 1
+
+
+def test_estimate_size_is_close_to_the_serialized_size():
+    for response in [create_response(0), create_response(1), create_response(500), {"not": "a response"}]:
+        size = len(json.dumps(response, separators=(",", ":")))
+        assert abs(estimate_size(response) - size) <= 0.05 * size
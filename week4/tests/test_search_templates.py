@@ -0,0 +1,72 @@
+import json
+import re
+
+import pytest
+
+import week4.utilities.ltr_utils as lu
+import week4.utilities.query_utils as qu
+
+SECTION_RE = re.compile(r"\{\{#(\w+)\}\}(.*?)\{\{/\1\}\}", re.DOTALL)
+VARIABLE_RE = re.compile(r"\{\{(\w+)\}\}")
+
+
+# Just enough of mustache, as OpenSearch runs it for a JSON search template, to render our templates: sections, the toJson
+# function, and variables, which are JSON-escaped
+def render(template, params):
+    def render_section(match):
+        (name, inner) = match.groups()
+        if name == "toJson":
+            return json.dumps(params[inner])
+        return render(inner, params) if params.get(name) else ""
+
+    def render_variable(match):
+        value = params.get(match.group(1), "")
+        return json.dumps(value)[1:-1] if isinstance(value, str) else json.dumps(value)
+    return VARIABLE_RE.sub(render_variable, SECTION_RE.sub(render_section, template))
+
+
+def create_builder_query(model, user_query, click_prior_query, filters, sort, sortDir, size, highlight, include_aggs,
+                         source, sort_tiebreaker, fuzzy, rescore_size, main_query_weight):
+    create = qu.create_simple_baseline if qu.TEMPLATE_MODELS[model] == "simple_baseline" else qu.create_query
+    query_obj = create(user_query, click_prior_query, filters, sort, sortDir, size=size, include_aggs=include_aggs,
+                       highlight=highlight, source=source, sort_tiebreaker=sort_tiebreaker, fuzzy=fuzzy)
+    if model.endswith("_LTR"):
+        query_obj = lu.create_rescore_ltr_query(user_query, query_obj, click_prior_query, "ltr_model", "week2",
+                                                rescore_size=rescore_size, main_query_weight=main_query_weight)
+    return query_obj
+
+
+def create_template_query(model, user_query, click_prior_query, filters, sort, sortDir, size, highlight, include_aggs,
+                          source, sort_tiebreaker, fuzzy, rescore_size, main_query_weight):
+    templates = qu.create_search_templates(lu.create_rescore_ltr_query, highlight=highlight, include_aggs=include_aggs)
+    ltr_args = {"ltr_model_name": "ltr_model", "ltr_store_name": "week2", "rescore_size": rescore_size,
+                "main_query_weight": main_query_weight} if model.endswith("_LTR") else {}
+    params = qu.create_search_template_params(user_query, click_prior_query, filters, sort, sortDir, size=size, source=source,
+                                              sort_tiebreaker=sort_tiebreaker, fuzzy=fuzzy, **ltr_args)
+    return json.loads(render(templates[qu.get_search_template_id(model, highlight, include_aggs)], params))
+
+
+@pytest.mark.parametrize("model", sorted(qu.TEMPLATE_MODELS))
+@pytest.mark.parametrize("highlight,include_aggs", [(True, True), (False, False)])
+@pytest.mark.parametrize("user_query,click_prior_query", [
+    ("tv", ""),
+    ("apple ipad 2", "1234^0.500  5678^0.250  "),
+    ('16" "monitor" \\ back\\slash', ""),
+])
+@pytest.mark.parametrize("filters,source,sort_tiebreaker,fuzzy", [
+    ([], None, None, True),
+    ([{"term": {"department.keyword": "VIDEO/COMPACT DISC"}}], ["sku", "name"], "sku.keyword", False),
+])
+def test_rendered_template_matches_builder(model, highlight, include_aggs, user_query, click_prior_query, filters, source,
+                                           sort_tiebreaker, fuzzy):
+    args = (model, user_query, click_prior_query, filters, "_score", "desc", 25, highlight, include_aggs, source,
+            sort_tiebreaker, fuzzy, 100, 0)
+    builder_query = create_builder_query(*args)
+    builder_query.setdefault("_source", True)  # the template always sends _source, true is OpenSearch's default
+    assert create_template_query(*args) == builder_query
+
+
+def test_template_ids():
+    templates = qu.create_search_templates(lu.create_rescore_ltr_query, highlight=False, include_aggs=False)
+    assert sorted(templates) == sorted("bbuy_%s_nohl_noaggs" % model for model in qu.TEMPLATE_MODELS)
+    assert all("__" not in source for source in templates.values())  # every placeholder was replaced
@@ -0,0 +1,67 @@
+import threading
+
+import pytest
+
+from week4.singleflight import SingleFlight
+
+
+def run_concurrently(single_flight, key, fn, num_threads):
+    results = [None] * num_threads
+    errors = [None] * num_threads
+    ready = threading.Barrier(num_threads)
+
+    def run(idx):
+        ready.wait()
+        try:
+            results[idx] = single_flight.do(key, fn)
+        except Exception as e:
+            errors[idx] = e
+    threads = [threading.Thread(target=run, args=(idx,)) for idx in range(num_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def slow_call(release, calls, result=None, error=None):
+    def call():
+        calls.append(1)
+        release.wait(5)
+        if error is not None:
+            raise error
+        return result
+    return call
+
+
+def test_concurrent_calls_share_one_call():
+    single_flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+    threading.Timer(0.2, release.set).start()
+    (results, errors) = run_concurrently(single_flight, "key", slow_call(release, calls, result="value"), 10)
+    assert results == ["value"] * 10
+    assert errors == [None] * 10
+    assert len(calls) == 1
+    assert single_flight.stats() == {"calls_total": 1, "collapsed_total": 9, "in_flight": 0}
+
+
+def test_errors_are_shared():
+    single_flight = SingleFlight()
+    release = threading.Event()
+    threading.Timer(0.2, release.set).start()
+    (results, errors) = run_concurrently(single_flight, "key", slow_call(release, [], error=ValueError("boom")), 5)
+    assert all(isinstance(error, ValueError) for error in errors)
+    assert single_flight.stats()["in_flight"] == 0
+
+
+def test_different_keys_and_later_calls_run_again():
+    single_flight = SingleFlight()
+    calls = []
+    assert single_flight.do("a", lambda: calls.append("a") or 1) == 1
+    assert single_flight.do("b", lambda: calls.append("b") or 2) == 2
+    assert single_flight.do("a", lambda: calls.append("a") or 3) == 3  # not a cache
+    assert calls == ["a", "b", "a"]
+    with pytest.raises(KeyError):
+        single_flight.do("a", lambda: {}["missing"])
+    assert single_flight.do("a", lambda: 4) == 4
@@ -0,0 +1,46 @@
+import pandas as pd
+
+from week4.spelling import SpellingCorrector, edit_distance
+
+
+def create_corrector(**kwargs):
+    query_counts = pd.Series({"laptop": 100, "laptop bag": 10, "headphones": 50, "iphone": 80, "ipad": 5})
+    names = ["Apple iPhone 4", "Sony Headphones", "Samsung Television", "Samsung Television"]
+    return SpellingCorrector.from_vocabulary(query_counts, names, min_count=2, **kwargs)
+
+
+def test_edit_distance():
+    assert edit_distance("laptop", "laptop", 2) == 0
+    assert edit_distance("laptpo", "laptop", 2) == 1  # a transposition is one edit
+    assert edit_distance("lptop", "laptop", 2) == 1
+    assert edit_distance("lapptopp", "laptop", 2) == 2
+    assert edit_distance("lap", "laptop", 2) == 3  # over the max, we give up at max + 1
+
+
+def test_corrects_each_word():
+    corrector = create_corrector()
+    assert corrector.correct("labtop") == "laptop"
+    assert corrector.correct("headphnoes") == "headphones"
+    assert corrector.correct("labtop bga") == "laptop bag"
+    assert corrector.correct("samsung televsion") == "samsung television"
+
+
+def test_leaves_known_short_and_non_alpha_words_alone():
+    corrector = create_corrector()
+    assert corrector.correct("laptop") is None
+    assert corrector.correct("ipd") == "ipad"
+    assert corrector.correct("ip") is None  # shorter than min_word_length
+    assert corrector.correct("kx3000") is None
+    assert corrector.correct("zzzzzzzz") is None  # nothing close enough
+
+
+def test_prefers_closer_then_more_frequent_words():
+    corrector = SpellingCorrector({"cable": 10, "table": 100, "cables": 1000})
+    assert corrector.correct_word("cabel") == "cable"  # one transposition beats two edits
+    assert corrector.correct_word("xable") == "table"  # both one edit, table is more frequent
+
+
+def test_min_count_drops_rare_words():
+    corrector = create_corrector()
+    assert "apple" not in corrector.word_counts  # only in one product name
+    assert "samsung" in corrector.word_counts
@@ -0,0 +1,61 @@
+def get_page_fetches(searches):
+    return [query_obj for query_obj in searches if "ids" in query_obj.get("query", {})]
+
+
+def to_product_ids(skus):
+    return [str(int(sku) + 1000000) for sku in skus]  # see opensearch_standin.create_product
+
+
+def test_ltr_window_is_id_only(get_results, searches):
+    get_results("/search/query?query=tv&model=ht_LTR")
+    window_query = [query_obj for query_obj in searches if "rescore" in query_obj][0]
+    assert window_query["_source"] is False
+    assert "highlight" not in window_query
+
+
+def test_ltr_fetches_just_the_page_in_window_order(standin, get_results, searches, monkeypatch):
+    match = standin.match
+
+    # return the page's documents in the wrong order, so we know the page is put back in the window's order
+    def reversed_ids(query_obj):
+        skus = match(query_obj)
+        return skus[::-1] if "ids" in query_obj.get("query", {}) else skus
+    monkeypatch.setattr(standin, "match", reversed_ids)
+    page = get_results("/search/query?query=tv&model=ht_LTR")
+    window_query = [query_obj for query_obj in searches if "rescore" in query_obj][0]
+    (_, window) = standin.search(window_query)
+    window_skus = [hit["_id"] for hit in window["hits"]["hits"]]
+    [page_fetch] = get_page_fetches(searches)
+    assert page_fetch["query"]["ids"]["values"] == window_skus[:10]
+    assert page.product_ids == to_product_ids(window_skus[:10])
+
+
+def test_ltr_drops_hits_deleted_since_the_window(standin, get_results, searches, monkeypatch):
+    match = standin.match
+    deleted = []
+
+    def delete_first(query_obj):
+        skus = match(query_obj)
+        if "ids" in query_obj.get("query", {}):
+            deleted.append(skus[0])
+            return skus[1:]
+        return skus
+    monkeypatch.setattr(standin, "match", delete_first)
+    page = get_results("/search/query?query=tv&model=ht_LTR")
+    assert len(page.product_ids) == 9
+    assert to_product_ids(deleted)[0] not in page.product_ids
+
+
+def test_other_models_search_in_one_phase(get_results, searches):
+    page = get_results("/search/query?query=laptop&model=simple")
+    assert len(page.product_ids) == 10
+    assert not get_page_fetches(searches)
+    assert searches[-1].get("_source") is not False
+
+
+def test_two_phase_can_be_turned_off(app, get_results, searches):
+    app.config["TWO_PHASE_RETRIEVAL"] = False
+    page = get_results("/search/query?query=tv&model=ht_LTR")
+    assert len(page.product_ids) == 10
+    assert not get_page_fetches(searches)
+    assert "highlight" in [query_obj for query_obj in searches if "rescore" in query_obj][0]
@@ -0,0 +1,41 @@
+import pandas as pd
+
+from week4.typeahead import Typeahead
+
+
+def create_typeahead(**kwargs):
+    queries = ["ipad", "iphone", "iphone case", "ipod", "tv", "tv stand", "xbox"]
+    counts = [50, 100, 30, 10, 80, 5, 20]
+    return Typeahead(queries, counts, **kwargs)
+
+
+def test_suggests_most_frequent_completions_first():
+    typeahead = create_typeahead(top_n=3)
+    assert typeahead.suggest("ip") == [("iphone", 100), ("ipad", 50), ("iphone case", 30)]
+    assert typeahead.suggest("iphone") == [("iphone", 100), ("iphone case", 30)]
+    assert typeahead.suggest("TV ") == [("tv", 80), ("tv stand", 5)]  # normalized like the queries
+
+
+def test_precomputed_and_computed_prefixes_agree():
+    precomputed = create_typeahead(top_n=10, precompute_length=2)
+    computed = create_typeahead(top_n=10, precompute_length=0)
+    for prefix in ["", "i", "ip", "ipa", "iph", "t", "tv", "x", "z"]:
+        assert precomputed.suggest(prefix) == computed.suggest(prefix)
+
+
+def test_n_limits_the_suggestions():
+    typeahead = create_typeahead(top_n=2)
+    assert typeahead.suggest("i", n=1) == [("iphone", 100)]
+    assert len(typeahead.suggest("i", n=4)) == 4  # more than top_n is computed on the fly
+    assert typeahead.suggest("i", n=0) == []
+
+
+def test_no_completions():
+    assert create_typeahead().suggest("zune") == []
+
+
+def test_from_clicks_counts_normalized_queries():
+    clicks_df = pd.DataFrame({"query": ["iPad", "ipad ", "ipad", "ipod", None, "tv", "tv"]})
+    typeahead = Typeahead.from_clicks(clicks_df, min_count=2)
+    assert len(typeahead) == 2
+    assert typeahead.suggest("") == [("ipad", 3), ("tv", 2)]
@@ -0,0 +1,69 @@
+#
+# Query autocompletion from the query logs, served from memory so that we never send keystrokes to OpenSearch.
+#
+# The (normalized) queries are kept in one sorted list, so all the completions of a prefix are a contiguous range of it
+# that we find with two binary searches.  We then take the most frequent queries in the range.  Short prefixes match a
+# big chunk of the list, so we precompute their completions when we build the index.
+#
+import bisect
+
+import numpy as np
+import pandas as pd
+
+import week4.utilities.query_utils as qu
+
+# sorts after any character we'll see in a query, so prefix + MAX_CHAR is just past the last query starting with prefix
+MAX_CHAR = "\U0010ffff"
+
+
+class Typeahead:
+
+    def __init__(self, queries, counts, top_n=10, precompute_length=2) -> None:
+        order = np.argsort(np.asarray(queries, dtype=object), kind="stable")
+        self.queries = [queries[idx] for idx in order]
+        self.counts = np.asarray(counts, dtype=np.int64)[order]
+        self.top_n = top_n
+        self.precomputed = {}  # prefix -> completions, for every prefix up to precompute_length characters
+        prefixes = {""}
+        for query in self.queries:
+            for length in range(1, min(precompute_length, len(query)) + 1):
+                prefixes.add(query[:length])
+        for prefix in prefixes:
+            self.precomputed[prefix] = self._complete(prefix, top_n)
+
+    # Count how often each (normalized) query was searched.  min_count drops the rare ones, which are mostly typos.
+    @classmethod
+    def from_clicks(cls, clicks_df, min_count=2, **kwargs):
+        counts = clicks_df["query"].dropna().astype(str).map(qu.normalize_query).value_counts()
+        counts = counts[(counts >= min_count) & (counts.index != "")]
+        print("Built typeahead for %s queries from %s clicks" % (len(counts), len(clicks_df)))
+        return cls(list(counts.index), counts.to_numpy(), **kwargs)
+
+    @classmethod
+    def from_csv(cls, clicks_file, min_count=2, **kwargs):
+        return cls.from_clicks(pd.read_csv(clicks_file, usecols=["query"]), min_count, **kwargs)
+
+    def __len__(self):
+        return len(self.queries)
+
+    # The most frequent queries starting with prefix, most frequent first, as (query, count) pairs
+    def suggest(self, prefix, n=None):
+        n = self.top_n if n is None else n
+        prefix = qu.normalize_query(prefix)
+        completions = self.precomputed.get(prefix) if n <= self.top_n else None
+        if completions is None:
+            completions = self._complete(prefix, n)
+        return completions[:n]
+
+    def _complete(self, prefix, n):
+        lo = bisect.bisect_left(self.queries, prefix)
+        hi = bisect.bisect_left(self.queries, prefix + MAX_CHAR, lo)
+        if hi <= lo or n <= 0:
+            return []
+        counts = self.counts[lo:hi]
+        if hi - lo > n:
+            top = np.argpartition(-counts, n - 1)[:n]
+        else:
+            top = np.arange(hi - lo)
+        top = top[np.argsort(-counts[top], kind="stable")]
+        return [(self.queries[lo + idx], int(counts[idx])) for idx in top]
@@ -16,6 +16,7 @@ import click_models as cm
 import data_prepper as dp
 import ltr_utils as ltr
 import pandas as pd
+import query_utils as qu
 import search_utils as su
 import xgb_utils as xgbu
 from opensearchpy import OpenSearch
@@ -35,6 +36,8 @@ if __name__ == "__main__":
                          help='The OpenSearch host name')
     general.add_argument("-p", '--port', type=int, default=9200,
                          help='The OpenSearch port')
+    general.add_argument('--no_ssl', action="store_true",
+                         help='Connect over plain HTTP, e.g. to week4/utilities/opensearch_standin.py')
     general.add_argument('--user',
                          help='The OpenSearch admin.  If this is set, the program will prompt for password too. If not set, use default of admin/admin')
     general.add_argument("-l", '--ltr_store', default="week3",
@@ -75,6 +78,8 @@ if __name__ == "__main__":
                            help='Upload the featureset given by the --featureset argument to OpenSearch')
     ltr_group.add_argument("-u", '--upload_ltr_model', action="store_true",
                            help='Upload XGB LTR model under the given featureset. Requires --featureset_name and --xgb_model')
+    ltr_group.add_argument('--upload_search_templates', action="store_true",
+                           help='Store the query builders (simple, hand tuned and their LTR rescore versions) as OpenSearch mustache search templates.  See query_utils.create_search_templates')
 
     xgb_group = parser.add_argument_group("XGB Model Training and Testing")
     xgb_group.add_argument("-x", '--xgb',
@@ -103,6 +108,8 @@ if __name__ == "__main__":
                            help="For the rescore query, how much weight to give the main query.")
     xgb_group.add_argument("--xgb_rescore_query_weight", default=2, type=float,
                            help="For the rescore query, how much weight to give the rescore query.")
+    xgb_group.add_argument("--xgb_test_search_templates", action="store_true",
+                           help="Run the --xgb_test queries through the stored search templates (see --upload_search_templates) instead of sending the query bodies.")
 
     analyze_group = parser.add_argument_group("Analyze Test Results")
     analyze_group.add_argument("--analyze", action="store_true",
@@ -155,14 +162,14 @@ if __name__ == "__main__":
         password = getpass()
         auth = (args.user, password)
 
-    base_url = "https://{}:{}/".format(host, port)
+    base_url = "{}://{}:{}/".format("http" if args.no_ssl else "https", host, port)
     opensearch = OpenSearch(
         hosts=[{'host': host, 'port': port}],
         http_compress=True,  # enables gzip compression for request bodies
         http_auth=auth,
         # client_cert = client_cert_path,
         # client_key = client_key_path,
-        use_ssl=True,
+        use_ssl=not args.no_ssl,
         verify_certs=False,  # set to true if you have certs
         ssl_assert_hostname=False,
         ssl_show_warn=False,
@@ -221,6 +228,14 @@ if __name__ == "__main__":
             ltr.upload_model(model_path, json.load(model_file), auth)
 
 
+    # Store the query builders as search templates.  We store the app's versions (with and without aggregations and
+    # highlighting, see search.query) and the one we use for testing (neither)
+    if args.upload_search_templates:
+        qu.put_search_templates(opensearch, qu.create_search_templates(ltr.create_rescore_ltr_query))
+        qu.put_search_templates(opensearch, qu.create_search_templates(ltr.create_rescore_ltr_query, highlight=False))  # two phase retrieval
+        qu.put_search_templates(opensearch, qu.create_search_templates(ltr.create_rescore_ltr_query, include_aggs=False))  # degraded
+        qu.put_search_templates(opensearch, qu.create_search_templates(ltr.create_rescore_ltr_query, highlight=False, include_aggs=False))
+
     ######
     #
     # Impressions are candidate queries with *simulated* ranks added to them as well as things like number of impressions
@@ -381,7 +396,8 @@ if __name__ == "__main__":
         # DataFrame: query, doc, rank, type, miss, score, new
         results_df, no_results = su.evaluate_test_set(test_data, train_df, opensearch, args.xgb_model_name,
                                                       args.ltr_store, args.index, num_queries=args.xgb_test_num_queries,
-                                                      main_query_weight=args.xgb_main_query_weight, rescore_query_weight=args.xgb_rescore_query_weight
+                                                      main_query_weight=args.xgb_main_query_weight, rescore_query_weight=args.xgb_rescore_query_weight,
+                                                      use_search_templates=args.xgb_test_search_templates
                                                       )
         print("Writing results of test to %s" % "%s/%s" % (output_dir, args.xgb_test_output))
         results_df.to_csv("%s/%s" % (output_dir, args.xgb_test_output), index=False)
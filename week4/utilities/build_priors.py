@@ -0,0 +1,20 @@
+####
+#
+#  Precompute the click priors for the search app from the LTR training clicks and save them in the binary form that
+#  PriorIndex.load reads, so the app doesn't have to read and group the CSV every time it starts.
+#
+###
+import argparse
+
+import query_utils as qu
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build the click priors for the search app.')
+    general = parser.add_argument_group("general")
+    general.add_argument("--input", default="/workspace/ltr_output/train.csv", help="The click CSV to build the priors from")
+    general.add_argument("--output", default="/workspace/ltr_output/priors.npz", help="Where to write the priors.  Point PRIOR_CLICKS_LOC at it.")
+    general.add_argument("--top_k", type=int, default=0, help="Only keep the top k skus for each query.  0 keeps them all")
+    args = parser.parse_args()
+
+    prior_index = qu.PriorIndex.from_csv(args.input, top_k=args.top_k or None)
+    prior_index.save(args.output)
@@ -0,0 +1,137 @@
+####
+#
+#  Replay the queries from the click logs (e.g. train.csv or test.csv) against the search app and report the latency,
+#  error rate and throughput for each model.
+#
+#  We keep the shape of the traffic: the requests are sent with the same gaps between them as the query_times in the
+#  log, just scaled so that the average rate is --qps.  The requests are spread round robin over --models, so every model
+#  sees the same traffic shape.  Requests are sent on schedule whether or not the earlier ones have come back, and the
+#  latency is measured from when a request was due, so a backed up app shows up as latency instead of as fewer requests.
+#
+#  To run it on a laptop, point the app at the OpenSearch stand-in (opensearch_standin.py), or pass --start_standin to
+#  run the stand-in here:
+#    python load_test.py --start_standin --standin_port 9201 &
+#    OPENSEARCH_PORT=9201 OPENSEARCH_USE_SSL=false flask run --port 3000
+#
+###
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import requests
+
+MODELS = ["simple", "hand_tuned", "simple_LTR", "ht_LTR"]
+
+
+# Returns a list of (seconds from the start, query, model), in the order to send them
+def create_schedule(clicks_df, qps, models, max_queries=None):
+    clicks_df = clicks_df[["query", "query_time"]].dropna().sort_values("query_time", kind="mergesort")
+    if max_queries:
+        clicks_df = clicks_df.head(max_queries)
+    times = (clicks_df["query_time"] - clicks_df["query_time"].iloc[0]).dt.total_seconds().to_numpy()
+    if len(times) > 1 and times[-1] > 0:
+        # scale the gaps so that the whole log takes len(times) / qps seconds
+        offsets = times * (len(times) / times[-1]) / qps
+    else:
+        offsets = np.arange(len(times)) / qps
+    queries = clicks_df["query"].astype(str).to_numpy()
+    return [(offset, query, models[idx % len(models)]) for idx, (offset, query) in enumerate(zip(offsets, queries))]
+
+
+class LoadTest:
+
+    def __init__(self, url, path="/search/query", workers=64, timeout=10.0) -> None:
+        self.url = url.rstrip("/") + path
+        self.workers = workers
+        self.timeout = timeout
+        self.results = {}  # model -> {"latencies": [seconds], "errors": count}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def run(self, schedule):
+        start = time.perf_counter() + 0.1
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for (offset, query, model) in schedule:
+                due = start + offset
+                wait = due - time.perf_counter()
+                if wait > 0:
+                    time.sleep(wait)
+                pool.submit(self.send, due, query, model)
+        return time.perf_counter() - start
+
+    def send(self, due, query, model):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        error = False
+        try:
+            response = session.get(self.url, params={"query": query, "model": model}, timeout=self.timeout)
+            error = response.status_code >= 400
+        except requests.RequestException:
+            error = True
+        latency = time.perf_counter() - due
+        with self._lock:
+            result = self.results.setdefault(model, {"latencies": [], "errors": 0})
+            result["latencies"].append(latency)
+            if error:
+                result["errors"] += 1
+
+    # A row per model (and one for all of them) with the request count, error rate, throughput and latency percentiles
+    def report(self, elapsed):
+        rows = []
+        all_latencies = []
+        all_errors = 0
+        for model, result in sorted(self.results.items()):
+            rows.append(create_report_row(model, result["latencies"], result["errors"], elapsed))
+            all_latencies.extend(result["latencies"])
+            all_errors += result["errors"]
+        rows.append(create_report_row("all", all_latencies, all_errors, elapsed))
+        return pd.DataFrame(rows).set_index("model")
+
+
+def create_report_row(model, latencies, errors, elapsed):
+    latencies_ms = np.array(latencies) * 1000
+    (p50, p90, p99) = np.percentile(latencies_ms, [50, 90, 99]) if len(latencies_ms) else (np.nan, np.nan, np.nan)
+    return {"model": model, "requests": len(latencies), "errors": errors,
+            "error_rate": errors / len(latencies) if latencies else 0.0,
+            "throughput_qps": len(latencies) / elapsed if elapsed > 0 else 0.0,
+            "p50_ms": p50, "p90_ms": p90, "p99_ms": p99}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Replay the click logs against the search app.')
+    general = parser.add_argument_group("general")
+    general.add_argument("-u", '--url', default="http://localhost:3000", help='The search app')
+    general.add_argument('--path', default="/search/query", help='The search page to hit, e.g. /search/api for the JSON API')
+    general.add_argument("-f", '--queries', default="/workspace/datasets/test.csv",
+                         help='A CSV with query and query_time columns, e.g. train.csv or test.csv')
+    general.add_argument('--qps', type=float, default=20, help='The average number of queries per second to send')
+    general.add_argument('--max_queries', type=int, default=2000, help='Only replay the first this many queries.  0 for all')
+    general.add_argument('--models', default=",".join(MODELS), help='Comma separated list of the models to spread the queries over')
+    general.add_argument('--workers', type=int, default=64, help='The most requests in flight at once')
+    general.add_argument('--timeout', type=float, default=10.0, help='Seconds before a request counts as an error')
+    general.add_argument('--output', help='Also write the report to this CSV')
+    standin_group = parser.add_argument_group("OpenSearch stand-in")
+    standin_group.add_argument('--start_standin', action="store_true", help='Run the OpenSearch stand-in while we run')
+    standin_group.add_argument('--standin_port', type=int, default=9201, help='The port the stand-in listens on')
+    standin_group.add_argument('--standin_latency_ms', type=float, default=5.0, help='How long each stand-in search takes')
+    args = parser.parse_args()
+
+    if args.start_standin:
+        import opensearch_standin as osi
+        server = osi.create_server("localhost", args.standin_port, osi.StandIn(latency_ms=args.standin_latency_ms))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print("OpenSearch stand-in listening on http://localhost:%s" % args.standin_port)
+
+    clicks_df = pd.read_csv(args.queries, usecols=["query", "query_time"], parse_dates=["query_time"])
+    schedule = create_schedule(clicks_df, args.qps, args.models.split(","), args.max_queries)
+    print("Replaying %s queries at %s qps against %s%s" % (len(schedule), args.qps, args.url, args.path))
+    load_test = LoadTest(args.url, args.path, args.workers, args.timeout)
+    elapsed = load_test.run(schedule)
+    report = load_test.report(elapsed)
+    print(report.to_string(float_format=lambda value: "%.3f" % value))
+    if args.output:
+        report.to_csv(args.output)
@@ -0,0 +1,630 @@
+####
+#
+#  A stand-in for OpenSearch, so the search apps, build_ltr.py and load_test.py can run on a laptop without a cluster, and
+#  so we can benchmark the Python side without OpenSearch's time muddying the numbers.
+#
+#  It implements the endpoints this project uses: _search (including feature logging, from/search_after paging and
+#  track_total_hits), _search/point_in_time, _search/template, _msearch, _explain, _doc, _mget, _scripts and the LTR
+#  plugin's store, featureset and model routes.  Responses come from, in order:
+#    1. A recording (--recordings) of a real cluster's responses, if it has one for the same request.  Make one by running
+#       with --record_from pointing at the real cluster, which proxies every request to it and saves the responses.
+#    2. Otherwise they're synthesized, from a sample of real products (--products, one product _source per line as JSON)
+#       or from made up ones.  They're only as realistic as the code here needs: the shapes are right and the same
+#       request always gets the same response.
+#  Every response is delayed by --latency_ms (+/- --jitter_ms), plus --rescore_latency_ms for LTR rescoring.
+#
+#  Point the app (or build_ltr.py --no_ssl) at it over plain HTTP:
+#    python opensearch_standin.py --port 9201 &
+#    OPENSEARCH_PORT=9201 OPENSEARCH_USE_SSL=false flask run --port 3000
+#    python build_ltr.py --no_ssl --port 9201 ...
+#
+###
+import argparse
+import gzip
+import json
+import random
+import re
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+DEPARTMENTS = ["VIDEO/COMPACT DISC", "MUSIC", "COMPUTERS", "TV/VIDEO", "MOBILE", "APPLIANCES"]
+INDEX = r"/(?P<index>[^/_][^/]*)"
+STORE = r"/_ltr(?:/(?P<store>[^/_][^/]*))?"  # no store name means the default store
+
+
+# A made up product.  Deterministic, so the same sku always looks the same.
+def create_product(sku):
+    rand = random.Random(sku)
+    return {
+        "sku": [str(sku)],
+        "productId": [str(sku + 1000000)],
+        "name": ["Product %s" % sku],
+        "shortDescription": ["A short description of product %s" % sku],
+        "longDescription": ["A longer description of product %s, with more words in it" % sku],
+        "department": [rand.choice(DEPARTMENTS)],
+        "regularPrice": [round(rand.uniform(5, 1000), 2)],
+        "salesRankShortTerm": [rand.randint(1, 100000)],
+        "salesRankMediumTerm": [rand.randint(1, 100000)],
+        "salesRankLongTerm": [rand.randint(1, 100000)],
+        "image": ["http://images.bestbuy.com/BestBuy_US/images/products/%s/%s_sa.jpg" % (sku // 10000, sku)]
+    }
+
+
+# The request, canonicalized so that the same JSON with its keys in a different order is the same request.  The preference
+# only picks which shard copies answer (hedged searches send a random one, see hedging.py), so it isn't part of the key.
+def get_recording_key(method, path, body):
+    (path, _, query_string) = path.partition("?")
+    args = [arg for arg in query_string.split("&") if arg and not arg.startswith("preference=")]
+    if args:
+        path += "?" + "&".join(args)
+    text = body.decode("utf-8") if body else ""
+    try:
+        lines = [json.dumps(json.loads(line), sort_keys=True) for line in text.split("\n") if line.strip()]
+        text = "\n".join(lines)
+    except ValueError:
+        pass
+    return "%s %s %s" % (method, path, text)
+
+
+class StandIn:
+
+    def __init__(self, products=None, num_products=10000, max_hits=1000, latency_ms=5.0, jitter_ms=2.0,
+                 rescore_latency_ms=0.0) -> None:
+        if products:
+            self.products = {int(product["sku"][0] if isinstance(product["sku"], list) else product["sku"]): product
+                             for product in products}
+        else:
+            self.products = None
+        self.skus = sorted(self.products.keys()) if self.products else list(range(num_products))
+        self.max_hits = max_hits  # the most hits any query matches
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rescore_latency_ms = rescore_latency_ms
+        self.recordings = {}  # recording key -> (status, response)
+        self.stores = {}  # LTR store name -> {"featuresets": {name: featureset}, "models": {name: model}}
+        self.scripts = {}  # stored script (search template) id -> script
+        self.pits = {}  # point in time id -> index.  They never expire, the stand-in doesn't live long enough to care
+        self._lock = threading.Lock()
+
+    def load_recordings(self, path):
+        with open(path) as input:
+            for line in input:
+                recording = json.loads(line)
+                self.recordings[recording["key"]] = (recording["status"], recording["response"])
+        print("Loaded %s recorded responses from %s" % (len(self.recordings), path))
+
+    def get_product(self, sku):
+        if self.products is not None:
+            return self.products.get(sku)
+        return create_product(sku) if 0 <= sku < len(self.skus) else None
+
+    def delay(self, query_obj=None):
+        latency_ms = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if query_obj is not None and "rescore" in query_obj:
+            latency_ms += self.rescore_latency_ms
+        time.sleep(max(latency_ms, 0) / 1000)
+
+    # The skus a query matches, best first.  Seeded by the query, so the same query always gets the same results.
+    def match(self, query_obj):
+        ids = find_ids(query_obj.get("query", {}))
+        if ids is not None:
+            return [int(sku) for sku in ids if str(sku).isdigit() and self.get_product(int(sku)) is not None]
+        rand = random.Random(json.dumps(query_obj.get("query", {}), sort_keys=True))
+        total = rand.randint(0, min(self.max_hits, len(self.skus)))
+        return rand.sample(self.skus, total)
+
+    def search(self, query_obj):
+        start = time.perf_counter()
+        pit = query_obj.get("pit")
+        if pit is not None and pit.get("id") not in self.pits:
+            return 404, create_error("search_context_missing_exception", "No search context found for id [%s]" % pit.get("id"), 404)
+        self.delay(query_obj)
+        skus = self.match(query_obj)
+        offset = int(query_obj.get("from", 0))
+        if query_obj.get("search_after"):
+            offset = get_search_after_offset(skus, query_obj["search_after"])
+        size = int(query_obj.get("size", 10))
+        feature_logging = get_feature_logging(query_obj)
+        if feature_logging is not None:
+            feature_names = self.get_feature_names(feature_logging["store"], feature_logging["featureset"])
+            if feature_names is None:
+                return 400, create_error("resource_not_found_exception", "Unknown featureset [%s]" % feature_logging["featureset"], 400)
+        hits = []
+        for rank, sku in enumerate(skus[offset:offset + size]):
+            score = 100.0 / (offset + rank + 1)
+            hit = {"_index": "bbuy_products", "_id": str(sku), "_score": score}
+            source = filter_source(self.get_product(sku), query_obj.get("_source", True))
+            if source is not None:
+                hit["_source"] = source
+            if "sort" in query_obj:
+                hit["sort"] = [score, str(sku)]
+            if "highlight" in query_obj:
+                highlight = create_highlight(query_obj["highlight"], self.get_product(sku))
+                if highlight:
+                    hit["highlight"] = highlight
+            if feature_logging is not None:
+                hit["fields"] = {"_ltrlog": [{feature_logging["name"]: [
+                    {"name": name, "value": value} for name, value in
+                    create_feature_values(feature_logging["keywords"], sku, feature_names).items()]}]}
+            hits.append(hit)
+        response = {
+            "took": int((time.perf_counter() - start) * 1000),
+            "timed_out": False,
+            "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+            "hits": {"max_score": hits[0]["_score"] if hits else None, "hits": hits}
+        }
+        total = create_total(len(skus), query_obj.get("track_total_hits", 10000))
+        if total is not None:
+            response["hits"]["total"] = total
+        if pit is not None:
+            response["pit_id"] = pit["id"]
+        aggs = query_obj.get("aggs", query_obj.get("aggregations"))
+        if aggs:
+            response["aggregations"] = create_aggregations(aggs, [self.get_product(sku) for sku in skus[:1000]])
+        return 200, response
+
+    # Search templates: we don't render the stored template, we search with the parameters we can use
+    def search_template(self, template_request):
+        params = template_request.get("params", {})
+        query_obj = {"query": {"query_string": {"query": params.get("query", "")}}, "size": params.get("size", 10),
+                     "_source": params.get("source", True)}
+        if params.get("sort_tiebreaker"):
+            query_obj["sort"] = [{params.get("sort", "_score"): {"order": params.get("sortDir", "desc")}}]
+        if "ltr_model_name" in params:
+            query_obj["rescore"] = {}
+        return self.search(query_obj)
+
+    def create_point_in_time(self, index):
+        pit_id = "pit-%s" % uuid.uuid4().hex
+        with self._lock:
+            self.pits[pit_id] = index
+        return {"pit_id": pit_id, "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+                "creation_time": int(time.time() * 1000)}
+
+    def delete_point_in_time(self, body):
+        pit_ids = body.get("pit_id", [])
+        with self._lock:
+            pits = [{"pit_id": pit_id, "successful": self.pits.pop(pit_id, None) is not None}
+                    for pit_id in (pit_ids if isinstance(pit_ids, list) else [pit_ids])]
+        return {"pits": pits}
+
+    def get_doc(self, index, doc_id, source=True):
+        sku = int(doc_id) if str(doc_id).isdigit() else -1
+        product = self.get_product(sku)
+        if product is None:
+            return {"_index": index, "_id": str(doc_id), "found": False}
+        doc = {"_index": index, "_id": str(doc_id), "_version": 1, "found": True}
+        source = filter_source(product, source)
+        if source is not None:
+            doc["_source"] = source
+        return doc
+
+    def mget(self, index, body):
+        docs = body.get("docs")
+        if docs is None:
+            docs = [{"_id": doc_id} for doc_id in body.get("ids", [])]
+        return {"docs": [self.get_doc(doc.get("_index", index), doc["_id"], doc.get("_source", True)) for doc in docs]}
+
+    # One detail per should clause (like compare_explains expects), with the LTR model's features under its clause
+    def explain(self, index, doc_id, query_obj):
+        self.delay(query_obj)
+        query = query_obj.get("query", {})
+        bool_query = query.get("bool") or query.get("function_score", {}).get("query", {}).get("bool") or {}
+        clauses = bool_query.get("should", []) or bool_query.get("must", []) or [query]
+        rand = random.Random("%s %s" % (json.dumps(query, sort_keys=True), doc_id))
+        details = []
+        for clause in clauses:
+            if "sltr" in clause and "model" in clause["sltr"]:
+                feature_names = self.get_model_feature_names(clause["sltr"].get("store"), clause["sltr"]["model"]) or []
+                features = create_feature_values(clause["sltr"].get("params", {}).get("keywords", ""), doc_id, feature_names)
+                details.append({"value": sum(features.values()), "description": "LtrModel: naive_additive_decision_tree",
+                                "details": [{"value": value, "description": "Feature %s(%s):" % (idx, name), "details": []}
+                                            for idx, (name, value) in enumerate(features.items())]})
+            else:
+                details.append({"value": round(rand.uniform(0, 10), 4),
+                                "description": "weight(%s)" % json.dumps(clause, sort_keys=True)[:100], "details": []})
+        return {"_index": index, "_id": str(doc_id), "matched": True,
+                "explanation": {"value": sum(detail["value"] for detail in details), "description": "sum of:",
+                                "details": details}}
+
+    #
+    # The LTR plugin's feature store
+    #
+    def get_store(self, store):
+        return self.stores.get(store or "_default")
+
+    def create_store(self, store):
+        with self._lock:
+            self.stores.setdefault(store or "_default", {"featuresets": {}, "models": {}})
+        return {"acknowledged": True, "shards_acknowledged": True, "index": ".ltrstore" + ("_" + store if store else "")}
+
+    def delete_store(self, store):
+        with self._lock:
+            if self.stores.pop(store or "_default", None) is None:
+                return 404, create_error("index_not_found_exception", "no such index [.ltrstore_%s]" % store, 404)
+        return 200, {"acknowledged": True}
+
+    def put_featureset(self, store, name, body):
+        ltr_store = self.get_store(store)
+        if ltr_store is None:
+            return 404, create_error("index_not_found_exception", "no such index [.ltrstore_%s]" % store, 404)
+        ltr_store["featuresets"][name] = body.get("featureset", body)
+        return 201, {"_index": ".ltrstore_%s" % store, "_id": "featureset-%s" % name, "result": "created"}
+
+    def create_model(self, store, featureset_name, body):
+        ltr_store = self.get_store(store)
+        if ltr_store is None or featureset_name not in ltr_store["featuresets"]:
+            return 404, create_error("resource_not_found_exception", "Unknown featureset [%s]" % featureset_name, 404)
+        model = body.get("model", {})
+        if model.get("name") in ltr_store["models"]:
+            return 400, create_error("illegal_argument_exception", "Model [%s] already exists" % model.get("name"), 400)
+        ltr_store["models"][model.get("name")] = dict(model, featureset=featureset_name)
+        return 201, {"_index": ".ltrstore_%s" % store, "_id": "model-%s" % model.get("name"), "result": "created"}
+
+    def get_feature_names(self, store, featureset_name):
+        ltr_store = self.get_store(store)
+        featureset = ltr_store["featuresets"].get(featureset_name) if ltr_store is not None else None
+        if featureset is None:
+            return None
+        return [feature["name"] for feature in featureset.get("features", [])]
+
+    def get_model_feature_names(self, store, model_name):
+        ltr_store = self.get_store(store)
+        model = ltr_store["models"].get(model_name) if ltr_store is not None else None
+        return self.get_feature_names(store, model["featureset"]) if model is not None else None
+
+    def handle_ltr(self, method, store, kind, name, action, body):
+        ltr_store = self.get_store(store)
+        if kind is None:
+            if method == "PUT":
+                return 200, self.create_store(store)
+            if method == "DELETE":
+                return self.delete_store(store)
+            if ltr_store is None:
+                return 404, create_error("index_not_found_exception", "no such index [.ltrstore_%s]" % store, 404)
+            return 200, {"stores": {store or "_default": {"status": "green", "counts": {
+                "featureset": len(ltr_store["featuresets"]), "model": len(ltr_store["models"])}}}}
+        if kind == "_featureset" and action == "_createmodel":
+            return self.create_model(store, name, body)
+        if ltr_store is None:
+            return 404, create_error("index_not_found_exception", "no such index [.ltrstore_%s]" % store, 404)
+        if kind == "_featureset" and method in ("PUT", "POST"):
+            return self.put_featureset(store, name, body)
+        items = ltr_store["featuresets" if kind == "_featureset" else "models"]
+        if name not in items:
+            return 404, {"_index": ".ltrstore_%s" % store, "_id": "%s-%s" % (kind[1:], name), "found": False}
+        if method == "DELETE":
+            items.pop(name)
+            return 200, {"_id": "%s-%s" % (kind[1:], name), "result": "deleted"}
+        return 200, {"_id": "%s-%s" % (kind[1:], name), "found": True, "_source": items[name]}
+
+
+# The ids from an ids query (two-phase retrieval) or a terms filter on _id or sku (feature logging), or None
+def find_ids(query):
+    if "ids" in query:
+        return query["ids"].get("values", [])
+    for clause in query.get("bool", {}).get("filter", []) if isinstance(query.get("bool", {}).get("filter"), list) else []:
+        terms = clause.get("terms", {})
+        for field in ("_id", "sku"):
+            if field in terms:
+                return terms[field]
+    return None
+
+
+# The sltr query and log name if the search logs LTR features, otherwise None
+def get_feature_logging(query_obj):
+    log_specs = query_obj.get("ext", {}).get("ltr_log", {}).get("log_specs")
+    if log_specs is None:
+        return None
+    filters = query_obj.get("query", {}).get("bool", {}).get("filter", [])
+    for clause in filters if isinstance(filters, list) else []:
+        sltr = clause.get("sltr")
+        if sltr is not None and sltr.get("_name") == log_specs.get("named_query"):
+            return {"name": log_specs.get("name", "log_entry"), "store": sltr.get("store"), "featureset": sltr.get("featureset"),
+                    "keywords": sltr.get("params", {}).get("keywords", "")}
+    return None
+
+
+# Where the hits after search_after start.  Every hit's sort ends with its sku (see StandIn.search), which is all we need
+# to find it.  Like OpenSearch, a search_after past the end gets no hits.
+def get_search_after_offset(skus, search_after):
+    sku = str(search_after[-1])
+    for idx, match in enumerate(skus):
+        if str(match) == sku:
+            return idx + 1
+    return len(skus)
+
+
+# hits.total for track_total_hits: exact for true, a lower bound once it's over a number, and left out for false
+def create_total(count, track_total_hits):
+    if track_total_hits is False or track_total_hits == "false":
+        return None
+    if track_total_hits is True or track_total_hits == "true" or count <= int(track_total_hits):
+        return {"value": count, "relation": "eq"}
+    return {"value": int(track_total_hits), "relation": "gte"}
+
+
+def create_feature_values(keywords, doc_id, feature_names):
+    rand = random.Random("%s %s" % (keywords, doc_id))
+    return {name: round(rand.uniform(0, 10), 4) for name in feature_names}
+
+
+def create_error(error_type, reason, status):
+    return {"error": {"root_cause": [{"type": error_type, "reason": reason}], "type": error_type, "reason": reason},
+            "status": status}
+
+
+# The highlights for the fields highlight asks for, split into fragments the way OpenSearch would: number_of_fragments of
+# up to fragment_size characters each, or the whole field if number_of_fragments is 0.  We don't know which words match,
+# so we emphasize the first word of each fragment.
+def create_highlight(highlight, product):
+    highlights = {}
+    for field, options in highlight.get("fields", {}).items():
+        if not product.get(field):
+            continue
+        text = str(product[field][0])
+        number_of_fragments = int(options.get("number_of_fragments", 5))
+        if number_of_fragments == 0:
+            fragments = [text]
+        else:
+            fragment_size = int(options.get("fragment_size", 100))
+            fragments = [text[start:start + fragment_size] for start in range(0, len(text), fragment_size)][:number_of_fragments]
+        highlights[field] = [re.sub(r"^(\S+)", r"<em>\1</em>", fragment) for fragment in fragments]
+    return highlights
+
+
+def filter_source(source, includes):
+    if source is None or includes is True or includes is None or includes == "true":
+        return source
+    if includes is False or includes == "false":
+        return None
+    if isinstance(includes, dict):
+        includes = includes.get("includes", list(source.keys()))
+    if isinstance(includes, str):
+        includes = includes.split(",")
+    return {field: value for field, value in source.items() if field in includes}
+
+
+def create_aggregations(aggs, products):
+    aggregations = {}
+    for name, agg in aggs.items():
+        if "sampler" in agg or "diversified_sampler" in agg:
+            sample = create_sample(agg.get("sampler") or agg["diversified_sampler"], products)
+            aggregations[name] = dict(create_aggregations(agg.get("aggs", agg.get("aggregations", {})), sample),
+                                      doc_count=len(sample))
+        elif "terms" in agg:
+            counts = {}
+            for product in products:
+                for value in product.get(agg["terms"]["field"].replace(".keyword", ""), []):
+                    counts[value] = counts.get(value, 0) + 1
+            aggregations[name] = {"doc_count_error_upper_bound": 0, "sum_other_doc_count": 0,
+                                  "buckets": [{"key": key, "doc_count": count} for key, count in
+                                              sorted(counts.items(), key=lambda item: -item[1])]}
+        elif "missing" in agg:
+            aggregations[name] = {"doc_count": sum(1 for product in products if not product.get(agg["missing"]["field"]))}
+        elif "range" in agg:
+            buckets = []
+            field = agg["range"]["field"]
+            for bucket in agg["range"]["ranges"]:
+                count = sum(1 for product in products if product.get(field) and
+                            bucket.get("from", float("-inf")) <= float(product[field][0]) < bucket.get("to", float("inf")))
+                buckets.append(dict(bucket, doc_count=count))
+            aggregations[name] = {"buckets": buckets}
+        elif "stats" in agg or "extended_stats" in agg:
+            field = (agg.get("stats") or agg.get("extended_stats"))["field"]
+            values = [float(product[field][0]) for product in products if product.get(field)]
+            count = len(values)
+            avg = sum(values) / count if count else None
+            stats = {"count": count, "min": min(values) if values else None, "max": max(values) if values else None,
+                     "avg": avg, "sum": sum(values)}
+            if "extended_stats" in agg:
+                variance = sum((value - avg) ** 2 for value in values) / count if count else None
+                stats.update({"sum_of_squares": sum(value ** 2 for value in values), "variance": variance,
+                              "std_deviation": variance ** 0.5 if variance is not None else None})
+            aggregations[name] = stats
+        else:
+            aggregations[name] = {}
+    return aggregations
+
+
+# The products a (diversified_)sampler agg looks at: the best shard_size matches (we only have one shard), with at most
+# max_docs_per_value of them for each value of field, if it has one
+def create_sample(sampler, products):
+    shard_size = int(sampler.get("shard_size", 100))
+    field = sampler.get("field")
+    if field is None:
+        return products[:shard_size]
+    field = field.replace(".keyword", "")
+    max_docs_per_value = int(sampler.get("max_docs_per_value", 1))
+    counts = {}
+    sample = []
+    for product in products:
+        value = (product.get(field) or [None])[0]
+        if counts.get(value, 0) < max_docs_per_value:
+            counts[value] = counts.get(value, 0) + 1
+            sample.append(product)
+            if len(sample) == shard_size:
+                break
+    return sample
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real thing
+    # without this, Nagle plus the client's delayed ACK hold each response after the first on a connection for ~40ms,
+    # which swamps the latencies we're trying to measure
+    disable_nagle_algorithm = True
+    standin = None
+    record_from = None  # the real cluster's base URL, when recording
+    record_auth = None
+    recordings_file = None
+    recordings_lock = threading.Lock()
+
+    def do_GET(self):
+        self.handle_request()
+
+    def do_POST(self):
+        self.handle_request()
+
+    def do_PUT(self):
+        self.handle_request()
+
+    def do_DELETE(self):
+        self.handle_request()
+
+    def do_HEAD(self):
+        self.send_json(200, {})
+
+    def log_message(self, format, *args):
+        pass  # too noisy under load
+
+    def handle_request(self):
+        body = self.read_body()
+        if self.record_from is not None:
+            self.record(body)
+            return
+        recording = self.standin.recordings.get(get_recording_key(self.command, self.path, body))
+        if recording is not None:
+            self.standin.delay()
+            self.send_json(*recording)
+            return
+        try:
+            self.send_json(*self.route(body))
+        except ValueError as e:
+            self.send_json(400, create_error("parse_exception", str(e), 400))
+
+    def route(self, body):
+        (path, _, query_string) = self.path.partition("?")
+        args = dict(arg.split("=", 1) for arg in query_string.split("&") if "=" in arg)
+        method = self.command
+        standin = self.standin
+        match = re.fullmatch(STORE + r"(?:/(?P<kind>_featureset|_model)/(?P<name>[^/]+)(?:/(?P<action>_createmodel))?)?", path)
+        if match:
+            return standin.handle_ltr(method, match["store"], match["kind"], match["name"], match["action"], load_json(body))
+        match = re.fullmatch(r"%s/_search/point_in_time" % INDEX, path)
+        if match and method == "POST":
+            return 200, standin.create_point_in_time(match["index"])
+        if path == "/_search/point_in_time" and method == "DELETE":
+            return 200, standin.delete_point_in_time(load_json(body))
+        if re.fullmatch(r"(%s)?/_search/template" % INDEX, path):
+            return standin.search_template(load_json(body))
+        if re.fullmatch(r"(%s)?/_search" % INDEX, path):
+            return standin.search(load_json(body))
+        if re.fullmatch(r"(%s)?/_msearch" % INDEX, path):
+            lines = [line for line in body.decode("utf-8").split("\n") if line.strip()]
+            responses = []
+            for line in lines[1::2]:
+                (status, response) = standin.search(json.loads(line))
+                responses.append(dict(response, status=status))
+            return 200, {"took": sum(response.get("took", 0) for response in responses), "responses": responses}
+        match = re.fullmatch(r"(%s)?/_mget" % INDEX, path)
+        if match:
+            standin.delay()
+            return 200, standin.mget(match["index"], load_json(body))
+        match = re.fullmatch(r"%s/_explain/(?P<id>[^/]+)" % INDEX, path)
+        if match:
+            return 200, standin.explain(match["index"], match["id"], load_json(body))
+        match = re.fullmatch(r"%s/_doc/(?P<id>[^/]+)" % INDEX, path)
+        if match and method in ("GET", "HEAD"):
+            standin.delay()
+            source = args.get("_source", "true")
+            doc = standin.get_doc(match["index"], match["id"], source if source in ("true", "false") else source.split("%2C"))
+            return (200 if doc["found"] else 404), doc
+        match = re.fullmatch(r"/_scripts/(?P<id>[^/]+)", path)
+        if match:
+            if method in ("PUT", "POST"):
+                standin.scripts[match["id"]] = load_json(body).get("script")
+                return 200, {"acknowledged": True}
+            if match["id"] not in standin.scripts:
+                return 404, {"_id": match["id"], "found": False}
+            return 200, {"_id": match["id"], "found": True, "script": standin.scripts[match["id"]]}
+        if path == "/":
+            return 200, {"name": "standin", "cluster_name": "standin", "version": {"distribution": "opensearch", "number": "1.2.3"}}
+        return 400, create_error("unsupported_operation_exception", "The stand-in doesn't support %s %s" % (method, path), 400)
+
+    # Proxy the request to the real cluster and save its response
+    def record(self, body):
+        headers = {"Content-Type": self.headers.get("Content-Type", "application/json")}
+        response = requests.request(self.command, self.record_from.rstrip("/") + self.path, data=body, headers=headers,
+                                    auth=self.record_auth, verify=False)
+        try:
+            response_obj = response.json()
+        except ValueError:
+            response_obj = {"text": response.text}
+        with self.recordings_lock:
+            with open(self.recordings_file, "a") as output:
+                output.write(json.dumps({"key": get_recording_key(self.command, self.path, body),
+                                         "status": response.status_code, "response": response_obj}) + "\n")
+        self.send_json(response.status_code, response_obj)
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else b""
+        encoding = self.headers.get("Content-Encoding", "")
+        if encoding == "gzip":
+            body = gzip.decompress(body)
+        elif encoding == "deflate":
+            body = zlib.decompress(body)
+        return body
+
+    def send_json(self, status, obj):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+
+def load_json(body):
+    return json.loads(body) if body else {}
+
+
+# One product _source per line, e.g. a sample pulled from the real index
+def load_products(path):
+    with open(path) as input:
+        return [json.loads(line) for line in input if line.strip()]
+
+
+def create_server(host, port, standin, record_from=None, record_auth=None, recordings_file=None):
+    handler = type("Handler", (StandInHandler,), {"standin": standin, "record_from": record_from,
+                                                  "record_auth": record_auth, "recordings_file": recordings_file})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run an OpenSearch stand-in for benchmarks and offline runs.')
+    general = parser.add_argument_group("general")
+    general.add_argument("-s", '--host', default="localhost", help='The host name to listen on')
+    general.add_argument("-p", '--port', type=int, default=9201, help='The port to listen on')
+    general.add_argument('--latency_ms', type=float, default=5.0, help='How long each request takes')
+    general.add_argument('--jitter_ms', type=float, default=2.0, help='How much the latency varies by, either way')
+    general.add_argument('--rescore_latency_ms', type=float, default=0.0, help='How much longer LTR rescoring takes')
+    synth_group = parser.add_argument_group("Synthesized responses")
+    synth_group.add_argument('--products', help='A sample of products to search, one _source per line as JSON.  Otherwise we make them up')
+    synth_group.add_argument('--num_products', type=int, default=10000, help='The number of made up products')
+    synth_group.add_argument('--max_hits', type=int, default=1000, help='The most hits a query can have')
+    record_group = parser.add_argument_group("Recorded responses")
+    record_group.add_argument('--recordings', help='The recorded responses to serve, or to record to with --record_from')
+    record_group.add_argument('--record_from', help='Record: proxy every request to this cluster, e.g. https://localhost:9200')
+    record_group.add_argument('--user', default="admin", help='The user for --record_from')
+    record_group.add_argument('--password', default="admin", help='The password for --record_from')
+    args = parser.parse_args()
+
+    standin = StandIn(load_products(args.products) if args.products else None, args.num_products, args.max_hits,
+                      args.latency_ms, args.jitter_ms, args.rescore_latency_ms)
+    if args.record_from:
+        if not args.recordings:
+            parser.error("--record_from needs --recordings to write to")
+        print("Recording the responses from %s to %s" % (args.record_from, args.recordings))
+    elif args.recordings:
+        standin.load_recordings(args.recordings)
+    server = create_server(args.host, args.port, standin, args.record_from, (args.user, args.password) if args.record_from else None,
+                           args.recordings)
+    print("OpenSearch stand-in listening on http://%s:%s" % (args.host, args.port))
+    server.serve_forever()
@@ -1,5 +1,17 @@
+import json
 import math
+
+import numpy as np
+import pandas as pd
 # some helpful tools for dealing with queries
+
+
+# Lowercase and collapse whitespace so that "iPad  2" and "ipad 2" share priors, cache entries, etc.
+def normalize_query(user_query):
+    if user_query is None:
+        return ""
+    return " ".join(str(user_query).lower().split())
+
 def create_stats_query(aggs, extended=True):
     print("Creating stats query from %s" % aggs)
     agg_map = {}
@@ -40,8 +52,116 @@ def create_prior_queries(doc_ids, doc_id_weights, query_times_seen): # total imp
     return click_prior_query
 
 
+# A precomputed lookup of click priors by normalized query.  Built once from the raw click logs (e.g. train.csv) so that
+# we don't have to groupby/value_counts/concatenate strings for every query we run.
+# Each entry holds the top_k SKUs for the query (most clicked first), their weights (clicks for the SKU / total clicks for the
+# query, same as create_prior_queries) and the query_string clause created from them.
+class PriorIndex:
+
+    def __init__(self, entries, top_k=None) -> None:
+        self.entries = entries  # normalized query -> (skus, weights, click_prior_query)
+        self.top_k = top_k
+
+    @classmethod
+    def from_clicks(cls, clicks_df, top_k=None):
+        clicks_df = clicks_df[["query", "sku"]].dropna()
+        pairs = pd.DataFrame({"query": clicks_df["query"].astype(str).map(normalize_query), "sku": clicks_df["sku"]})
+        pairs = pairs.groupby(["query", "sku"]).size().reset_index(name="clicks")
+        pairs["query_times_seen"] = pairs.groupby("query")["clicks"].transform("sum")
+        pairs = pairs.sort_values(["query", "clicks"], ascending=[True, False], kind="mergesort")
+        if top_k:
+            pairs = pairs.groupby("query").head(top_k)
+        queries = pairs["query"].to_numpy()
+        skus = pairs["sku"].to_numpy()
+        weights = (pairs["clicks"] / pairs["query_times_seen"]).to_numpy(dtype=np.float32)
+        # rows are sorted by query, so each query is a contiguous slice of the arrays
+        starts = np.flatnonzero(np.r_[True, queries[1:] != queries[:-1]]) if len(queries) > 0 else np.array([], dtype=int)
+        ends = np.r_[starts[1:], len(queries)]
+        entries = {}
+        for start, end in zip(starts, ends):
+            query_skus = skus[start:end]
+            query_weights = weights[start:end]
+            click_prior_query = "".join("%s^%.3f  " % (sku, wgt) for sku, wgt in zip(query_skus, query_weights))
+            entries[queries[start]] = (query_skus, query_weights, click_prior_query)
+        print("Built prior index for %s queries from %s clicks" % (len(entries), len(clicks_df)))
+        return cls(entries, top_k)
+
+    @classmethod
+    def from_csv(cls, clicks_file, top_k=None):
+        return cls.from_clicks(pd.read_csv(clicks_file, usecols=["query", "sku"]), top_k)
+
+    # Save the index as flat numpy arrays (see utilities/build_priors.py), which load much faster than grouping the CSV
+    def save(self, path):
+        queries = list(self.entries.keys())
+        lengths = [len(self.entries[query][0]) for query in queries]
+        starts = np.zeros(len(queries) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=starts[1:])
+        skus = np.concatenate([self.entries[query][0] for query in queries]) if queries else np.array([])
+        if skus.dtype == object:
+            skus = skus.astype(str)  # so we can load without allow_pickle
+        weights = np.concatenate([self.entries[query][1] for query in queries]) if queries else np.array([], dtype=np.float32)
+        (query_blob, query_offsets) = _pack_strings(queries)
+        (clause_blob, clause_offsets) = _pack_strings([self.entries[query][2] for query in queries])
+        with open(path, "wb") as output:  # np.savez would add .npz to the path if it isn't there
+            np.savez(output, starts=starts, skus=skus, weights=weights, query_blob=query_blob, query_offsets=query_offsets,
+                     clause_blob=clause_blob, clause_offsets=clause_offsets, top_k=np.array(self.top_k or 0))
+        print("Saved prior index for %s queries to %s" % (len(queries), path))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            starts = data["starts"]
+            skus = data["skus"]
+            weights = data["weights"]
+            queries = _unpack_strings(data["query_blob"], data["query_offsets"])
+            clauses = _unpack_strings(data["clause_blob"], data["clause_offsets"])
+            top_k = int(data["top_k"]) or None
+        entries = {query: (skus[start:end], weights[start:end], clause)
+                   for query, start, end, clause in zip(queries, starts[:-1], starts[1:], clauses)}
+        return cls(entries, top_k)
+
+    # Load the saved index if we have one, otherwise build it from the clicks CSV
+    @classmethod
+    def from_file(cls, path, top_k=None):
+        if path.endswith(".csv"):
+            return cls.from_csv(path, top_k)
+        return cls.load(path)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, user_query):
+        return normalize_query(user_query) in self.entries
+
+    # Returns (skus, weights) for the query, or (None, None) if we haven't seen it
+    def get_priors(self, user_query):
+        entry = self.entries.get(normalize_query(user_query))
+        if entry is None:
+            return None, None
+        return entry[0], entry[1]
+
+    # Returns the query_string clause for the query, or "" if we haven't seen it.  Same format as create_prior_queries
+    def get_prior_query(self, user_query):
+        entry = self.entries.get(normalize_query(user_query))
+        if entry is None:
+            return ""
+        return entry[2]
+
+
+# Strings as one utf-8 byte array plus offsets into it, so that we can save them without pickling
+def _pack_strings(strings):
+    encoded = [string.encode("utf-8") for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(string) for string in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
 
-def create_simple_baseline(user_query, click_prior_query, filters, sort="_score", sortDir="desc", size=10, include_aggs=True, highlight=True, source=None):
+
+def _unpack_strings(blob, offsets):
+    data = blob.tobytes()
+    return [data[start:end].decode("utf-8") for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def create_simple_baseline(user_query, click_prior_query, filters, sort="_score", sortDir="desc", size=10, include_aggs=True, highlight=True, source=None, sort_tiebreaker=None, fuzzy=True):
 
     query_obj = {
         'size': size,
@@ -106,6 +226,8 @@ def create_simple_baseline(user_query, click_prior_query, filters, sort="_score"
 
         }
     }
+    if not fuzzy: # leave typos to the spelling corrector instead, see week4/spelling.py
+        query_obj["query"]["bool"]["should"].pop(0) # the fuzzy name match
     if click_prior_query != "":
         query_obj["query"]["bool"]["should"].append({
                         "query_string":{  # This may feel like cheating, but it's really not, esp. in ecommerce where you have all this prior data,  You just can't let the test clicks leak in, which is why we split on date
@@ -122,22 +244,18 @@ def create_simple_baseline(user_query, click_prior_query, filters, sort="_score"
         except:
             pass
     if highlight:
-        query_obj["highlight"] = {
-            "fields": {
-                "name": {},
-                "shortDescription": {},
-                "longDescription": {}
-            }
-        }
+        add_highlight(query_obj)
     if source is not None: # otherwise use the default and retrieve all source
         query_obj["_source"] = source
+    if sort_tiebreaker is not None: # a unique field, so that we can page with search_after
+        query_obj["sort"].append({sort_tiebreaker: {"order": "asc"}})
 
     if include_aggs:
         add_aggs(query_obj)
     return query_obj
 
 # Hardcoded query here.  Better to use search templates or other query config.
-def create_query(user_query, click_prior_query, filters, sort="_score", sortDir="desc", size=10, include_aggs=True, highlight=True, source=None):
+def create_query(user_query, click_prior_query, filters, sort="_score", sortDir="desc", size=10, include_aggs=True, highlight=True, source=None, sort_tiebreaker=None, fuzzy=True):
     query_obj = {
         'size': size,
         "sort":[
@@ -252,6 +370,8 @@ def create_query(user_query, click_prior_query, filters, sort="_score", sortDir=
             }
         }
     }
+    if not fuzzy: # leave typos to the spelling corrector instead, see week4/spelling.py
+        query_obj["query"]["function_score"]["query"]["bool"]["should"].pop(0) # the fuzzy name match
     if click_prior_query != "":
         query_obj["query"]["function_score"]["query"]["bool"]["should"].append({
                         "query_string":{  # This may feel like cheating, but it's really not, esp. in ecommerce where you have all this prior data,  You just can't let the test clicks leak in, which is why we split on date
@@ -266,21 +386,59 @@ def create_query(user_query, click_prior_query, filters, sort="_score", sortDir=
         except:
             print("Couldn't replace query for *")
     if highlight:
-        query_obj["highlight"] = {
-            "fields": {
-                "name": {},
-                "shortDescription": {},
-                "longDescription": {}
-            }
-        }
+        add_highlight(query_obj)
     if source is not None: # otherwise use the default and retrieve all source
         query_obj["_source"] = source
+    if sort_tiebreaker is not None: # a unique field, so that we can page with search_after
+        query_obj["sort"].append({sort_tiebreaker: {"order": "asc"}})
 
     if include_aggs:
         add_aggs(query_obj)
     return query_obj
 
 
+# Fetch the given documents, highlighting them for the user query.  Used to fetch just the page we are displaying after
+# running the (id only) main query.
+def create_ids_query(user_query, ids, highlight=True, source=None):
+    query_obj = {
+        "size": len(ids),
+        "query": {
+            "ids": {
+                "values": ids
+            }
+        }
+    }
+    if highlight and user_query != "*" and user_query != "#":
+        add_highlight(query_obj)
+        # the ids query has nothing to highlight, so tell the highlighter what to look for
+        query_obj["highlight"]["highlight_query"] = {
+            "multi_match": {
+                "query": user_query,
+                "fields": list(HIGHLIGHT_FIELDS.keys())
+            }
+        }
+    if source is not None:
+        query_obj["_source"] = source
+    return query_obj
+
+
+# The fields we highlight and how much of each we show.  bbuy_products.json indexes their offsets, so the unified
+# highlighter can read the offsets from the postings instead of re-analyzing the (long) descriptions for every hit.
+# The results page only shows the first fragment, so that's all we ask for.
+HIGHLIGHT_FIELDS = {
+    "name": {"number_of_fragments": 0},  # names are short, highlight the whole thing
+    "shortDescription": {"fragment_size": 150, "number_of_fragments": 1},
+    "longDescription": {"fragment_size": 200, "number_of_fragments": 1}
+}
+
+
+def add_highlight(query_obj):
+    query_obj["highlight"] = {
+        "type": "unified",
+        "fields": {field: dict(options) for field, options in HIGHLIGHT_FIELDS.items()}
+    }
+
+
 def add_aggs(query_obj):
     query_obj["aggs"] = {
         "department": {
@@ -314,3 +472,165 @@ def add_aggs(query_obj):
         }
 
     }
+
+
+# The name of the sampler aggregation limit_counting puts the facets under
+SAMPLER_AGG = "sample"
+
+
+# Make a query cheaper to count: stop counting hits at track_total_hits (the total in the response is then a lower bound,
+# with relation "gte") and compute the facets over a sample of the shard_size best matching docs on each shard instead of
+# over every match.  With diversify_field, the sample takes at most max_docs_per_value docs with the same value of it, so
+# one department can't crowd the others out of the sample.
+def limit_counting(query_obj, track_total_hits=1000, shard_size=1000, diversify_field=None, max_docs_per_value=100):
+    query_obj["track_total_hits"] = track_total_hits
+    aggs = query_obj.get("aggs")
+    if aggs and shard_size:
+        if diversify_field:
+            sampler = {"diversified_sampler": {"shard_size": shard_size, "field": diversify_field,
+                                               "max_docs_per_value": max_docs_per_value}}
+        else:
+            sampler = {"sampler": {"shard_size": shard_size}}
+        query_obj["aggs"] = {SAMPLER_AGG: dict(sampler, aggs=aggs)}
+    return query_obj
+
+
+# Returns a copy of the response with the facets limit_counting sampled moved back to where add_aggs puts them, and the
+# number of docs in the sample as facets_sample_size.  Other responses are returned as they are.
+def unwrap_sampled_aggs(response):
+    sample = response.get("aggregations", {}).get(SAMPLER_AGG)
+    if sample is None:
+        return response
+    aggs = {name: agg for name, agg in sample.items() if isinstance(agg, dict)}
+    return dict(response, aggregations=aggs, facets_sample_size=sample.get("doc_count", 0))
+
+
+#####
+#
+# Stored search templates.  Rather than sending the whole query body on every request, we store the bodies built by
+# create_simple_baseline/create_query (and the LTR rescore on top of them) in OpenSearch as mustache templates once, and
+# then only send the template id and the parameters.  This also means query changes can be rolled out by updating the
+# stored template, without redeploying the app.
+#
+# We create the templates by running the regular query builders with placeholder values and then swapping the
+# placeholders for mustache tags, so the templates can't drift from the builders.
+#
+#####
+TEMPLATE_QUERY = "__QUERY__"
+TEMPLATE_CLICK_PRIOR = "__CLICK_PRIOR_QUERY__"
+TEMPLATE_FILTERS = "__FILTERS__"
+TEMPLATE_SORT = "__SORT__"
+TEMPLATE_SORT_DIR = "__SORT_DIR__"
+TEMPLATE_SORT_TIEBREAKER = "__SORT_TIEBREAKER__"
+TEMPLATE_SIZE = "__SIZE__"
+TEMPLATE_SOURCE = "__SOURCE__"
+TEMPLATE_LTR_MODEL = "__LTR_MODEL_NAME__"
+TEMPLATE_LTR_STORE = "__LTR_STORE_NAME__"
+TEMPLATE_RESCORE_SIZE = "__RESCORE_SIZE__"
+TEMPLATE_MAIN_QUERY_WEIGHT = "__MAIN_QUERY_WEIGHT__"
+TEMPLATE_RESCORE_QUERY_WEIGHT = "__RESCORE_QUERY_WEIGHT__"
+
+# The models we have templates for and the query builder each one starts from
+TEMPLATE_MODELS = {"simple": "simple_baseline", "hand_tuned": "query", "simple_LTR": "simple_baseline", "ht_LTR": "query"}
+
+
+# The stored template id for a model.  Templates without highlighting or aggregations (what the LTR pipeline uses) get a
+# suffix so both kinds can be stored side by side.
+def get_search_template_id(model, highlight=True, include_aggs=True):
+    template_id = "bbuy_%s" % model
+    if not highlight:
+        template_id += "_nohl"
+    if not include_aggs:
+        template_id += "_noaggs"
+    return template_id
+
+
+# Returns {template id: mustache source} for all TEMPLATE_MODELS.
+# create_rescore_ltr_query is ltr_utils.create_rescore_ltr_query.  We pass it in since the app and the LTR scripts import
+# ltr_utils differently.
+def create_search_templates(create_rescore_ltr_query, highlight=True, include_aggs=True):
+    templates = {}
+    for model, builder in TEMPLATE_MODELS.items():
+        create = create_simple_baseline if builder == "simple_baseline" else create_query
+        query_obj = create(TEMPLATE_QUERY, TEMPLATE_CLICK_PRIOR, TEMPLATE_FILTERS, TEMPLATE_SORT, TEMPLATE_SORT_DIR,
+                           size=TEMPLATE_SIZE, include_aggs=include_aggs, highlight=highlight, source=TEMPLATE_SOURCE,
+                           sort_tiebreaker=TEMPLATE_SORT_TIEBREAKER)
+        if model.endswith("_LTR"):
+            query_obj = create_rescore_ltr_query(TEMPLATE_QUERY, query_obj, TEMPLATE_CLICK_PRIOR, TEMPLATE_LTR_MODEL,
+                                                 TEMPLATE_LTR_STORE, rescore_size=TEMPLATE_RESCORE_SIZE,
+                                                 main_query_weight=TEMPLATE_MAIN_QUERY_WEIGHT,
+                                                 rescore_query_weight=TEMPLATE_RESCORE_QUERY_WEIGHT)
+        templates[get_search_template_id(model, highlight, include_aggs)] = to_mustache(query_obj)
+    return templates
+
+
+# Turn a query built with the TEMPLATE_* placeholders into mustache source
+def to_mustache(query_obj):
+    source = json.dumps(query_obj)
+    # the prior clause is only added to the query when we have priors for it, so make it a conditional section
+    prior_clause = json.dumps({"query_string": {"query": TEMPLATE_CLICK_PRIOR, "fields": ["_id"]}})
+    source = source.replace(", " + prior_clause,
+                            "{{#click_prior_query}}, %s{{/click_prior_query}}" % prior_clause.replace('"%s"' % TEMPLATE_CLICK_PRIOR, '"{{click_prior_query}}"'))
+    # the fuzzy name match can be turned off (see the fuzzy argument to the builders)
+    fuzzy_clause = json.dumps({"match": {"name": {"query": TEMPLATE_QUERY, "fuzziness": "1", "prefix_length": 2, "boost": 0.01}}})
+    source = source.replace(fuzzy_clause + ", ",
+                            "{{#fuzzy}}%s, {{/fuzzy}}" % fuzzy_clause)
+    # as is the search_after tiebreaker
+    tiebreaker = json.dumps({TEMPLATE_SORT_TIEBREAKER: {"order": "asc"}})
+    source = source.replace(", " + tiebreaker,
+                            "{{#sort_tiebreaker}}, %s{{/sort_tiebreaker}}" % tiebreaker.replace(TEMPLATE_SORT_TIEBREAKER, "{{sort_tiebreaker}}"))
+    # JSON values
+    source = source.replace('["%s"]' % TEMPLATE_QUERY, "{{#toJson}}query_terms{{/toJson}}")  # the SKU terms clause
+    source = source.replace('"%s"' % TEMPLATE_FILTERS, "{{#toJson}}filters{{/toJson}}")
+    source = source.replace('"%s"' % TEMPLATE_SOURCE, "{{#toJson}}source{{/toJson}}")
+    # numbers
+    for placeholder, param in [(TEMPLATE_SIZE, "size"), (TEMPLATE_RESCORE_SIZE, "rescore_size"),
+                               (TEMPLATE_MAIN_QUERY_WEIGHT, "main_query_weight"),
+                               (TEMPLATE_RESCORE_QUERY_WEIGHT, "rescore_query_weight")]:
+        source = source.replace('"%s"' % placeholder, "{{%s}}" % param)
+    # strings, which mustache JSON-escapes for us
+    for placeholder, param in [(TEMPLATE_QUERY, "query"), (TEMPLATE_CLICK_PRIOR, "click_prior_query"),
+                               (TEMPLATE_SORT, "sort"), (TEMPLATE_SORT_DIR, "sortDir"),
+                               (TEMPLATE_LTR_MODEL, "ltr_model_name"), (TEMPLATE_LTR_STORE, "ltr_store_name")]:
+        source = source.replace(placeholder, "{{%s}}" % param)
+    return source
+
+
+# The parameters for a stored template created by create_search_templates.  Same arguments as the query builders.
+# "*" (match all) doesn't have a template, use the query builders for it.
+def create_search_template_params(user_query, click_prior_query, filters, sort="_score", sortDir="desc", size=10,
+                                  source=None, ltr_model_name=None, ltr_store_name=None, rescore_size=500,
+                                  main_query_weight=1, rescore_query_weight=2, sort_tiebreaker=None, fuzzy=True):
+    params = {
+        "query": user_query,
+        "query_terms": user_query.split(),
+        "filters": filters if filters is not None else [],
+        "sort": sort,
+        "sortDir": sortDir,
+        "size": size,
+        "source": source if source is not None else True
+    }
+    if click_prior_query:
+        params["click_prior_query"] = click_prior_query
+    if sort_tiebreaker is not None:
+        params["sort_tiebreaker"] = sort_tiebreaker
+    if fuzzy:
+        params["fuzzy"] = True
+    if ltr_model_name is not None:
+        params["ltr_model_name"] = ltr_model_name
+        params["ltr_store_name"] = ltr_store_name
+        params["rescore_size"] = rescore_size
+        params["main_query_weight"] = main_query_weight
+        params["rescore_query_weight"] = rescore_query_weight
+    return params
+
+
+def can_use_search_template(user_query):
+    return user_query != "*" and user_query != "#"
+
+
+# Store (or replace) the templates in OpenSearch
+def put_search_templates(opensearch, templates):
+    for template_id, source in templates.items():
+        print("Storing search template %s" % template_id)
+        opensearch.put_script(id=template_id, body={"script": {"lang": "mustache", "source": source}})
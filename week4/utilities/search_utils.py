@@ -2,8 +2,12 @@
 
 import json
 
-import query_utils as qu
-import ltr_utils as lu
+try:
+    import query_utils as qu
+    import ltr_utils as lu
+except ImportError:  # imported from the app (see search.explain) rather than run from this directory
+    import week4.utilities.query_utils as qu
+    import week4.utilities.ltr_utils as lu
 from opensearchpy import NotFoundError
 import pandas as pd
 import os
@@ -13,14 +17,15 @@ import os
 
 
 def evaluate_test_set(test_data, prior_clicks_df, opensearch, xgb_model_name, ltr_store, index, num_queries=100,
-                      size=500, rescore_size=500, precision=10, main_query_weight=1, rescore_query_weight=2):
+                      size=500, rescore_size=500, precision=10, main_query_weight=1, rescore_query_weight=2,
+                      use_search_templates=False):
     # (ranks_df, features_df) = data_prepper.get_judgments(test_data, True) # judgments as a Pandas DataFrame
     if precision > size:
         print("Precision can't be greater than the fetch size, changing the precision to be same as size")
         precision = size
     test_data = test_data.sample(frac=1).reset_index(drop=True)  # shuffle things
     query_gb = test_data.groupby("query", sort=False) #small
-    prior_clicks_gb = prior_clicks_df.groupby(["query"]) #large
+    prior_index = qu.PriorIndex.from_clicks(prior_clicks_df) #large, so build it once rather than per query
     source = ["sku", "name"]
 
     no_simple = []
@@ -52,42 +57,51 @@ def evaluate_test_set(test_data, prior_clicks_df, opensearch, xgb_model_name, lt
         # this is the set of skus that were clicked w/o dupes
         # since we are using prior clicks to learn from and boost, we cannot use them for judgment
         test_skus_for_query = test_clicks_for_query.sku.drop_duplicates()
-        prior_doc_ids = None
-        prior_doc_id_weights = None
-        query_times_seen = 0 # careful here
-        prior_clicks_for_query = None
-        seen = False
-        try:
-            prior_clicks_for_query = prior_clicks_gb.get_group(key)
-            if prior_clicks_for_query is not None and len(prior_clicks_for_query) > 0:
-                prior_doc_ids = prior_clicks_for_query.sku.drop_duplicates()
-                prior_doc_id_weights = prior_clicks_for_query.sku.value_counts() # histogram gives us the click counts for all the doc_ids
-                query_times_seen = prior_clicks_for_query.sku.count()
-                seen = True
-        except KeyError as ke:
-            # nothing to do here, we just haven't seen this query before in our training set
-            pass
-
-        click_prior_query = qu.create_prior_queries(prior_doc_ids, prior_doc_id_weights, query_times_seen)
-        simple_query_obj = qu.create_simple_baseline(key, click_prior_query, filters=None, size=size, highlight=False, include_aggs=False, source=source)
-        # don't care about no results here
-        __judge_hits(test_skus_for_query, index, key, no_simple, opensearch, simple_query_obj, "simple", results, seen)
-        # Run hand-tuned
-        hand_tuned_query_obj = qu.create_query(key, click_prior_query, filters=None, size=size, highlight=False, include_aggs=False, source=source)
-
-        __judge_hits(test_skus_for_query, index, key, no_hand_tuned, opensearch, hand_tuned_query_obj, "hand_tuned", results, seen)
+        # empty if we haven't seen this query before in our training set
+        click_prior_query = prior_index.get_prior_query(key)
+        seen = click_prior_query != ""
+        if use_search_templates and qu.can_use_search_template(key):
+            query_objs = __create_search_template_requests(key, click_prior_query, size, source, xgb_model_name, ltr_store,
+                                                           rescore_size, main_query_weight, rescore_query_weight)
+        else:
+            query_objs = __create_query_objs(key, click_prior_query, size, source, xgb_model_name, ltr_store,
+                                             rescore_size, main_query_weight, rescore_query_weight)
         # NOTE: very important, we cannot look at the test set for click weights, but we can look at the train set.
-
-        ltr_simple_query_obj = lu.create_rescore_ltr_query(key, simple_query_obj, click_prior_query, xgb_model_name, ltr_store, rescore_size=rescore_size,
-                                                           main_query_weight=main_query_weight, rescore_query_weight=rescore_query_weight)
-        __judge_hits(test_skus_for_query, index, key, no_ltr_simple, opensearch, ltr_simple_query_obj, "ltr_simple", results, seen)
-        ltr_hand_query_obj = lu.create_rescore_ltr_query(key, hand_tuned_query_obj, click_prior_query, xgb_model_name, ltr_store,
-                                                         rescore_size=rescore_size, main_query_weight=main_query_weight, rescore_query_weight=rescore_query_weight)
-        __judge_hits(test_skus_for_query, index, key, no_ltr_hand_tuned, opensearch, ltr_hand_query_obj, "ltr_hand_tuned", results, seen)
+        for query_type, query_obj in query_objs:
+            # don't care about no results here
+            __judge_hits(test_skus_for_query, index, key, no_results[query_type], opensearch, query_obj, query_type, results, seen)
 
     return pd.DataFrame(results), no_results
 
 
+# The (type, query) pairs we evaluate for each test query: simple, hand tuned and LTR rescoring of each
+def __create_query_objs(key, click_prior_query, size, source, xgb_model_name, ltr_store, rescore_size, main_query_weight,
+                        rescore_query_weight):
+    simple_query_obj = qu.create_simple_baseline(key, click_prior_query, filters=None, size=size, highlight=False, include_aggs=False, source=source)
+    hand_tuned_query_obj = qu.create_query(key, click_prior_query, filters=None, size=size, highlight=False, include_aggs=False, source=source)
+    ltr_simple_query_obj = qu.create_simple_baseline(key, click_prior_query, filters=None, size=size, highlight=False, include_aggs=False, source=source)
+    ltr_simple_query_obj = lu.create_rescore_ltr_query(key, ltr_simple_query_obj, click_prior_query, xgb_model_name, ltr_store, rescore_size=rescore_size,
+                                                       main_query_weight=main_query_weight, rescore_query_weight=rescore_query_weight)
+    ltr_hand_query_obj = qu.create_query(key, click_prior_query, filters=None, size=size, highlight=False, include_aggs=False, source=source)
+    ltr_hand_query_obj = lu.create_rescore_ltr_query(key, ltr_hand_query_obj, click_prior_query, xgb_model_name, ltr_store,
+                                                     rescore_size=rescore_size, main_query_weight=main_query_weight, rescore_query_weight=rescore_query_weight)
+    return [("simple", simple_query_obj), ("hand_tuned", hand_tuned_query_obj), ("ltr_simple", ltr_simple_query_obj),
+            ("ltr_hand_tuned", ltr_hand_query_obj)]
+
+
+# Same as __create_query_objs, but for the stored templates uploaded with build_ltr.py --upload_search_templates
+def __create_search_template_requests(key, click_prior_query, size, source, xgb_model_name, ltr_store, rescore_size,
+                                      main_query_weight, rescore_query_weight):
+    template_requests = []
+    for query_type, model in [("simple", "simple"), ("hand_tuned", "hand_tuned"), ("ltr_simple", "simple_LTR"), ("ltr_hand_tuned", "ht_LTR")]:
+        params = qu.create_search_template_params(key, click_prior_query, None, size=size, source=source,
+                                                  ltr_model_name=xgb_model_name, ltr_store_name=ltr_store,
+                                                  rescore_size=rescore_size, main_query_weight=main_query_weight,
+                                                  rescore_query_weight=rescore_query_weight)
+        template_requests.append((query_type, {"id": qu.get_search_template_id(model, highlight=False, include_aggs=False), "params": params}))
+    return template_requests
+
+
 def write_diffs(to_compare_set, to_compare_results, ltr_results, ltr_set, od):
     diff = to_compare_set.symmetric_difference(ltr_set)
     if len(diff) > 0:
@@ -112,7 +126,10 @@ def write_diffs(to_compare_set, to_compare_results, ltr_results, ltr_set, od):
 # ranking
 def __judge_hits(all_skus_for_query, index, key, no_results, opensearch, query_object, query_type, results, seen):
     try:
-        response = opensearch.search(body=query_object, index=index)
+        if "id" in query_object:  # a stored search template request
+            response = opensearch.search_template(body=query_object, index=index)
+        else:
+            response = opensearch.search(body=query_object, index=index)
     except Exception as re:
         print(re, query_object)
     else:
@@ -204,18 +221,19 @@ def analyze_results(results_df, no_results_df, new_queries_df, opensearch, index
     ltr_ht_top_20 = ltr_ht_better[ltr_ht_better["rank_ltr"] < 20]
     ltr_ht_top_20.to_csv("%s/ht_ltr_better_r20.csv" % analysis_output_dir, index=False)
     if analyze_explains:
-        train_gb = train_df.groupby("query")
+        prior_index = qu.PriorIndex.from_clicks(train_df)
         print("Comparing simple vs LTR explains")
-        simple_ltr_explains = compare_explains(simple_better, "ltr_simple", opensearch, index, ltr_model_name, ltr_store_name, train_gb, max_explains)
+        simple_ltr_explains = compare_explains(simple_better, "ltr_simple", opensearch, index, ltr_model_name, ltr_store_name, prior_index, max_explains)
         simple_ltr_explains.to_csv("%s/analysis/simple_ltr_explains.csv" % output_dir, index=False)
         print("Comparing hand tuned vs LTR explains")
-        ht_ltr_explains = compare_explains(ht_better, "ltr_hand_tuned", opensearch, index, ltr_model_name, ltr_store_name, train_gb, max_explains)
+        ht_ltr_explains = compare_explains(ht_better, "ltr_hand_tuned", opensearch, index, ltr_model_name, ltr_store_name, prior_index, max_explains)
         ht_ltr_explains.to_csv("%s/analysis/hand_tuned_ltr_explains.csv" % output_dir, index=False)
 
 
 # loop through, run the explain and extract the scores
 # The dataframe is a joined one
-def compare_explains(join, type, opensearch, index, ltr_model_name, ltr_store_name, train_gb, max_explains=100):
+# prior_index is a query_utils.PriorIndex built from the training clicks
+def compare_explains(join, type, opensearch, index, ltr_model_name, ltr_store_name, prior_index, max_explains=100):
 
     query = []
     sku = []
@@ -228,16 +246,7 @@ def compare_explains(join, type, opensearch, index, ltr_model_name, ltr_store_na
             print("Progress[%s]: %s" % (ctr, item.query))
         if max_explains == ctr:
             break
-        click_prior_query = ""
-        try:
-            prior_clicks_for_query = train_gb.get_group(item.query)
-            if prior_clicks_for_query is not None and len(prior_clicks_for_query) > 0:
-                prior_doc_ids = prior_clicks_for_query.sku.drop_duplicates()
-                prior_doc_id_weights = prior_clicks_for_query.sku.value_counts() # histogram gives us the click counts for all the doc_ids
-                query_times_seen = prior_clicks_for_query.sku.count()
-                click_prior_query = qu.create_prior_queries(prior_doc_ids, prior_doc_id_weights, query_times_seen)
-        except KeyError as ke:
-            pass #just means we can't find this query in the priors, which is OK
+        click_prior_query = prior_index.get_prior_query(item.query) # empty just means we can't find this query in the priors, which is OK
 
         query_obj, num_shoulds = get_explain_query_for_type(item.query, type, click_prior_query, ltr_model_name, ltr_store_name)
         if click_prior_query is None or click_prior_query == '':
@@ -293,15 +302,20 @@ def get_feat_names(details):
         break
     return feat_names
 
-def get_explain_query_for_type(query, type, click_prior_query, ltr_model_name, ltr_store_name):
+# type is ltr_simple or ltr_hand_tuned, or simple or hand_tuned for the queries without the LTR model
+def get_explain_query_for_type(query, type, click_prior_query, ltr_model_name, ltr_store_name, fuzzy=True):
     num_shoulds = 0
     qo = None
     if type == "ltr_simple":
-        qo = qu.create_simple_baseline(query, click_prior_query, None, include_aggs=False, highlight=False)
+        qo = qu.create_simple_baseline(query, click_prior_query, None, include_aggs=False, highlight=False, fuzzy=fuzzy)
         qo, num_shoulds = lu.create_sltr_simple_query(query, qo, click_prior_query, ltr_model_name, ltr_store_name)
     elif type == "ltr_hand_tuned":
-        qo = qu.create_query(query, click_prior_query, None, include_aggs=False, highlight=False)
+        qo = qu.create_query(query, click_prior_query, None, include_aggs=False, highlight=False, fuzzy=fuzzy)
         qo, num_shoulds = lu.create_sltr_hand_tuned_query(query, qo, click_prior_query, ltr_model_name, ltr_store_name)
+    elif type == "simple":
+        qo = qu.create_simple_baseline(query, click_prior_query, None, include_aggs=False, highlight=False, fuzzy=fuzzy)
+    elif type == "hand_tuned":
+        qo = qu.create_query(query, click_prior_query, None, include_aggs=False, highlight=False, fuzzy=fuzzy)
     try:
         qo.pop("size")
     except:
@@ -324,29 +338,28 @@ def lookup_product(sku, opensearch, index="bbuy_products", source=None):
         return None
 
 
-def lookup_query(query, all_clicks_df, opensearch, explain=False, index="bbuy_products", source=None):
-    gb = all_clicks_df.groupby("query")
-    if gb is not None:
-        click_group = gb.get_group(query)
-        if len(click_group) > 0:
-            print("Query: %s has %s clicked docs" % (query, len(click_group)))
-            for item in click_group.itertuples():
-                sku = item.sku
-                try:
-                    doc = lookup_product(sku, opensearch, index=index, source=source)
-                except NotFoundError as ne:
-                    print("Couldn't find doc: %s" % sku)
-                else:
-                    print(json.dumps(doc, indent=4))
-                    if explain:
-                        query_obj = qu.create_query(query, None, include_aggs=False, highlight=False, source=source)
-                        query_obj.pop("size")
-                        query_obj.pop("sort")
-                        query_obj.pop("_source")
-                        print("Explain query %s" % query_obj)
-                        response = opensearch.explain(index, sku, body=query_obj)
-                        print(json.dumps(response, indent=4))
-                    
+# all_clicks may be the raw clicks DataFrame or a query_utils.PriorIndex that has already been built from it
+def lookup_query(query, all_clicks, opensearch, explain=False, index="bbuy_products", source=None):
+    prior_index = all_clicks if isinstance(all_clicks, qu.PriorIndex) else qu.PriorIndex.from_clicks(all_clicks)
+    skus, weights = prior_index.get_priors(query)
+    if skus is not None and len(skus) > 0:
+        print("Query: %s has %s clicked docs" % (query, len(skus)))
+        for sku in skus:
+            try:
+                doc = lookup_product(sku, opensearch, index=index, source=source)
+            except NotFoundError as ne:
+                print("Couldn't find doc: %s" % sku)
+            else:
+                print(json.dumps(doc, indent=4))
+                if explain:
+                    query_obj = qu.create_query(query, None, include_aggs=False, highlight=False, source=source)
+                    query_obj.pop("size")
+                    query_obj.pop("sort")
+                    query_obj.pop("_source")
+                    print("Explain query %s" % query_obj)
+                    response = opensearch.explain(index, sku, body=query_obj)
+                    print(json.dumps(response, indent=4))
                 
-        else:
-            print("No clicks for query %s" % query)
\ No newline at end of file
+            
+    else:
+        print("No clicks for query %s" % query)
\ No newline at end of file